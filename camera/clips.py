@@ -0,0 +1,190 @@
+"""
+Short clips around high-threat tracks, cut from the encoded video without re-encoding.
+
+The track timeline from detect_objects gives the seconds each boat, drone or
+mines track is visible. Those intervals are padded, merged when they overlap or
+sit close together, widened to the surrounding keyframes and cut with ffmpeg
+stream copy, so a clip costs a file copy rather than an encode. The main MP4
+has a keyframe every SEGMENT_SECONDS (see build_encode_command), so the cuts
+land within that of the tracks. A clip index next to the clips lists what each
+one contains.
+
+    # Post-pass on outputs already copied to processed_output
+    python clips.py processed_output/clip_detected.mp4 processed_output/clip_detections.json
+"""
+
+import argparse
+import json
+import os
+import shutil
+import subprocess
+from bisect import bisect_left, bisect_right
+from collections import Counter
+from typing import Any, Dict, List, Optional
+
+from threat_classes import HIGH_THREAT_CLASSES
+
+# Seconds of context kept before and after each track
+CLIP_PAD_SECONDS = float(os.getenv("CLIP_PAD_SECONDS", "2"))
+# Incidents closer than this are cut as one clip
+CLIP_MERGE_GAP_SECONDS = float(os.getenv("CLIP_MERGE_GAP_SECONDS", "4"))
+# Tracks shorter than this (flicker) do not get a clip of their own
+CLIP_MIN_TRACK_SECONDS = float(os.getenv("CLIP_MIN_TRACK_SECONDS", "0.5"))
+
+
+def threat_intervals(tracks: List[Dict[str, Any]], duration: float, classes=HIGH_THREAT_CLASSES,
+                     pad: float = CLIP_PAD_SECONDS, merge_gap: float = CLIP_MERGE_GAP_SECONDS,
+                     min_track: float = CLIP_MIN_TRACK_SECONDS) -> List[Dict[str, Any]]:
+    """
+    Merge the padded time ranges of high-threat tracks into incidents.
+
+    Args:
+        tracks: Track records with class_name, start_s, end_s, tracker_id and max_confidence
+        duration: Video length in seconds
+        classes: Class names (case-insensitive) that get clips
+        pad: Seconds added before and after each track
+        merge_gap: Incidents separated by less than this are merged
+        min_track: Shorter tracks are skipped
+
+    Returns:
+        Incidents sorted by start time, each with start_s, end_s, first_seen_s, tracks,
+        classes and max_confidence
+    """
+    selected = sorted(
+        (track for track in tracks
+         if track["class_name"].casefold() in classes and track["end_s"] - track["start_s"] >= min_track),
+        key=lambda track: track["start_s"])
+
+    incidents = []
+    for track in selected:
+        start = max(0.0, track["start_s"] - pad)
+        end = min(duration, track["end_s"] + pad)
+        if incidents and start - incidents[-1]["end_s"] < merge_gap:
+            incident = incidents[-1]
+            incident["end_s"] = max(incident["end_s"], end)
+        else:
+            incident = {"start_s": start, "end_s": end, "first_seen_s": track["start_s"], "tracks": [],
+                        "classes": Counter(), "max_confidence": 0.0}
+            incidents.append(incident)
+        incident["tracks"].append(track["tracker_id"])
+        incident["classes"][track["class_name"]] += 1
+        incident["max_confidence"] = max(incident["max_confidence"], track.get("max_confidence", 0.0))
+
+    for incident in incidents:
+        incident["classes"] = dict(incident["classes"])
+    return incidents
+
+
+def keyframe_times(video_path: str, ffprobe: str = "ffprobe") -> List[float]:
+    """Keyframe timestamps of the first video stream, read from packet flags without decoding"""
+    result = subprocess.run(
+        [ffprobe, "-v", "error", "-select_streams", "v:0", "-show_entries", "packet=pts_time,flags",
+         "-of", "csv=p=0", video_path], check=True, capture_output=True, text=True)
+    times = []
+    for line in result.stdout.splitlines():
+        pts, _, flags = line.partition(",")
+        if "K" in flags and pts not in ("", "N/A"):
+            times.append(float(pts))
+    return sorted(times)
+
+
+def snap_to_keyframes(start: float, end: float, keyframes: List[float], duration: float):
+    """Widen [start, end] to the keyframe at or before start and the one at or after end"""
+    first = keyframes[max(0, bisect_right(keyframes, start + 1e-3) - 1)] if keyframes else 0.0
+    index = bisect_left(keyframes, end - 1e-3)
+    last = keyframes[index] if index < len(keyframes) else duration
+    return first, max(last, first)
+
+
+def build_clip_command(video_path: str, start: float, end: float, output_path: str, ffmpeg: str = "ffmpeg"):
+    """Stream-copy [start, end) of the video; start must be a keyframe"""
+    return [
+        ffmpeg, "-y", "-v", "error",
+        # Input seeking with stream copy starts at the keyframe at or before -ss
+        "-ss", f"{start:.3f}", "-i", video_path, "-t", f"{end - start:.3f}",
+        "-map", "0", "-c", "copy", "-avoid_negative_ts", "make_zero", "-movflags", "+faststart",
+        output_path,
+    ]
+
+
+def extract_clips(video_path: str, tracks: List[Dict[str, Any]], output_dir: str, base_name: str,
+                  duration: float, ffmpeg: str = "ffmpeg", ffprobe: str = "ffprobe") -> Optional[Dict[str, Any]]:
+    """
+    Cut one clip per high-threat incident and write the clip index.
+
+    Clips go to {base_name}_clips/ and the index to {base_name}_clips.json in output_dir.
+
+    Returns:
+        The clip index (paths relative to output_dir), or None when there are no high-threat tracks
+    """
+    incidents = threat_intervals(tracks, duration)
+    if not incidents:
+        return None
+
+    clip_dir = f"{base_name}_clips"
+    # Clips from an earlier run of the same video would otherwise linger in the index directory
+    shutil.rmtree(os.path.join(output_dir, clip_dir), ignore_errors=True)
+    os.makedirs(os.path.join(output_dir, clip_dir))
+    keyframes = keyframe_times(video_path, ffprobe)
+
+    clips = []
+    for number, incident in enumerate(incidents, 1):
+        start, end = snap_to_keyframes(incident["start_s"], incident["end_s"], keyframes, duration)
+        name = f"{clip_dir}/incident_{number:02d}.mp4"
+        subprocess.run(build_clip_command(video_path, start, end, os.path.join(output_dir, name), ffmpeg),
+                       check=True, capture_output=True, text=True)
+        clips.append({
+            "file": name,
+            "start_s": round(start, 3),
+            "end_s": round(end, 3),
+            "duration_s": round(end - start, 3),
+            "bytes": os.path.getsize(os.path.join(output_dir, name)),
+            "classes": incident["classes"],
+            "tracks": incident["tracks"],
+            "max_confidence": round(incident["max_confidence"], 4),
+            # Offset of the first sighting inside the clip, for players that seek to it
+            "first_seen_s": round(incident["first_seen_s"] - start, 3),
+        })
+
+    source_bytes = os.path.getsize(video_path)
+    clip_bytes = sum(clip["bytes"] for clip in clips)
+    index = {
+        "source": os.path.basename(video_path),
+        "source_bytes": source_bytes,
+        "source_duration_s": round(duration, 3),
+        "clip_bytes": clip_bytes,
+        "clip_duration_s": round(sum(clip["duration_s"] for clip in clips), 3),
+        "clips": clips,
+    }
+    with open(os.path.join(output_dir, f"{base_name}_clips.json"), "w") as f:
+        json.dump(index, f, indent=2)
+    return index
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Cut stream-copied clips around high-threat tracks")
+    parser.add_argument("video", help="Encoded video (e.g. processed_output/<name>_detected.mp4)")
+    parser.add_argument("detections", help="Detection summary JSON with a tracks list")
+    parser.add_argument("--output-dir", help="Where to write the clips (default: next to the video)")
+    parser.add_argument("--ffmpeg", default="ffmpeg")
+    parser.add_argument("--ffprobe", default="ffprobe")
+    args = parser.parse_args()
+
+    with open(args.detections) as f:
+        summary = json.load(f)
+    info = summary["video_info"]
+    duration = info["processed_frames"] / info["fps"] if info.get("fps") else 0.0
+    output_dir = args.output_dir or os.path.dirname(os.path.abspath(args.video))
+    base_name = os.path.basename(args.video).rsplit("_detected", 1)[0].rsplit(".", 1)[0]
+
+    index = extract_clips(args.video, summary.get("tracks", []), output_dir, base_name, duration,
+                          args.ffmpeg, args.ffprobe)
+    if index is None:
+        print("No high-threat tracks; no clips written")
+    else:
+        for clip in index["clips"]:
+            classes = ", ".join(f"{count} {name}" for name, count in clip["classes"].items())
+            print(f"{clip['file']}: {clip['start_s']:.1f}-{clip['end_s']:.1f}s, {clip['bytes']} bytes ({classes})")
+        print(f"{len(index['clips'])} clips, {index['clip_duration_s']:.1f}s of {index['source_duration_s']:.1f}s, "
+              f"{index['clip_bytes']} of {index['source_bytes']} bytes "
+              f"({index['clip_bytes'] / index['source_bytes']:.0%})")
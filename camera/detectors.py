@@ -0,0 +1,480 @@
+"""
+Object detectors behind one interface, so the same tracking code runs on a GPU
+(PyTorch) or on CPU-only edge sites (ONNX Runtime or OpenVINO, optionally INT8).
+
+A detector is called with a BGR frame and returns sv.Detections; `batch` takes
+a list of frames (from any number of streams) and returns one sv.Detections per
+frame. `names` maps class ids to class names.
+
+    # Export yolov8x.pt to ONNX, plus an INT8 copy calibrated on frames from test_videos
+    python detectors.py export --model yolov8x.pt --int8 --videos ../test_videos
+
+    # Accuracy (agreement with PyTorch), per-frame latency and memory per backend
+    python detectors.py compare --model yolov8x.pt --videos ../test_videos \\
+        --candidate onnx:yolov8x.onnx --candidate onnx:yolov8x.int8.onnx \\
+        --candidate openvino:yolov8x.int8.onnx
+
+    # Detect and track a video on CPU, writing a detection summary
+    python detectors.py run ../test_videos/harbor.mp4 --backend onnx --model yolov8x.int8.onnx
+"""
+
+import argparse
+import ast
+import json
+import os
+import re
+import resource
+import tempfile
+import time
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from typing import Dict, List, Optional
+
+import cv2
+import numpy as np
+import supervision as sv
+
+DETECTOR_BACKEND = os.getenv("DETECTOR_BACKEND", "torch")
+DETECTOR_MODEL = os.getenv("DETECTOR_MODEL", "yolov8x.pt")
+# Intra-op threads for the CPU runtimes; physical cores usually beat logical ones
+DETECTOR_THREADS = int(os.getenv("DETECTOR_THREADS", max(1, (os.cpu_count() or 2) // 2)))
+IMAGE_SIZE = 640
+CONFIDENCE = 0.25
+IOU = 0.7
+MAX_DETECTIONS = 300
+VIDEO_EXTENSIONS = ('.mp4', '.avi', '.mov')
+
+
+class TorchDetector:
+    """The PyTorch model through ultralytics (GPU when available)"""
+
+    def __init__(self, model_path: str = DETECTOR_MODEL, device: Optional[str] = None,
+                 threads: Optional[int] = None):
+        from ultralytics import YOLO
+
+        if threads:
+            import torch
+
+            # Only matters on CPU; lets comparisons use the same thread count
+            torch.set_num_threads(threads)
+        self.model = YOLO(model_path)
+        self.device = device
+        self.names = self.model.names
+
+    def __call__(self, frame: np.ndarray) -> sv.Detections:
+        results = self.model(frame, device=self.device, verbose=False)[0]
+        return sv.Detections.from_ultralytics(results)
+
+    def batch(self, frames: List[np.ndarray]) -> List[sv.Detections]:
+        """One forward pass over all frames"""
+        results = self.model(frames, device=self.device, verbose=False)
+        return [sv.Detections.from_ultralytics(result) for result in results]
+
+
+class _ExportedDetector:
+    """Letterbox pre-processing and YOLOv8 post-processing shared by the CPU runtimes"""
+
+    def __init__(self, model_path: str, image_size: int = IMAGE_SIZE):
+        self.model_path = model_path
+        self.image_size = image_size
+        self.names = read_names(model_path)
+
+    def preprocess(self, frame: np.ndarray):
+        height, width = frame.shape[:2]
+        scale = min(self.image_size / height, self.image_size / width)
+        resized_w, resized_h = round(width * scale), round(height * scale)
+        pad_x, pad_y = (self.image_size - resized_w) / 2, (self.image_size - resized_h) / 2
+        if (resized_w, resized_h) != (width, height):
+            frame = cv2.resize(frame, (resized_w, resized_h), interpolation=cv2.INTER_LINEAR)
+        top, left = round(pad_y - 0.1), round(pad_x - 0.1)
+        frame = cv2.copyMakeBorder(frame, top, self.image_size - resized_h - top, left,
+                                   self.image_size - resized_w - left, cv2.BORDER_CONSTANT, value=(114, 114, 114))
+        blob = cv2.dnn.blobFromImage(frame, 1 / 255.0, swapRB=True)
+        return blob, scale, (left, top)
+
+    def postprocess(self, output: np.ndarray, scale: float, pad, shape) -> sv.Detections:
+        # (1, 4 + classes, anchors) -> (anchors, 4 + classes)
+        predictions = output[0].T
+        class_scores = predictions[:, 4:]
+        class_ids = class_scores.argmax(axis=1)
+        confidences = class_scores[np.arange(len(class_ids)), class_ids]
+        keep = confidences >= CONFIDENCE
+        if not keep.any():
+            return sv.Detections.empty()
+        boxes, confidences, class_ids = predictions[keep, :4], confidences[keep], class_ids[keep]
+
+        xywh = boxes.copy()
+        xywh[:, 0] -= xywh[:, 2] / 2
+        xywh[:, 1] -= xywh[:, 3] / 2
+        indices = cv2.dnn.NMSBoxesBatched(xywh.tolist(), confidences.tolist(), class_ids.tolist(),
+                                          CONFIDENCE, IOU, top_k=MAX_DETECTIONS)
+        indices = np.array(indices, dtype=int).reshape(-1)[:MAX_DETECTIONS]
+
+        xyxy = np.empty((len(indices), 4), dtype=np.float32)
+        xyxy[:, 0] = (xywh[indices, 0] - pad[0]) / scale
+        xyxy[:, 1] = (xywh[indices, 1] - pad[1]) / scale
+        xyxy[:, 2] = xyxy[:, 0] + xywh[indices, 2] / scale
+        xyxy[:, 3] = xyxy[:, 1] + xywh[indices, 3] / scale
+        xyxy[:, [0, 2]] = xyxy[:, [0, 2]].clip(0, shape[1])
+        xyxy[:, [1, 3]] = xyxy[:, [1, 3]].clip(0, shape[0])
+        return sv.Detections(xyxy=xyxy, confidence=confidences[indices].astype(np.float32),
+                             class_id=class_ids[indices].astype(int))
+
+    def __call__(self, frame: np.ndarray) -> sv.Detections:
+        blob, scale, pad = self.preprocess(frame)
+        return self.postprocess(self.infer(blob), scale, pad, frame.shape)
+
+    def batch(self, frames: List[np.ndarray]) -> List[sv.Detections]:
+        # Exports have a static batch of one; CPU throughput comes from intra-op threads
+        return [self(frame) for frame in frames]
+
+    def infer(self, blob: np.ndarray) -> np.ndarray:
+        raise NotImplementedError
+
+
+class OnnxDetector(_ExportedDetector):
+    """ONNX Runtime on CPU with a fixed intra-op thread pool"""
+
+    def __init__(self, model_path: str, threads: int = DETECTOR_THREADS, image_size: int = IMAGE_SIZE):
+        import onnxruntime as ort
+
+        super().__init__(model_path, image_size)
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = threads
+        # One frame at a time: parallelism comes from inside each operator
+        options.inter_op_num_threads = 1
+        options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(model_path, options, providers=["CPUExecutionProvider"])
+        self.input_name = self.session.get_inputs()[0].name
+
+    def infer(self, blob):
+        return self.session.run(None, {self.input_name: blob})[0]
+
+
+class OpenVinoDetector(_ExportedDetector):
+    """OpenVINO on CPU; reads the same ONNX file, including INT8 (QDQ) exports"""
+
+    def __init__(self, model_path: str, threads: int = DETECTOR_THREADS, image_size: int = IMAGE_SIZE):
+        import openvino as ov
+
+        super().__init__(model_path, image_size)
+        self.compiled = ov.Core().compile_model(model_path, "CPU", {
+            "INFERENCE_NUM_THREADS": threads,
+            "PERFORMANCE_HINT": "LATENCY",
+        })
+        self.request = self.compiled.create_infer_request()
+
+    def infer(self, blob):
+        self.request.infer({0: blob})
+        return self.request.get_output_tensor(0).data
+
+
+DETECTORS = {
+    "torch": TorchDetector,
+    "onnx": OnnxDetector,
+    "openvino": OpenVinoDetector,
+}
+
+
+def load_detector(backend: str = DETECTOR_BACKEND, model_path: str = DETECTOR_MODEL,
+                  threads: int = DETECTOR_THREADS):
+    """
+    Create a detector.
+
+    Args:
+        backend: "torch", "onnx" or "openvino"
+        model_path: .pt weights for torch, an exported .onnx file otherwise
+        threads: Intra-op threads for the CPU runtimes
+
+    Returns:
+        A callable frame -> sv.Detections with a `names` mapping
+    """
+    if backend not in DETECTORS:
+        raise ValueError(f"Unknown detector backend {backend!r}; choose from {sorted(DETECTORS)}")
+    if backend == "torch":
+        return TorchDetector(model_path, threads=threads)
+    return DETECTORS[backend](model_path, threads)
+
+
+def read_names(onnx_path: str) -> Dict[int, str]:
+    """Class names stored in the ONNX metadata by the ultralytics exporter"""
+    import onnx
+
+    model = onnx.load(onnx_path, load_external_data=False)
+    for prop in model.metadata_props:
+        if prop.key == "names":
+            return {int(key): value for key, value in ast.literal_eval(prop.value).items()}
+    raise ValueError(f"{onnx_path} has no class names in its metadata; export it with ultralytics")
+
+
+def sample_frames(video_paths: List[str], per_video: int = 32) -> List[np.ndarray]:
+    """Evenly spaced frames from each video, for calibration and comparisons"""
+    frames = []
+    for path in video_paths:
+        cap = cv2.VideoCapture(path)
+        total = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        for index in np.linspace(0, max(total - 1, 0), per_video).astype(int):
+            cap.set(cv2.CAP_PROP_POS_FRAMES, int(index))
+            ok, frame = cap.read()
+            if ok:
+                frames.append(frame)
+        cap.release()
+    return frames
+
+
+def video_files(video_dir: str) -> List[str]:
+    return sorted(os.path.join(video_dir, f) for f in os.listdir(video_dir) if f.endswith(VIDEO_EXTENSIONS))
+
+
+def export_onnx(model_path: str, image_size: int = IMAGE_SIZE) -> str:
+    """Export PyTorch weights to ONNX (static 1x3xSxS input, class names in the metadata)"""
+    from ultralytics import YOLO
+
+    return YOLO(model_path).export(format="onnx", imgsz=image_size, dynamic=False, simplify=False)
+
+
+def quantize_int8(onnx_path: str, frames: List[np.ndarray], output_path: Optional[str] = None) -> str:
+    """
+    Statically quantize an exported model to INT8, calibrated on real frames.
+
+    Weights are quantized per channel. The detection head stays in float because
+    its box regression and class scores lose the most accuracy in INT8.
+
+    Returns:
+        Path of the quantized model
+    """
+    import onnx
+    from onnxruntime.quantization import (CalibrationDataReader, QuantFormat, QuantType,
+                                          quantize_static)
+    from onnxruntime.quantization.shape_inference import quant_pre_process
+
+    output_path = output_path or onnx_path.replace(".onnx", ".int8.onnx")
+    detector = _ExportedDetector(onnx_path)
+    model = onnx.load(onnx_path)
+    input_name = model.graph.input[0].name
+
+    # Nodes are named /model.<layer>/...; the last layer is the Detect head
+    layers = [int(m.group(1)) for node in model.graph.node for m in [re.match(r"/model\.(\d+)/", node.name)] if m]
+    head = f"/model.{max(layers)}/" if layers else None
+    excluded = [node.name for node in model.graph.node if head and node.name.startswith(head)]
+
+    class FrameReader(CalibrationDataReader):
+        def __init__(self):
+            self.blobs = iter([{input_name: detector.preprocess(frame)[0]} for frame in frames])
+
+        def get_next(self):
+            return next(self.blobs, None)
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        prepared = os.path.join(temp_dir, "prepared.onnx")
+        quant_pre_process(onnx_path, prepared, skip_symbolic_shape=True)
+        quantize_static(prepared, output_path, FrameReader(), quant_format=QuantFormat.QDQ,
+                        per_channel=True, activation_type=QuantType.QUInt8, weight_type=QuantType.QInt8,
+                        nodes_to_exclude=excluded)
+
+    # Keep the exporter's metadata (class names, image size) on the quantized copy
+    quantized = onnx.load(output_path)
+    del quantized.metadata_props[:]
+    quantized.metadata_props.extend(model.metadata_props)
+    onnx.save(quantized, output_path)
+    return output_path
+
+
+def _benchmark(backend: str, model_path: str, frames_path: str, threads: int, warmup: int = 3) -> Dict:
+    """Run one backend over the sample frames (in its own process, so memory is its own)"""
+    with np.load(frames_path) as data:
+        frames = [data[f"arr_{index}"] for index in range(len(data.files))]
+    started = time.perf_counter()
+    detector = load_detector(backend, model_path, threads)
+    load_s = time.perf_counter() - started
+    for frame in frames[:warmup]:
+        detector(frame)
+    latencies, detections = [], []
+    for frame in frames:
+        started = time.perf_counter()
+        result = detector(frame)
+        latencies.append((time.perf_counter() - started) * 1000)
+        detections.append((result.xyxy.tolist(), result.class_id.tolist()))
+    latencies.sort()
+    return {
+        "load_s": load_s,
+        "p50_ms": latencies[len(latencies) // 2],
+        "p95_ms": latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))],
+        # Peak resident memory of the process, in MB (ru_maxrss is in KB on Linux)
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "detections": detections,
+    }
+
+
+def _iou(box, boxes):
+    x1 = np.maximum(box[0], boxes[:, 0])
+    y1 = np.maximum(box[1], boxes[:, 1])
+    x2 = np.minimum(box[2], boxes[:, 2])
+    y2 = np.minimum(box[3], boxes[:, 3])
+    intersection = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+    area = (box[2] - box[0]) * (box[3] - box[1])
+    areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    return intersection / np.maximum(area + areas - intersection, 1e-9)
+
+
+def agreement(reference, candidate, iou_threshold: float = 0.5) -> Dict[str, float]:
+    """Precision/recall/F1 of candidate detections against the reference model's, frame by frame"""
+    matched = found = expected = 0
+    for (ref_boxes, ref_classes), (boxes, classes) in zip(reference, candidate):
+        ref_boxes, boxes = np.array(ref_boxes).reshape(-1, 4), np.array(boxes).reshape(-1, 4)
+        expected += len(ref_boxes)
+        found += len(boxes)
+        used = np.zeros(len(boxes), dtype=bool)
+        for box, class_id in zip(ref_boxes, ref_classes):
+            candidates = (np.array(classes) == class_id) & ~used
+            if not candidates.any():
+                continue
+            ious = np.where(candidates, _iou(box, boxes), 0)
+            best = int(ious.argmax())
+            if ious[best] >= iou_threshold:
+                used[best] = True
+                matched += 1
+    precision = matched / found if found else 1.0
+    recall = matched / expected if expected else 1.0
+    f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+    return {"precision": precision, "recall": recall, "f1": f1}
+
+
+def compare(model_path: str, candidates: List[str], frames: List[np.ndarray],
+            threads: int = DETECTOR_THREADS) -> List[Dict]:
+    """
+    Benchmark the PyTorch model and each "backend:path" candidate on the same frames.
+
+    There are no ground-truth labels for the sample videos, so accuracy is
+    agreement with the PyTorch model's detections (IoU >= 0.5, same class).
+    """
+    runs = [("torch", model_path)] + [tuple(candidate.split(":", 1)) for candidate in candidates]
+    with tempfile.TemporaryDirectory() as temp_dir:
+        frames_path = os.path.join(temp_dir, "frames.npz")
+        # Videos differ in resolution, so frames are stored as separate arrays
+        np.savez(frames_path, *frames)
+        results = []
+        for backend, path in runs:
+            # A fresh process per run, so peak memory and thread pools do not mix
+            with ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn")) as pool:
+                result = pool.submit(_benchmark, backend, path, frames_path, threads).result()
+            result.update(backend=backend, model=os.path.basename(path),
+                          size_mb=os.path.getsize(path) / 1e6 if os.path.exists(path) else float("nan"))
+            results.append(result)
+
+    reference = results[0]["detections"]
+    for result in results:
+        result.update(agreement(reference, result.pop("detections")))
+    return results
+
+
+def run_video(video_path: str, detector, output_path: Optional[str] = None) -> Dict:
+    """Detect and track a video with any detector, returning a detection summary"""
+    from instrumentation import span
+
+    cap = cv2.VideoCapture(video_path)
+    fps = int(cap.get(cv2.CAP_PROP_FPS))
+    resolution = f"{int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))}x{int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))}"
+    tracker = sv.ByteTrack()
+    unique_objects = defaultdict(int)
+    tracks = {}
+    frame_count = 0
+    started = time.perf_counter()
+    while True:
+        with span("camera", "decode"):
+            ok, frame = cap.read()
+        if not ok:
+            break
+        frame_count += 1
+        with span("camera", "inference"):
+            detections = detector(frame)
+        if len(detections) == 0:
+            continue
+        with span("camera", "tracking"):
+            detections = tracker.update_with_detections(detections)
+        for tracker_id, class_id, confidence in zip(detections.tracker_id, detections.class_id, detections.confidence):
+            class_name = detector.names[int(class_id)]
+            unique_objects[class_name] += 1
+            track = tracks.setdefault(int(tracker_id), {
+                "tracker_id": int(tracker_id), "class_name": class_name,
+                "first_frame": frame_count, "last_frame": frame_count, "max_confidence": 0.0})
+            track["last_frame"] = frame_count
+            track["max_confidence"] = max(track["max_confidence"], float(confidence))
+    cap.release()
+    elapsed = time.perf_counter() - started
+
+    summary = {
+        "video_info": {
+            "filename": os.path.basename(video_path),
+            "resolution": resolution,
+            "fps": fps,
+            "total_frames": frame_count,
+            "processed_frames": frame_count,
+        },
+        "unique_objects": dict(unique_objects),
+        "tracks": [
+            {**track,
+             "start_s": round(track["first_frame"] / fps, 3) if fps else 0.0,
+             "end_s": round(track["last_frame"] / fps, 3) if fps else 0.0}
+            for track in tracks.values()
+        ],
+    }
+    print(f"Processed {frame_count} frames in {elapsed:.1f}s ({frame_count / elapsed:.1f} frames/s)")
+    if output_path:
+        with open(output_path, 'w') as f:
+            json.dump(summary, f, indent=2)
+    return summary
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export, compare and run detectors on CPU")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    export = commands.add_parser("export", help="Export PyTorch weights to ONNX (and INT8)")
+    export.add_argument("--model", default=DETECTOR_MODEL)
+    export.add_argument("--int8", action="store_true", help="Also write an INT8 model calibrated on --videos")
+    export.add_argument("--videos", default=os.path.join(os.getcwd(), "test_videos"))
+    export.add_argument("--calibration-frames", type=int, default=32, help="Frames per video for calibration")
+
+    compare_parser = commands.add_parser("compare", help="Accuracy, latency and memory against PyTorch")
+    compare_parser.add_argument("--model", default=DETECTOR_MODEL, help="PyTorch reference weights")
+    compare_parser.add_argument("--candidate", action="append", required=True, help="backend:path, repeatable")
+    compare_parser.add_argument("--videos", default=os.path.join(os.getcwd(), "test_videos"))
+    compare_parser.add_argument("--frames", type=int, default=16, help="Frames per video")
+    compare_parser.add_argument("--threads", type=int, default=DETECTOR_THREADS)
+    compare_parser.add_argument("--report", help="Also write the results to this JSON file")
+
+    run = commands.add_parser("run", help="Detect and track one video")
+    run.add_argument("video")
+    run.add_argument("--backend", default=DETECTOR_BACKEND, choices=sorted(DETECTORS))
+    run.add_argument("--model", default=DETECTOR_MODEL)
+    run.add_argument("--threads", type=int, default=DETECTOR_THREADS)
+    run.add_argument("--output", help="Detection summary JSON (defaults to <video>_detections.json)")
+    args = parser.parse_args()
+
+    if args.command == "export":
+        onnx_path = export_onnx(args.model)
+        print(f"Exported {onnx_path}")
+        if args.int8:
+            frames = sample_frames(video_files(args.videos), args.calibration_frames)
+            print(f"Calibrating on {len(frames)} frames...")
+            print(f"Quantized {quantize_int8(onnx_path, frames)}")
+    elif args.command == "compare":
+        frames = sample_frames(video_files(args.videos), args.frames)
+        results = compare(args.model, args.candidate, frames, args.threads)
+        print(f"{len(frames)} frames, {args.threads} thread(s); accuracy is agreement with PyTorch")
+        print(f"{'backend':>9} {'model':>24} {'MB':>7} {'p50 ms':>8} {'p95 ms':>8} {'RSS MB':>7} "
+              f"{'prec':>5} {'recall':>6} {'F1':>5}")
+        for r in results:
+            print(f"{r['backend']:>9} {r['model'][-24:]:>24} {r['size_mb']:>7.1f} {r['p50_ms']:>8.1f} "
+                  f"{r['p95_ms']:>8.1f} {r['peak_rss_mb']:>7.0f} {r['precision']:>5.2f} {r['recall']:>6.2f} "
+                  f"{r['f1']:>5.2f}")
+        if args.report:
+            with open(args.report, 'w') as f:
+                json.dump(results, f, indent=2)
+    else:
+        output = args.output or os.path.splitext(args.video)[0] + "_detections.json"
+        run_video(args.video, load_detector(args.backend, args.model, args.threads), output)
+        print(f"Detection summary saved to {output}")
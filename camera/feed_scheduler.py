@@ -0,0 +1,357 @@
+"""
+Shares one detector across many concurrent camera feeds.
+
+Each feed samples frames at its own rate into a short pending queue. One
+inference loop builds cross-stream batches: a batch is dispatched as soon as it
+is full or its oldest frame has waited `max_wait_ms`, and frames from feeds
+with a higher effective priority go first. Every feed keeps its own ByteTrack
+tracker and annotator, so tracks never mix between cameras. A feed that has
+just seen a high-threat class is boosted to a higher frame rate and priority
+for `boost_seconds`.
+
+    # CPU-only load test with synthetic feeds and a simulated batched detector
+    python feed_scheduler.py --synthetic 24 --seconds 10
+
+    # Real videos with any detector backend (see detectors.py)
+    python feed_scheduler.py --videos ../test_videos --backend onnx --model yolov8x.int8.onnx
+"""
+
+import argparse
+import os
+import threading
+import time
+from collections import defaultdict, deque
+from typing import Callable, Dict, Iterable, List, Optional
+
+import cv2
+import numpy as np
+import supervision as sv
+
+from instrumentation import registry, span
+from threat_classes import HIGH_THREAT_CLASSES
+
+feed_lag_seconds = registry.histogram(
+    "sentral_feed_lag_seconds", "Capture-to-detection lag per camera feed", ("stream",))
+feed_batch_size = registry.histogram(
+    "sentral_feed_batch_size", "Frames per cross-stream inference batch",
+    buckets=(1, 2, 4, 8, 16, 32, 64))
+
+
+class FeedStream:
+    """
+    One camera feed with its own sampling rate, tracker and annotator.
+
+    Args:
+        name: Feed name used in reports and metrics
+        source: Iterable of BGR frames, paced like the live feed
+        fps: Frames per second sent to the detector normally
+        boosted_fps: Frames per second after a high-threat detection
+        priority: Base priority; higher is scheduled first
+        boost_seconds: How long a high-threat detection boosts the feed
+        max_pending: Frames kept waiting; older ones are dropped so lag stays bounded
+    """
+
+    def __init__(self, name: str, source: Iterable[np.ndarray], fps: float = 5.0, boosted_fps: float = 15.0,
+                 priority: int = 0, boost_seconds: float = 10.0, max_pending: int = 2):
+        self.name = name
+        self.source = source
+        self.fps = fps
+        self.boosted_fps = boosted_fps
+        self.priority = priority
+        self.boost_seconds = boost_seconds
+        self.pending = deque()
+        self.max_pending = max_pending
+        self.tracker = sv.ByteTrack(frame_rate=fps)
+        # ByteTrack counts its lost-track buffer in frames (one second's worth at
+        # frame_rate); keep it one second long whichever rate the feed runs at
+        self.lost_track_seconds = self.tracker.max_time_lost / fps
+        self.annotator = sv.BoxAnnotator()
+        self.unique_objects = defaultdict(int)
+        self.tracks: Dict[int, Dict] = {}
+        self.last_threat = float("-inf")
+        self.next_due = 0.0
+        self.frame_index = 0
+        self.processed = 0
+        self.skipped = 0
+        self.dropped = 0
+        self.lags = deque(maxlen=2000)
+        self.boosted_frames = 0
+
+    def boosted(self, now: float) -> bool:
+        return now - self.last_threat < self.boost_seconds
+
+    def rate(self, now: float) -> float:
+        return self.boosted_fps if self.boosted(now) else self.fps
+
+    def effective_priority(self, now: float) -> int:
+        return self.priority + (10 if self.boosted(now) else 0)
+
+    def retune_tracker(self, now: float):
+        """Size the tracker's lost-track buffer for the rate frames currently arrive at"""
+        self.tracker.max_time_lost = max(1, int(round(self.rate(now) * self.lost_track_seconds)))
+
+
+class FeedScheduler:
+    """
+    Cross-stream batching in front of one detector.
+
+    Args:
+        detector: Object with batch(frames) -> [sv.Detections] and `names` (see detectors.py)
+        max_batch: Largest batch sent to the detector
+        max_wait_ms: Longest a frame waits for its batch to fill
+        annotate: Draw boxes on each processed frame (passed to on_result)
+        on_result: Called with (stream, frame, detections) after tracking
+    """
+
+    def __init__(self, detector, max_batch: int = 16, max_wait_ms: float = 50,
+                 annotate: bool = False, on_result: Optional[Callable] = None):
+        self.detector = detector
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self.annotate = annotate
+        self.on_result = on_result
+        self.streams: List[FeedStream] = []
+        self.condition = threading.Condition()
+        self.threads: List[threading.Thread] = []
+        self.stopped = threading.Event()
+        self.batches = 0
+        self.frames = 0
+        self.started_at = None
+
+    def add_stream(self, stream: FeedStream):
+        self.streams.append(stream)
+
+    def start(self):
+        self.started_at = time.perf_counter()
+        for stream in self.streams:
+            thread = threading.Thread(target=self._intake, args=(stream,), name=f"feed-{stream.name}", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+        inference = threading.Thread(target=self._run, name="feed-inference", daemon=True)
+        inference.start()
+        self.threads.append(inference)
+
+    def stop(self):
+        self.stopped.set()
+        with self.condition:
+            self.condition.notify_all()
+        for thread in self.threads:
+            thread.join(timeout=5)
+
+    def _intake(self, stream: FeedStream):
+        """Sample the feed at its current rate into its pending queue"""
+        for frame in stream.source:
+            if self.stopped.is_set():
+                break
+            now = time.perf_counter()
+            stream.frame_index += 1
+            if now < stream.next_due:
+                stream.skipped += 1
+                continue
+            stream.next_due = max(stream.next_due + 1 / stream.rate(now), now - 0.5 / stream.rate(now))
+            with self.condition:
+                stream.pending.append((frame, now, stream.frame_index))
+                if len(stream.pending) > stream.max_pending:
+                    stream.pending.popleft()
+                    stream.dropped += 1
+                self.condition.notify_all()
+
+    def _collect(self) -> List:
+        """Wait for a full batch or for the oldest pending frame's deadline"""
+        with self.condition:
+            while not self.stopped.is_set():
+                pending = [(stream, entry) for stream in self.streams for entry in stream.pending]
+                if pending:
+                    oldest = min(entry[1] for _, entry in pending)
+                    remaining = oldest + self.max_wait - time.perf_counter()
+                    if len(pending) >= self.max_batch or remaining <= 0:
+                        break
+                    self.condition.wait(remaining)
+                else:
+                    self.condition.wait(0.1)
+            else:
+                return []
+
+            now = time.perf_counter()
+            pending.sort(key=lambda item: (-item[0].effective_priority(now), item[1][1]))
+            batch = pending[:self.max_batch]
+            for stream, entry in batch:
+                stream.pending.remove(entry)
+            return batch
+
+    def _run(self):
+        while not self.stopped.is_set():
+            batch = self._collect()
+            if not batch:
+                continue
+            with span("camera", "inference", batch=len(batch)):
+                results = self.detector.batch([entry[0] for _, entry in batch])
+            feed_batch_size.observe(len(batch))
+            self.batches += 1
+            self.frames += len(batch)
+            done = time.perf_counter()
+            for (stream, (frame, captured, index)), detections in zip(batch, results):
+                self._track(stream, frame, index, detections, done)
+                lag = done - captured
+                stream.lags.append(lag)
+                feed_lag_seconds.observe(lag, stream=stream.name)
+
+    def _track(self, stream: FeedStream, frame, index: int, detections, now: float):
+        stream.processed += 1
+        if stream.boosted(now):
+            stream.boosted_frames += 1
+        if len(detections) > 0:
+            with span("camera", "tracking"):
+                stream.retune_tracker(now)
+                detections = stream.tracker.update_with_detections(detections)
+            for tracker_id, class_id in zip(detections.tracker_id, detections.class_id):
+                class_name = self.detector.names[int(class_id)]
+                stream.unique_objects[class_name] += 1
+                track = stream.tracks.setdefault(int(tracker_id), {
+                    "tracker_id": int(tracker_id), "class_name": class_name,
+                    "first_frame": index, "last_frame": index})
+                track["last_frame"] = index
+                if class_name.casefold() in HIGH_THREAT_CLASSES:
+                    stream.last_threat = now
+            if self.annotate:
+                frame = stream.annotator.annotate(scene=frame.copy(), detections=detections)
+        if self.on_result is not None:
+            self.on_result(stream, frame, detections)
+
+    def report(self) -> Dict:
+        """Aggregate throughput and per-stream rates and lag"""
+        elapsed = time.perf_counter() - self.started_at
+        streams = {}
+        for stream in self.streams:
+            lags = sorted(stream.lags)
+            streams[stream.name] = {
+                "priority": stream.priority,
+                "processed": stream.processed,
+                "fps": stream.processed / elapsed,
+                "boosted_frames": stream.boosted_frames,
+                "skipped": stream.skipped,
+                "dropped": stream.dropped,
+                "lag_p50_ms": lags[len(lags) // 2] * 1000 if lags else None,
+                "lag_p95_ms": lags[min(len(lags) - 1, int(len(lags) * 0.95))] * 1000 if lags else None,
+                "tracks": len(stream.tracks),
+            }
+        return {
+            "elapsed_s": elapsed,
+            "frames": self.frames,
+            "fps": self.frames / elapsed,
+            "mean_batch": self.frames / self.batches if self.batches else 0.0,
+            "streams": streams,
+        }
+
+
+def video_source(path: str, realtime: bool = True) -> Iterable[np.ndarray]:
+    """Frames of a video file, paced at its frame rate to behave like a live feed"""
+    cap = cv2.VideoCapture(path)
+    interval = 1 / (cap.get(cv2.CAP_PROP_FPS) or 30)
+    next_frame = time.perf_counter()
+    while True:
+        ok, frame = cap.read()
+        if not ok:
+            break
+        if realtime:
+            next_frame += interval
+            time.sleep(max(0.0, next_frame - time.perf_counter()))
+        yield frame
+    cap.release()
+
+
+def synthetic_source(seconds: float, fps: float = 30, size=(360, 640), threat_window=None) -> Iterable[np.ndarray]:
+    """
+    Blank frames at a live frame rate. Inside threat_window (start_s, end_s) the
+    first pixel is set, which SyntheticDetector reports as a boat.
+    """
+    started = time.perf_counter()
+    next_frame = started
+    while next_frame - started < seconds:
+        frame = np.zeros((*size, 3), dtype=np.uint8)
+        elapsed = time.perf_counter() - started
+        if threat_window and threat_window[0] <= elapsed < threat_window[1]:
+            frame[0, 0, 0] = 255
+        next_frame += 1 / fps
+        time.sleep(max(0.0, next_frame - time.perf_counter()))
+        yield frame
+
+
+class SyntheticDetector:
+    """
+    Stand-in for a batched GPU detector: a fixed launch cost plus a small cost per
+    frame, so larger batches amortise the launch like a real GPU does.
+    """
+
+    names = {0: "person", 1: "boat", 2: "bird"}
+
+    def __init__(self, launch_ms: float = 20, per_frame_ms: float = 2):
+        self.launch_ms = launch_ms
+        self.per_frame_ms = per_frame_ms
+
+    def batch(self, frames: List[np.ndarray]) -> List[sv.Detections]:
+        time.sleep((self.launch_ms + self.per_frame_ms * len(frames)) / 1000)
+        results = []
+        for frame in frames:
+            class_id = 1 if frame[0, 0, 0] else 0
+            results.append(sv.Detections(xyxy=np.array([[40, 40, 120, 160]], dtype=np.float32),
+                                         confidence=np.array([0.9], dtype=np.float32),
+                                         class_id=np.array([class_id])))
+        return results
+
+
+def print_report(report: Dict):
+    print(f"{report['frames']} frames in {report['elapsed_s']:.1f}s: {report['fps']:.1f} frames/s, "
+          f"mean batch {report['mean_batch']:.1f}")
+    print(f"{'stream':>12} {'prio':>4} {'fps':>6} {'boosted':>7} {'skipped':>7} {'dropped':>7} "
+          f"{'lag p50':>8} {'lag p95':>8}")
+    for name, s in report["streams"].items():
+        p50 = f"{s['lag_p50_ms']:.0f}" if s["lag_p50_ms"] is not None else "-"
+        p95 = f"{s['lag_p95_ms']:.0f}" if s["lag_p95_ms"] is not None else "-"
+        print(f"{name:>12} {s['priority']:>4} {s['fps']:>6.1f} {s['boosted_frames']:>7} {s['skipped']:>7} "
+              f"{s['dropped']:>7} {p50:>8} {p95:>8}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run many camera feeds through one shared detector")
+    parser.add_argument("--synthetic", type=int, default=0, help="Number of synthetic feeds")
+    parser.add_argument("--seconds", type=float, default=10, help="Length of each synthetic feed")
+    parser.add_argument("--videos", help="Directory of videos, each played as a live feed")
+    parser.add_argument("--backend", default=None, help="Detector backend for --videos (see detectors.py)")
+    parser.add_argument("--model", default=None, help="Detector model for --videos")
+    parser.add_argument("--fps", type=float, default=5, help="Frames per second per feed")
+    parser.add_argument("--boosted-fps", type=float, default=15, help="Frames per second after a high-threat class")
+    parser.add_argument("--max-batch", type=int, default=16)
+    parser.add_argument("--max-wait-ms", type=float, default=50)
+    args = parser.parse_args()
+
+    if args.synthetic:
+        detector = SyntheticDetector()
+        sources = {}
+        for index in range(args.synthetic):
+            # Every fourth feed sees a boat in the middle of the run
+            window = (args.seconds * 0.3, args.seconds * 0.5) if index % 4 == 0 else None
+            sources[f"feed-{index:02d}"] = synthetic_source(args.seconds, threat_window=window)
+        # The first two feeds are harbor cameras with a higher base priority
+        priorities = {name: (1 if index < 2 else 0) for index, name in enumerate(sources)}
+    elif args.videos:
+        from detectors import DETECTOR_BACKEND, DETECTOR_MODEL, load_detector, video_files
+
+        detector = load_detector(args.backend or DETECTOR_BACKEND, args.model or DETECTOR_MODEL)
+        sources = {os.path.splitext(os.path.basename(path))[0][:12]: video_source(path)
+                   for path in video_files(args.videos)}
+        priorities = {name: 0 for name in sources}
+    else:
+        parser.error("give --synthetic N or --videos DIR")
+
+    scheduler = FeedScheduler(detector, args.max_batch, args.max_wait_ms)
+    for name, source in sources.items():
+        scheduler.add_stream(FeedStream(name, source, args.fps, args.boosted_fps, priorities[name]))
+    scheduler.start()
+    try:
+        while any(thread.is_alive() for thread in scheduler.threads[:-1]):
+            time.sleep(0.2)
+    except KeyboardInterrupt:
+        pass
+    scheduler.stop()
+    print_report(scheduler.report())
@@ -0,0 +1,187 @@
+"""
+Keyframes for multimodal threat analysis.
+
+While detect_objects runs, every high-threat track keeps its few best views:
+the frame crop around the track's box, scaled to fit KEYFRAME_MAX_SIDE, ranked
+by detection confidence. A view whose perceptual hash (64-bit DCT pHash) is
+within KEYFRAME_HASH_DISTANCE bits of a better one is a near-duplicate and is
+dropped. Once the video is done, each incident (see clips.threat_intervals)
+gets up to KEYFRAMES_PER_INCIDENT views from its tracks. Each crop fits one
+768x768 Gemini image tile, so an incident costs at most
+KEYFRAMES_PER_INCIDENT * 258 image tokens.
+"""
+
+import math
+import os
+import shutil
+from typing import Any, Dict, List
+
+import cv2
+import numpy as np
+
+from threat_classes import HIGH_THREAT_CLASSES
+
+KEYFRAMES_PER_INCIDENT = int(os.getenv("KEYFRAMES_PER_INCIDENT", "3"))
+# Longest side of a keyframe crop; 768 keeps each image to one Gemini tile
+KEYFRAME_MAX_SIDE = int(os.getenv("KEYFRAME_MAX_SIDE", "768"))
+# pHash bits (of 64) below which two views count as the same picture
+KEYFRAME_HASH_DISTANCE = int(os.getenv("KEYFRAME_HASH_DISTANCE", "10"))
+# Views kept per track while the video is processed
+KEYFRAMES_PER_TRACK = int(os.getenv("KEYFRAMES_PER_TRACK", "3"))
+# Context kept around a box, as a fraction of the box size on each side
+CROP_MARGIN = 0.5
+MIN_CROP_SIDE = 224
+
+
+def phash(image: np.ndarray) -> int:
+    """64-bit perceptual hash: signs of the low-frequency DCT coefficients around their median"""
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+    small = cv2.resize(gray, (32, 32), interpolation=cv2.INTER_AREA).astype(np.float32)
+    low = cv2.dct(small)[:8, :8].flatten()
+    bits = low > np.median(low[1:])
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+
+def hamming(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+
+def image_tokens(width: int, height: int) -> int:
+    """Gemini image tokens: 258 up to 384x384, otherwise 258 per 768x768 tile"""
+    if width <= 384 and height <= 384:
+        return 258
+    return 258 * math.ceil(width / 768) * math.ceil(height / 768)
+
+
+def crop_around(frame: np.ndarray, box, margin: float = CROP_MARGIN, min_side: int = MIN_CROP_SIDE,
+                max_side: int = KEYFRAME_MAX_SIDE) -> np.ndarray:
+    """The box plus margin (at least min_side square), scaled down to fit max_side"""
+    height, width = frame.shape[:2]
+    x1, y1, x2, y2 = box
+    half_w = max((x2 - x1) * (0.5 + margin), min_side / 2)
+    half_h = max((y2 - y1) * (0.5 + margin), min_side / 2)
+    cx, cy = (x1 + x2) / 2, (y1 + y2) / 2
+    left, right = int(max(0, cx - half_w)), int(min(width, cx + half_w))
+    top, bottom = int(max(0, cy - half_h)), int(min(height, cy + half_h))
+    crop = frame[top:bottom, left:right]
+    scale = max_side / max(crop.shape[:2])
+    if scale < 1:
+        crop = cv2.resize(crop, (max(1, round(crop.shape[1] * scale)), max(1, round(crop.shape[0] * scale))),
+                          interpolation=cv2.INTER_AREA)
+    return np.ascontiguousarray(crop)
+
+
+class KeyframeSelector:
+    """
+    Keeps the best distinct views of each high-threat track.
+
+    Args:
+        classes: Class names (case-insensitive) worth a keyframe
+        per_track: Views kept per track
+        distance: pHash distance below which views are near-duplicates
+        max_side: Longest side of a stored crop
+    """
+
+    def __init__(self, classes=HIGH_THREAT_CLASSES, per_track: int = KEYFRAMES_PER_TRACK,
+                 distance: int = KEYFRAME_HASH_DISTANCE, max_side: int = KEYFRAME_MAX_SIDE):
+        self.classes = {name.casefold() for name in classes}
+        self.per_track = per_track
+        self.distance = distance
+        self.max_side = max_side
+        # tracker_id -> views sorted best first
+        self.views: Dict[int, List[Dict[str, Any]]] = {}
+
+    def offer(self, frame: np.ndarray, frame_index: int, time_s: float, detections, names):
+        """
+        Consider the tracked detections of one (unannotated) frame.
+
+        Args:
+            frame: BGR frame
+            frame_index: Frame number
+            time_s: Frame time in seconds
+            detections: sv.Detections after tracking
+            names: Class id to name mapping of the detector
+        """
+        if detections.tracker_id is None:
+            return
+        for box, class_id, confidence, tracker_id in zip(
+                detections.xyxy, detections.class_id, detections.confidence, detections.tracker_id):
+            class_name = names[int(class_id)]
+            if class_name.casefold() not in self.classes:
+                continue
+            views = self.views.setdefault(int(tracker_id), [])
+            # Cheap check first: most frames are no better than what the track already has
+            if len(views) >= self.per_track and confidence <= views[-1]["confidence"]:
+                continue
+            crop = crop_around(frame, box, max_side=self.max_side)
+            view = {"frame": frame_index, "time_s": round(time_s, 3), "tracker_id": int(tracker_id),
+                    "class_name": class_name, "confidence": float(confidence),
+                    "box": [round(float(v), 1) for v in box], "hash": phash(crop), "image": crop}
+            duplicate = next((v for v in views if hamming(v["hash"], view["hash"]) < self.distance), None)
+            if duplicate is not None:
+                if duplicate["confidence"] >= view["confidence"]:
+                    continue
+                views.remove(duplicate)
+            views.append(view)
+            views.sort(key=lambda v: -v["confidence"])
+            del views[self.per_track:]
+
+    def select(self, incidents: List[Dict[str, Any]], per_incident: int = KEYFRAMES_PER_INCIDENT):
+        """
+        Pick up to per_incident distinct views per incident, best confidence first,
+        preferring tracks that do not have a view yet.
+
+        Returns:
+            One list of views per incident
+        """
+        selected = []
+        for incident in incidents:
+            candidates = sorted((view for tracker_id in incident["tracks"] for view in self.views.get(tracker_id, [])),
+                                key=lambda view: -view["confidence"])
+            picked = []
+            # Two passes: the best view of each track, then the remaining views
+            for first_pass in (True, False):
+                for view in candidates:
+                    if len(picked) >= per_incident:
+                        break
+                    if view in picked:
+                        continue
+                    if first_pass and any(p["tracker_id"] == view["tracker_id"] for p in picked):
+                        continue
+                    if any(hamming(p["hash"], view["hash"]) < self.distance for p in picked):
+                        continue
+                    picked.append(view)
+            selected.append(picked)
+        return selected
+
+    def save(self, incidents: List[Dict[str, Any]], output_dir: str, base_name: str,
+             per_incident: int = KEYFRAMES_PER_INCIDENT, quality: int = 85) -> List[Dict[str, Any]]:
+        """
+        Write the selected views as JPEGs under {base_name}_keyframes/.
+
+        Returns:
+            Keyframe records (file relative to output_dir, incident number, timing,
+            track, class, confidence, size and image tokens)
+        """
+        keyframe_dir = f"{base_name}_keyframes"
+        # Keyframes from an earlier run of the same video would otherwise be picked up by the planner
+        shutil.rmtree(os.path.join(output_dir, keyframe_dir), ignore_errors=True)
+        records = []
+        for number, views in enumerate(self.select(incidents, per_incident), 1):
+            for view in views:
+                if not records:
+                    os.makedirs(os.path.join(output_dir, keyframe_dir), exist_ok=True)
+                name = f"{keyframe_dir}/incident_{number:02d}_frame_{view['frame']:05d}.jpg"
+                cv2.imwrite(os.path.join(output_dir, name), view["image"], [cv2.IMWRITE_JPEG_QUALITY, quality])
+                height, width = view["image"].shape[:2]
+                records.append({
+                    "file": name,
+                    "incident": number,
+                    **{key: view[key] for key in ("frame", "time_s", "tracker_id", "class_name", "box")},
+                    "confidence": round(view["confidence"], 4),
+                    "width": width,
+                    "height": height,
+                    "tokens": image_tokens(width, height),
+                    "phash": f"{view['hash']:016x}",
+                })
+        return records
@@ -6,8 +6,9 @@ import base64
 import subprocess
 from collections import defaultdict
 import json
+import time
+import queue
 import cv2
-from ultralytics import YOLO
 import supervision as sv
 
 # Create base image with minimal dependencies
@@ -31,6 +32,11 @@ base_image = (
     )
 )
 
+# The threat scorer's config, shipped so the container derives the same
+# high-threat classes (see threat_classes.py)
+SCORING_CONFIG = os.getenv("THREAT_SCORING_CONFIG")
+SCORING_CONFIG_REMOTE = "/root/threat_scoring.json"
+
 # Create detection image with all dependencies
 detection_image = (
     base_image
@@ -38,8 +44,26 @@ detection_image = (
         "numpy",
         "ffmpeg-python"
     )
+    .env({"THREAT_SCORING_CONFIG": SCORING_CONFIG_REMOTE} if SCORING_CONFIG else {})
     .add_local_dir(os.path.join(os.getcwd(), 'test_videos'), remote_path="/root/test_videos")
+    .add_local_file(
+        os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "instrumentation.py"),
+        remote_path="/root/instrumentation.py")
+    .add_local_file(
+        os.path.join(os.path.dirname(os.path.abspath(__file__)), "detectors.py"),
+        remote_path="/root/detectors.py")
+    .add_local_file(
+        os.path.join(os.path.dirname(os.path.abspath(__file__)), "clips.py"),
+        remote_path="/root/clips.py")
+    .add_local_file(
+        os.path.join(os.path.dirname(os.path.abspath(__file__)), "keyframes.py"),
+        remote_path="/root/keyframes.py")
+    .add_local_file(
+        os.path.join(os.path.dirname(os.path.abspath(__file__)), "threat_classes.py"),
+        remote_path="/root/threat_classes.py")
 )
+if SCORING_CONFIG:
+    detection_image = detection_image.add_local_file(SCORING_CONFIG, remote_path=SCORING_CONFIG_REMOTE)
 
 # Create app for Modal
 app = modal.App()
@@ -51,14 +75,140 @@ output_volume = modal.Volume.from_name("drone-detection-output", create_if_missi
 test_videos_dir = os.path.join(os.getcwd(), 'test_videos')
 os.makedirs(test_videos_dir, exist_ok=True)
 
+# Optional HLS renditions as (height, video bitrate), for players outside the
+# dashboard. Renditions taller than the source are skipped (the smallest is
+# always produced).
+HLS_RENDITIONS = [(720, "2800k"), (480, "1400k"), (360, "800k")]
+SEGMENT_SECONDS = 2
+SPRITE_COLUMNS = 10
+SPRITE_THUMB_WIDTH = 160
+MAX_SPRITE_THUMBS = 100
+
+def build_encode_command(frames_pattern, fps, width, height, frame_count, output_dir, base_name, streaming=False,
+                         hls=False):
+    """
+    Build one ffmpeg command that encodes the annotated frames into every output.
+
+    The frames are decoded once and split between the outputs: the main MP4,
+    with `streaming` a thumbnail sprite sheet (the dashboard's scrub previews)
+    and with `hls` the HLS renditions. The dashboard plays the main MP4, so the
+    renditions are only encoded when asked for. Keyframes are forced every
+    SEGMENT_SECONDS in all video outputs so HLS segments and stream-copied clips
+    cut cleanly.
+
+    Returns:
+        The command, the output paths relative to output_dir, and the sprite
+        layout (interval, thumbnail width/height, columns) or None
+    """
+    duration = frame_count / fps if fps else 0
+    keyframes = ['-force_key_frames', f'expr:gte(t,n_forced*{SEGMENT_SECONDS})', '-sc_threshold', '0']
+    outputs = {"mp4": f"{base_name}_detected.mp4"}
+    labels = ["main"]
+    filters = []
+    sprite = None
+
+    if hls:
+        renditions = [r for r in HLS_RENDITIONS if r[0] <= height] or HLS_RENDITIONS[-1:]
+        labels += [f"r{index}" for index in range(len(renditions))]
+        for index, (rendition_height, _) in enumerate(renditions):
+            filters.append(f"[r{index}]scale=-2:{rendition_height}[v{index}]")
+    if streaming:
+        labels.append("spr")
+        interval = max(1.0, duration / MAX_SPRITE_THUMBS)
+        thumbs = max(1, int(duration // interval) + 1)
+        rows = -(-thumbs // SPRITE_COLUMNS)
+        thumb_height = int(round(SPRITE_THUMB_WIDTH * height / width / 2) * 2)
+        filters.append(f"[spr]fps=1/{interval:g},scale={SPRITE_THUMB_WIDTH}:{thumb_height},"
+                       f"tile={SPRITE_COLUMNS}x{rows}[sprite]")
+        sprite = {"interval": interval, "width": SPRITE_THUMB_WIDTH, "height": thumb_height,
+                  "columns": SPRITE_COLUMNS, "count": thumbs}
+
+    split = f"[0:v]split={len(labels)}" + "".join(f"[{label}]" for label in labels)
+    cmd = [
+        'ffmpeg', '-y',
+        '-framerate', str(fps),
+        '-i', frames_pattern,
+        '-filter_complex', ";".join([split] + filters),
+        # Main MP4, moov atom up front so playback starts before the download ends
+        '-map', '[main]', '-c:v', 'libx264', '-preset', 'medium', '-crf', '23', '-pix_fmt', 'yuv420p',
+        *keyframes, '-movflags', '+faststart',
+        os.path.join(output_dir, outputs["mp4"]),
+    ]
+
+    if hls:
+        hls_dir = f"{base_name}_hls"
+        for index in range(len(renditions)):
+            os.makedirs(os.path.join(output_dir, hls_dir, f"v{index}"), exist_ok=True)
+        for index in range(len(renditions)):
+            cmd += ['-map', f'[v{index}]']
+        cmd += ['-c:v', 'libx264', '-preset', 'veryfast', '-pix_fmt', 'yuv420p', *keyframes]
+        for index, (_, bitrate) in enumerate(renditions):
+            cmd += [f'-b:v:{index}', bitrate, f'-maxrate:v:{index}', bitrate,
+                    f'-bufsize:v:{index}', f"{2 * int(bitrate[:-1])}k"]
+        cmd += [
+            '-f', 'hls',
+            '-hls_time', str(SEGMENT_SECONDS),
+            '-hls_playlist_type', 'vod',
+            '-hls_segment_filename', os.path.join(output_dir, hls_dir, 'v%v', 'seg_%04d.ts'),
+            '-master_pl_name', 'master.m3u8',
+            '-var_stream_map', " ".join(f"v:{index}" for index in range(len(renditions))),
+            os.path.join(output_dir, hls_dir, 'v%v', 'index.m3u8'),
+        ]
+        outputs["hls"] = f"{hls_dir}/master.m3u8"
+    if streaming:
+        outputs["sprite"] = f"{base_name}_sprite.jpg"
+        cmd += ['-map', '[sprite]', '-frames:v', '1', '-q:v', '4', os.path.join(output_dir, outputs["sprite"])]
+
+    return cmd, outputs, sprite
+
+def write_sprite_vtt(path, sprite_name, sprite, duration):
+    """WebVTT mapping time ranges to sprite tiles, used by players for scrub previews"""
+    def timestamp(seconds):
+        hours, rest = divmod(seconds, 3600)
+        minutes, seconds = divmod(rest, 60)
+        return f"{int(hours):02d}:{int(minutes):02d}:{seconds:06.3f}"
+
+    lines = ["WEBVTT", ""]
+    for index in range(sprite["count"]):
+        start = index * sprite["interval"]
+        if start >= duration and index:
+            break
+        end = min(duration, start + sprite["interval"]) or sprite["interval"]
+        x = (index % sprite["columns"]) * sprite["width"]
+        y = (index // sprite["columns"]) * sprite["height"]
+        lines += [f"{timestamp(start)} --> {timestamp(end)}",
+                  f"{sprite_name}#xywh={x},{y},{sprite['width']},{sprite['height']}", ""]
+    with open(path, 'w') as f:
+        f.write("\n".join(lines))
+
 @app.function(
     image=detection_image,
     gpu="T4",
     volumes={"/root/processed_output": output_volume}
 )
-def detect_objects(video_path: str):
-    """Process video with YOLOv8 model and track objects."""
-    model = YOLO("yolov8x.pt")
+def detect_objects(video_path: str, events=None, streaming: bool = False, hls: bool = False):
+    """Process video with YOLOv8 model and track objects.
+
+    When `events` (a modal.Queue) is given, a track event is put on it as soon as
+    a new high-threat track appears, so alerts do not wait for the whole video.
+    With `streaming`, the encode also writes a thumbnail sprite with its WebVTT
+    index for the dashboard's scrub previews, and with `hls` HLS renditions for
+    external players. High-threat
+    tracks are also cut into short stream-copied clips (see clips.py), with a
+    few distinct keyframes per clip for the planner's multimodal analysis (see
+    keyframes.py).
+    """
+    from instrumentation import registry, span, stage_seconds
+    from detectors import load_detector
+    from clips import extract_clips, threat_intervals
+    from keyframes import KeyframeSelector
+    from threat_classes import HIGH_THREAT_CLASSES
+
+    # A warm container keeps the metrics of earlier videos; the timings below are this call's share
+    stages_before = stage_seconds.summary()
+
+    # PyTorch on the GPU; DETECTOR_BACKEND=onnx/openvino with an exported model runs on CPU
+    detector = load_detector()
     
     # Convert local path to container path
     container_video_path = os.path.join("/root/test_videos", os.path.basename(video_path))
@@ -86,32 +236,68 @@ def detect_objects(video_path: str):
 
     tracker = sv.ByteTrack()
     box_annotator = sv.BoxAnnotator()  # Use default parameters for now
+    keyframe_selector = KeyframeSelector()
 
     frame_count = 0
     unique_objects = defaultdict(int)
+    # tracker_id -> first/last frame, class and best confidence of the track
+    tracks = {}
     
     try:
         while cap.isOpened():
-            ret, frame = cap.read()
+            with span("camera", "decode"):
+                ret, frame = cap.read()
             if not ret:
                 break
                 
             frame_count += 1
             
-            results = model(frame)[0]
-            detections = sv.Detections.from_ultralytics(results)
+            with span("camera", "inference"):
+                detections = detector(frame)
             
             if len(detections) > 0:
-                detections = tracker.update_with_detections(detections)
+                with span("camera", "tracking"):
+                    detections = tracker.update_with_detections(detections)
                 
                 # Count unique objects by class
                 for class_id in detections.class_id:
-                    class_name = results.names[class_id]
+                    class_name = detector.names[class_id]
                     unique_objects[class_name] += 1
+
+                for tracker_id, class_id, confidence in zip(
+                        detections.tracker_id, detections.class_id, detections.confidence):
+                    track = tracks.get(int(tracker_id))
+                    if track is not None:
+                        track["last_frame"] = frame_count
+                        track["max_confidence"] = max(track["max_confidence"], float(confidence))
+                        continue
+                    class_name = detector.names[class_id]
+                    tracks[int(tracker_id)] = {
+                        "tracker_id": int(tracker_id),
+                        "class_name": class_name,
+                        "first_frame": frame_count,
+                        "last_frame": frame_count,
+                        "max_confidence": float(confidence),
+                    }
+                    if events is not None and class_name.casefold() in HIGH_THREAT_CLASSES:
+                        events.put({
+                            "source": video_filename,
+                            "tracker_id": int(tracker_id),
+                            "class_name": class_name,
+                            "frame": frame_count,
+                            "time_s": frame_count / fps if fps else 0.0,
+                            "confidence": float(confidence),
+                            "detected_at": time.time(),
+                        })
+
+                # Before annotation, so the keyframes show the scene without boxes
+                with span("camera", "keyframes"):
+                    keyframe_selector.offer(frame, frame_count, frame_count / fps if fps else 0.0,
+                                            detections, detector.names)
                 
                 # Create label array for detections
                 labels = [
-                    f"{results.names[class_id]}"
+                    f"{detector.names[class_id]}"
                     for class_id in detections.class_id
                 ]
                 
@@ -122,7 +308,8 @@ def detect_objects(video_path: str):
                 
             # Save frame as image
             frame_path = os.path.join(temp_dir, f"frame_{frame_count:04d}.jpg")
-            cv2.imwrite(frame_path, frame)
+            with span("camera", "frame_write"):
+                cv2.imwrite(frame_path, frame)
             
             # Print progress every 30 frames (about once per second)
             if frame_count % 30 == 0:
@@ -138,33 +325,17 @@ def detect_objects(video_path: str):
     # Use ffmpeg to create video from frames
     try:
         print("\nCreating video from frames...")
-        # First create a temporary video with raw frames
-        temp_video = os.path.join(temp_dir, 'temp_video.mp4')
-        ffmpeg_cmd = [
-            'ffmpeg', '-y',
-            '-framerate', str(fps),
-            '-i', os.path.join(temp_dir, 'frame_%04d.jpg'),
-            '-c:v', 'libx264',
-            '-preset', 'medium',
-            '-crf', '23',
-            '-pix_fmt', 'yuv420p',
-            '-vf', f'fps={fps}',  # Ensure output framerate matches input
-            temp_video
-        ]
-        result = subprocess.run(ffmpeg_cmd, check=True, capture_output=True, text=True)
-        print("First pass complete")
-        
-        # Now create the final video with proper metadata
-        ffmpeg_cmd = [
-            'ffmpeg', '-y',
-            '-i', temp_video,
-            '-c', 'copy',
-            '-movflags', '+faststart',
-            '-map', '0:v',  # Only copy video stream
-            output_video_path
-        ]
-        result = subprocess.run(ffmpeg_cmd, check=True, capture_output=True, text=True)
-        print("Second pass complete")
+        # One pass decodes the frames once and writes every output
+        ffmpeg_cmd, streams, sprite = build_encode_command(
+            os.path.join(temp_dir, 'frame_%04d.jpg'), fps, frame_width, frame_height, frame_count,
+            "/root/processed_output", base_name, streaming, hls)
+        with span("camera", "encode"):
+            result = subprocess.run(ffmpeg_cmd, check=True, capture_output=True, text=True)
+        if sprite is not None:
+            streams["sprite_vtt"] = f"{base_name}_sprite.vtt"
+            write_sprite_vtt(os.path.join("/root/processed_output", streams["sprite_vtt"]),
+                             streams["sprite"], sprite, frame_count / fps if fps else 0)
+        print("Encode complete: " + ", ".join(streams.values()))
         
         # Clean up temp directory
         import shutil
@@ -192,6 +363,32 @@ def detect_objects(video_path: str):
         print(f"FFmpeg errors: {e.stderr}")
         return None
 
+    track_records = [
+        {**track,
+         "start_s": round(track["first_frame"] / fps, 3) if fps else 0.0,
+         "end_s": round(track["last_frame"] / fps, 3) if fps else 0.0}
+        for track in tracks.values()
+    ]
+
+    # Clips around the high-threat tracks: what operators review, and what is copied off the volume first
+    clip_index = None
+    try:
+        with span("camera", "clips"):
+            clip_index = extract_clips(output_video_path, track_records, "/root/processed_output", base_name,
+                                       frame_count / fps if fps else 0.0)
+    except subprocess.CalledProcessError as e:
+        print(f"Warning: clip extraction failed: {e.stderr}")
+    if clip_index:
+        streams["clips"] = f"{base_name}_clips.json"
+        print(f"Cut {len(clip_index['clips'])} threat clips ({clip_index['clip_duration_s']:.1f}s, "
+              f"{clip_index['clip_bytes']} of {clip_index['source_bytes']} bytes)")
+
+    # Same incidents as the clips; each keyframe fits one image tile of the analysis call
+    keyframes = keyframe_selector.save(threat_intervals(track_records, frame_count / fps if fps else 0.0),
+                                       "/root/processed_output", base_name)
+    if keyframes:
+        print(f"Selected {len(keyframes)} keyframes ({sum(k['tokens'] for k in keyframes)} image tokens)")
+
     print(f"\nProcessed {frame_count} frames")
     print("\nUnique Object Summary:")
     for obj, count in unique_objects.items():
@@ -205,9 +402,24 @@ def detect_objects(video_path: str):
             "total_frames": total_frames,
             "processed_frames": frame_count
         },
-        "unique_objects": dict(unique_objects)
+        "unique_objects": dict(unique_objects),
+        # Output files relative to the processed_output directory
+        "streams": streams,
+        "tracks": track_records,
+        "clips": clip_index["clips"] if clip_index else [],
+        "keyframes": keyframes,
+        # Total and mean seconds per stage of this video, for spotting the hot path
+        "timings": {
+            stage: {key: round(value, 4) for key, value in stats.items()}
+            for (service, stage), stats in stage_seconds.summary(since=stages_before).items()
+            if service == "camera"
+        }
     }
 
+    # Prometheus text dump next to the outputs (copied locally with the other files)
+    with open(os.path.join("/root/processed_output", f"{base_name}_metrics.prom"), 'w') as f:
+        f.write(registry.render())
+
     with open(json_output_path, 'w') as f:
         json.dump(detection_summary, f, indent=2)
 
@@ -217,34 +429,113 @@ def detect_objects(video_path: str):
 
     return detection_summary
 
+def is_clip_output(relative_path):
+    """Clips, keyframes, clip indexes and detection summaries: the small outputs copied first"""
+    top = relative_path.split(os.sep)[0]
+    return top.endswith(("_clips", "_keyframes")) or relative_path.endswith(("_clips.json", "_detections.json"))
+
 @app.function(image=base_image, volumes={"/root/processed_output": output_volume})
-def copy_output_to_local():
+def copy_output_to_local(part: str = "all"):
+    """
+    Read the output files, keyed by path relative to the output directory.
+
+    `part` is "clips" for the threat clips, keyframes, clip indexes and
+    detection summaries, "rest" for everything else, or "all".
+    """
     # Get all files in the output directory
     output_dir = "/root/processed_output"
     files = []
-    for file_name in os.listdir(output_dir):
-        file_path = os.path.join(output_dir, file_name)
-        if os.path.isfile(file_path):  # Only include files, not directories
-            files.append(file_path)
+    for dir_path, dir_names, file_names in os.walk(output_dir):
+        # Skip frame directories left behind by a failed run
+        dir_names[:] = [d for d in dir_names if d != "temp_frames"]
+        for file_name in file_names:
+            file_path = os.path.join(dir_path, file_name)
+            clip_output = is_clip_output(os.path.relpath(file_path, output_dir))
+            if part == "all" or clip_output == (part == "clips"):
+                files.append(file_path)
     
     print(f"Found {len(files)} files in remote directory:")
     for file_path in files:
-        print(f"- {os.path.basename(file_path)}")
+        print(f"- {os.path.relpath(file_path, output_dir)}")
 
-    # Read all files
+    # Read all files, keyed by path relative to the output directory (HLS
+    # renditions live in subdirectories)
     file_contents = {}
     for file_path in files:
+        relative_path = os.path.relpath(file_path, output_dir)
         print(f"Reading {file_path}")
         with open(file_path, 'rb') as f:
             content = f.read()
-            print(f"Read {len(content)} bytes from {os.path.basename(file_path)}")
-            file_contents[os.path.basename(file_path)] = content
+            print(f"Read {len(content)} bytes from {relative_path}")
+            file_contents[relative_path] = content
 
     return file_contents
 
+def save_local(file_contents, processed_dir):
+    for filename, content in file_contents.items():
+        local_path = os.path.join(processed_dir, filename)
+        try:
+            print(f"Writing {len(content)} bytes to {filename}")
+            os.makedirs(os.path.dirname(local_path), exist_ok=True)
+            with open(local_path, 'wb') as f:
+                f.write(content)
+            print(f"Saved {filename} ({os.path.getsize(local_path)} bytes) to {local_path}")
+        except Exception as e:
+            print(f"Error saving {filename}: {str(e)}")
+
+def run_with_events(video_path: str, bus_path: str, streaming: bool = False, processed_dir: str = "",
+                    hls: bool = False):
+    """
+    Run detect_objects while forwarding its track events to the local event bus,
+    then publish the detection summary.
+
+    With `processed_dir`, the clips and keyframes are copied there before the
+    summary is published, so the planner can attach the keyframes it references.
+    """
+    from event_bus import EventBus
+
+    bus = EventBus(bus_path)
+    with modal.Queue.ephemeral() as events:
+        call = detect_objects.spawn(video_path, events, streaming, hls)
+        results = None
+        done = False
+        while True:
+            if not done:
+                try:
+                    results = call.get(timeout=0)
+                    done = True
+                except (TimeoutError, modal.exception.TimeoutError):
+                    pass
+            try:
+                batch = events.get_many(100, timeout=0 if done else 1)
+            except queue.Empty:
+                batch = []
+            for event in batch:
+                bus.publish("track_events", event)
+                print(f"Track event: {event['class_name']} (track {event['tracker_id']}) at {event['time_s']:.1f}s")
+            if done and not batch:
+                break
+
+    if results:
+        if processed_dir:
+            print("\nCopying threat clips and keyframes to local directory...")
+            save_local(copy_output_to_local.remote("clips"), processed_dir)
+        bus.publish("detections", {
+            "source": results["video_info"]["filename"],
+            "summary": results,
+            "detected_at": time.time(),
+        })
+    return results
+
 @app.local_entrypoint()
-def main():
-    """Main function to run the object detection pipeline."""
+def main(bus: str = "", streaming: bool = False, hls: bool = False, clips_only: bool = False):
+    """Main function to run the object detection pipeline.
+
+    Pass --bus <path to events.db> to stream events to plan_creation/threat_pipeline.py,
+    --streaming to also write the thumbnail sprite for the dashboard's scrub bar,
+    --hls to also write HLS renditions for external players, and
+    --clips-only to copy just the threat clips and summaries off the volume.
+    """
     video_dir = os.path.join(os.getcwd(), 'test_videos')
     video_files = [f for f in os.listdir(video_dir) if f.endswith(('.mp4', '.avi', '.mov'))]
     
@@ -263,22 +554,24 @@ def main():
     
     # Use full path when calling detect_objects
     video_path = os.path.join(video_dir, video_files[0])
-    results = detect_objects.remote(video_path)
+    if bus:
+        results = run_with_events(video_path, bus, streaming, processed_dir, hls)
+    else:
+        results = detect_objects.remote(video_path, streaming=streaming, hls=hls)
     
     if results and 'unique_objects' in results:
         print("\nUnique Object Summary:")
         for obj, count in results['unique_objects'].items():
             print(f"{obj}: {count} instances")
     
-    print("\nCopying output files to local directory...")
-    file_contents = copy_output_to_local.remote()
+    # Threat clips first: they are small and are what operators review
+    if not bus:
+        print("\nCopying threat clips to local directory...")
+        save_local(copy_output_to_local.remote("clips"), processed_dir)
     
-    for filename, content in file_contents.items():
-        local_path = os.path.join(processed_dir, filename)
-        try:
-            print(f"Writing {len(content)} bytes to {filename}")
-            with open(local_path, 'wb') as f:
-                f.write(content)
-            print(f"Saved {filename} ({os.path.getsize(local_path)} bytes) to {local_path}")
-        except Exception as e:
-            print(f"Error saving {filename}: {str(e)}")
+    if clips_only:
+        print("Skipping the full-length outputs (--clips-only)")
+        return
+    
+    print("\nCopying remaining output files to local directory...")
+    save_local(copy_output_to_local.remote("rest"), processed_dir)
@@ -0,0 +1,46 @@
+from clips import build_clip_command, snap_to_keyframes, threat_intervals
+
+
+def track(tracker_id, class_name, start_s, end_s, confidence=0.5):
+    return {"tracker_id": tracker_id, "class_name": class_name, "start_s": start_s, "end_s": end_s,
+            "max_confidence": confidence}
+
+
+def test_only_high_threat_tracks_become_incidents():
+    tracks = [track(1, "person", 5, 20), track(2, "Boat", 10, 12, 0.7), track(3, "drone", 30, 30.2)]
+    [incident] = threat_intervals(tracks, duration=60, pad=2, merge_gap=4, min_track=0.5)
+    assert (incident["start_s"], incident["end_s"]) == (8, 14)
+    assert incident["first_seen_s"] == 10
+    assert incident["tracks"] == [2]
+    assert incident["classes"] == {"Boat": 1}
+    assert incident["max_confidence"] == 0.7
+
+
+def test_nearby_tracks_merge_and_pads_are_clamped():
+    tracks = [track(1, "mines", 0.5, 3, 0.4), track(2, "drone", 8, 10, 0.9),
+              track(3, "boat", 9, 11, 0.6), track(4, "boat", 30, 59.5)]
+    first, second = threat_intervals(tracks, duration=60, pad=2, merge_gap=4, min_track=0.5)
+    assert (first["start_s"], first["end_s"]) == (0.0, 13)
+    assert first["tracks"] == [1, 2, 3]
+    assert first["classes"] == {"mines": 1, "drone": 1, "boat": 1}
+    assert first["max_confidence"] == 0.9
+    assert (second["start_s"], second["end_s"]) == (28, 60)
+
+
+def test_snap_widens_to_keyframes():
+    keyframes = [0.0, 2.0, 4.0, 6.0, 8.0]
+    assert snap_to_keyframes(3.0, 5.0, keyframes, duration=9) == (2.0, 6.0)
+    # Already on a keyframe: unchanged
+    assert snap_to_keyframes(4.0, 6.0, keyframes, duration=9) == (4.0, 6.0)
+    # Past the last keyframe the clip runs to the end of the video
+    assert snap_to_keyframes(7.0, 8.5, keyframes, duration=9) == (6.0, 9)
+    assert snap_to_keyframes(1.0, 3.0, [], duration=9) == (0.0, 9)
+
+
+def test_clip_command_stream_copies_from_the_keyframe():
+    command = build_clip_command("in.mp4", 2.0, 6.5, "out.mp4", ffmpeg="ffmpeg")
+    assert command[command.index("-ss") + 1] == "2.000"
+    assert command[command.index("-t") + 1] == "4.500"
+    assert command.index("-ss") < command.index("-i")
+    assert command[command.index("-c") + 1] == "copy"
+    assert command[-1] == "out.mp4"
@@ -0,0 +1,69 @@
+import time
+
+import numpy as np
+
+from feed_scheduler import FeedScheduler, FeedStream, SyntheticDetector, synthetic_source
+
+
+def run(scheduler, seconds):
+    scheduler.start()
+    time.sleep(seconds)
+    scheduler.stop()
+    return scheduler.report()
+
+
+def test_batch_takes_boosted_then_higher_priority_feeds_first():
+    scheduler = FeedScheduler(SyntheticDetector(), max_batch=2, max_wait_ms=0)
+    plain = FeedStream("plain", [], priority=0)
+    harbor = FeedStream("harbor", [], priority=1)
+    boosted = FeedStream("boosted", [], priority=0)
+    for stream in (plain, harbor, boosted):
+        scheduler.add_stream(stream)
+    now = time.perf_counter()
+    boosted.last_threat = now
+    frame = np.zeros((4, 4, 3), dtype=np.uint8)
+    # The plain feed's frame is the oldest, but priority comes first
+    plain.pending.append((frame, now - 0.3, 1))
+    harbor.pending.append((frame, now - 0.2, 1))
+    boosted.pending.append((frame, now - 0.1, 1))
+
+    batch = scheduler._collect()
+    assert [stream.name for stream, _ in batch] == ["boosted", "harbor"]
+    assert len(plain.pending) == 1
+
+
+def test_equal_feeds_get_an_equal_share():
+    scheduler = FeedScheduler(SyntheticDetector(launch_ms=5, per_frame_ms=1), max_batch=8, max_wait_ms=20)
+    for index in range(4):
+        scheduler.add_stream(FeedStream(f"feed-{index}", synthetic_source(1.5), fps=5))
+    report = run(scheduler, 1.6)
+
+    processed = [stream["processed"] for stream in report["streams"].values()]
+    assert min(processed) >= 4
+    assert max(processed) - min(processed) <= 2
+    assert report["mean_batch"] > 1
+    assert all(stream["dropped"] == 0 for stream in report["streams"].values())
+
+
+def test_high_threat_boosts_the_feed():
+    scheduler = FeedScheduler(SyntheticDetector(launch_ms=5, per_frame_ms=1), max_batch=8, max_wait_ms=20)
+    quiet = FeedStream("quiet", synthetic_source(1.5), fps=4, boosted_fps=20)
+    threat = FeedStream("threat", synthetic_source(1.5, threat_window=(0.1, 0.8)), fps=4, boosted_fps=20)
+    scheduler.add_stream(quiet)
+    scheduler.add_stream(threat)
+    report = run(scheduler, 1.6)
+
+    assert report["streams"]["quiet"]["boosted_frames"] == 0
+    assert report["streams"]["threat"]["boosted_frames"] > 0
+    assert report["streams"]["threat"]["processed"] > report["streams"]["quiet"]["processed"] * 1.5
+    assert threat.unique_objects["boat"] > 0
+
+
+def test_tracker_keeps_lost_tracks_for_the_same_time_when_boosted():
+    stream = FeedStream("feed", [], fps=5, boosted_fps=15)
+    now = time.perf_counter()
+    stream.retune_tracker(now)
+    assert stream.tracker.max_time_lost == 5
+    stream.last_threat = now
+    stream.retune_tracker(now)
+    assert stream.tracker.max_time_lost == 15
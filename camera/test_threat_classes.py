@@ -0,0 +1,29 @@
+import json
+
+from threat_classes import DEFAULT_HIGH_THREAT_CLASSES, HIGH_TIER, high_threat_classes
+from threat_scoring import DEFAULT_TIERS, LEVELS, ThreatScorer
+
+
+def test_default_matches_the_scorer():
+    assert LEVELS[HIGH_TIER] == "HIGH"
+    assert DEFAULT_HIGH_THREAT_CLASSES == {
+        name.casefold() for name, tier in DEFAULT_TIERS.items() if tier == HIGH_TIER}
+
+
+def test_classes_follow_the_scoring_config(tmp_path, monkeypatch):
+    config = tmp_path / "scoring.json"
+    config.write_text(json.dumps({"tiers": {"Submarine": 2, "boat": 1, "Drone": 2}}))
+    scorer = ThreatScorer.from_config(str(config))
+    expected = {"submarine", "drone"}
+    assert {name for name in expected if scorer.tier(name) == HIGH_TIER} == expected
+    assert scorer.tier("boat") < HIGH_TIER
+
+    assert high_threat_classes(str(config)) == expected
+    monkeypatch.setenv("THREAT_SCORING_CONFIG", str(config))
+    assert high_threat_classes() == expected
+
+
+def test_config_without_tiers_keeps_the_default(tmp_path):
+    config = tmp_path / "scoring.json"
+    config.write_text(json.dumps({"weights": {"boat": 1.0}}))
+    assert high_threat_classes(str(config)) == DEFAULT_HIGH_THREAT_CLASSES
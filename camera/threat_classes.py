@@ -0,0 +1,42 @@
+"""
+Detector classes the camera pipeline treats as high threat.
+
+They are the HIGH tier of the threat scorer (plan_creation/threat_scoring.py):
+its default tiers, or the `tiers` of the THREAT_SCORING_CONFIG file when that
+is set. Their tracks are published as soon as they appear
+(modal_detection.py), boost a feed's frame rate (feed_scheduler.py), get clips
+(clips.py) and keep keyframes (keyframes.py). Names are compared
+case-insensitively.
+"""
+
+import json
+import os
+from typing import Optional
+
+# Index of HIGH in threat_scoring.LEVELS
+HIGH_TIER = 2
+
+# The HIGH tier of threat_scoring.DEFAULT_TIERS, casefolded. The camera image
+# does not ship the scorer, so test_threat_classes.py keeps the two equal.
+DEFAULT_HIGH_THREAT_CLASSES = frozenset({"mines", "drone", "boat"})
+
+
+def high_threat_classes(config_path: Optional[str] = None) -> frozenset:
+    """
+    Casefolded HIGH-tier classes of a scoring config.
+
+    Args:
+        config_path: JSON config read by ThreatScorer.from_config; defaults to
+            THREAT_SCORING_CONFIG. A config without tiers uses the default tiers.
+    """
+    config_path = config_path or os.getenv("THREAT_SCORING_CONFIG")
+    if not config_path:
+        return DEFAULT_HIGH_THREAT_CLASSES
+    with open(config_path, "r") as f:
+        tiers = json.load(f).get("tiers")
+    if tiers is None:
+        return DEFAULT_HIGH_THREAT_CLASSES
+    return frozenset(name.casefold() for name, tier in tiers.items() if tier == HIGH_TIER)
+
+
+HIGH_THREAT_CLASSES = high_threat_classes()
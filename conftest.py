@@ -0,0 +1,14 @@
+"""
+pytest setup for the whole repository. The services import their siblings by
+bare name (as serve.py and gateway.py arrange), so put every service directory
+on the path.
+"""
+
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+sys.path[:0] = [ROOT] + [os.path.join(ROOT, name) for name in ("plan_creation", "camera", "sonar")]
+
+# A training script run with `python test_sonar_model.py`, not a pytest module
+collect_ignore = [os.path.join("sonar", "test_sonar_model.py")]
@@ -0,0 +1,271 @@
+"""
+Local event bus connecting the camera, analysis and alerting stages.
+
+Events are appended to a SQLite table and every consumer group keeps its own
+offset per topic, so each group sees every event on the topics it subscribes
+to (at-least-once delivery). A file-backed database lets separate processes
+publish and consume. ":memory:" gives an in-process bus.
+
+Only one process consumes a (group, topic) at a time: it holds a lease that a
+heartbeat renews. Other processes subscribed to the same group stand by and
+take over when the lease expires, so two services started with the same bus
+never handle an event twice. A handler that raises is retried with backoff;
+after `max_attempts` the event is recorded in dead_letters and skipped.
+
+Publishing applies backpressure: when the slowest group subscribed to a topic
+is `max_pending` events behind, publish() blocks until it catches up or the
+timeout expires.
+"""
+
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Any, Callable, Dict, List, Optional
+
+
+class Backpressure(Exception):
+    """Raised when a publish times out waiting for consumers to catch up"""
+
+
+class EventBus:
+    def __init__(self, path: str = ":memory:", max_pending: int = 1000, poll_interval: float = 0.05,
+                 lease_seconds: float = 15.0, max_attempts: int = 3, retry_delay: float = 0.5):
+        self.path = path
+        self.max_pending = max_pending
+        self.poll_interval = poll_interval
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        # (topic, group) subscriptions whose lease this bus holds, and those it waits for
+        self.held = set()
+        self.standby = set()
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self.lock = threading.Lock()
+        self.handlers: Dict[tuple, Callable[[Dict[str, Any]], None]] = {}
+        self.threads: List[threading.Thread] = []
+        self.stopping = threading.Event()
+        with self.lock:
+            if path != ":memory:":
+                self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.executescript("""
+                CREATE TABLE IF NOT EXISTS events (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    topic TEXT NOT NULL,
+                    payload TEXT NOT NULL,
+                    published_at REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS events_topic_id ON events (topic, id);
+                CREATE TABLE IF NOT EXISTS offsets (
+                    group_name TEXT NOT NULL,
+                    topic TEXT NOT NULL,
+                    last_id INTEGER NOT NULL,
+                    PRIMARY KEY (group_name, topic)
+                );
+                CREATE TABLE IF NOT EXISTS leases (
+                    group_name TEXT NOT NULL,
+                    topic TEXT NOT NULL,
+                    owner TEXT NOT NULL,
+                    expires_at REAL NOT NULL,
+                    PRIMARY KEY (group_name, topic)
+                );
+                CREATE TABLE IF NOT EXISTS dead_letters (
+                    group_name TEXT NOT NULL,
+                    topic TEXT NOT NULL,
+                    event_id INTEGER NOT NULL,
+                    attempts INTEGER NOT NULL,
+                    error TEXT NOT NULL,
+                    failed_at REAL NOT NULL,
+                    PRIMARY KEY (group_name, topic, event_id)
+                );
+            """)
+
+    def _lag(self, topic: str) -> int:
+        row = self.conn.execute(
+            "SELECT (SELECT COALESCE(MAX(id), 0) FROM events WHERE topic = ?) - MIN(last_id) "
+            "FROM offsets WHERE topic = ?",
+            (topic, topic),
+        ).fetchone()
+        return row[0] or 0
+
+    def publish(self, topic: str, payload: Dict[str, Any], timeout: Optional[float] = None) -> int:
+        """
+        Append an event, blocking while subscribers of the topic are too far behind.
+
+        Args:
+            topic: Topic name
+            payload: JSON-serializable event body
+            timeout: Seconds to wait for consumers before raising Backpressure
+
+        Returns:
+            The event ID
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        body = json.dumps(payload)
+        while True:
+            with self.lock:
+                if self._lag(topic) < self.max_pending:
+                    cursor = self.conn.execute(
+                        "INSERT INTO events (topic, payload, published_at) VALUES (?, ?, ?)",
+                        (topic, body, time.time()),
+                    )
+                    return cursor.lastrowid
+            if deadline is not None and time.monotonic() > deadline:
+                raise Backpressure(f"Consumers of {topic} are {self.max_pending}+ events behind")
+            time.sleep(self.poll_interval)
+
+    def subscribe(self, topic: str, group: str, handler: Callable[[Dict[str, Any]], None],
+                  from_start: bool = False):
+        """
+        Register a handler for a consumer group. A new group starts at the end of
+        the topic unless from_start is True.
+        """
+        with self.lock:
+            start = 0 if from_start else self.conn.execute(
+                "SELECT COALESCE(MAX(id), 0) FROM events WHERE topic = ?", (topic,)).fetchone()[0]
+            self.conn.execute(
+                "INSERT OR IGNORE INTO offsets (group_name, topic, last_id) VALUES (?, ?, ?)",
+                (group, topic, start),
+            )
+        self.handlers[(topic, group)] = handler
+
+    def claim(self, topic: str, group: str) -> bool:
+        """
+        Take or renew the lease on a group's topic. The upsert only succeeds when the
+        lease is free, expired or already ours, so at most one process holds it.
+        """
+        now = time.time()
+        with self.lock:
+            self.conn.execute(
+                "INSERT INTO leases (group_name, topic, owner, expires_at) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (group_name, topic) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at "
+                "WHERE leases.owner = excluded.owner OR leases.expires_at < ?",
+                (group, topic, self.owner, now + self.lease_seconds, now),
+            )
+            owner = self.conn.execute(
+                "SELECT owner FROM leases WHERE group_name = ? AND topic = ?", (group, topic)).fetchone()[0]
+        key = (topic, group)
+        if owner == self.owner:
+            self.held.add(key)
+            self.standby.discard(key)
+            return True
+        if key in self.held:
+            print(f"Lost the {group}/{topic} lease to {owner}")
+        elif key not in self.standby:
+            print(f"{owner} is consuming {group}/{topic}; standing by")
+        self.held.discard(key)
+        self.standby.add(key)
+        return False
+
+    def poll(self, topic: str, group: str, limit: int = 100) -> int:
+        """
+        Deliver pending events of a topic to a group's handler; returns how many were handled.
+        Does nothing unless this bus holds the group's lease.
+        """
+        if (topic, group) not in self.held and not self.claim(topic, group):
+            return 0
+        handler = self.handlers[(topic, group)]
+        with self.lock:
+            last_id = self.conn.execute(
+                "SELECT last_id FROM offsets WHERE group_name = ? AND topic = ?", (group, topic)).fetchone()[0]
+            rows = self.conn.execute(
+                "SELECT id, payload, published_at FROM events WHERE topic = ? AND id > ? ORDER BY id LIMIT ?",
+                (topic, last_id, limit),
+            ).fetchall()
+        handled = 0
+        for event_id, body, published_at in rows:
+            if not self._deliver(topic, group, handler, event_id, body, published_at):
+                # Stopping mid-retry: the event stays pending and is delivered again next time
+                break
+            # Commit the offset only after the event was handled or dead-lettered, so a
+            # crash redelivers at most this one event
+            with self.lock:
+                self.conn.execute(
+                    "UPDATE offsets SET last_id = ? WHERE group_name = ? AND topic = ?", (event_id, group, topic))
+            handled += 1
+            if (topic, group) not in self.held:
+                break
+        return handled
+
+    def _deliver(self, topic, group, handler, event_id, body, published_at) -> bool:
+        """Run the handler with retries; dead-letter the event once attempts run out. False when stopping."""
+        for attempt in range(1, self.max_attempts + 1):
+            event = json.loads(body)
+            event.setdefault("_published_at", published_at)
+            try:
+                handler(event)
+                return True
+            except Exception as e:
+                error = f"{type(e).__name__}: {e}"
+                print(f"Error in {group} handling {topic} event {event_id} (attempt {attempt}/{self.max_attempts}): "
+                      f"{error}")
+            if attempt < self.max_attempts and self.stopping.wait(self.retry_delay * 2 ** (attempt - 1)):
+                return False
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO dead_letters (group_name, topic, event_id, attempts, error, failed_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (group, topic, event_id, self.max_attempts, error, time.time()),
+            )
+        print(f"Dead-lettered {topic} event {event_id} for {group}")
+        return True
+
+    def dead_letters(self, group: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Events a group gave up on, with the last error"""
+        query = "SELECT group_name, topic, event_id, attempts, error, failed_at FROM dead_letters"
+        params = ()
+        if group is not None:
+            query += " WHERE group_name = ?"
+            params = (group,)
+        with self.lock:
+            rows = self.conn.execute(query + " ORDER BY failed_at", params).fetchall()
+        return [dict(zip(("group", "topic", "event_id", "attempts", "error", "failed_at"), row)) for row in rows]
+
+    def start(self):
+        """Run one consumer thread per (topic, group) subscription, plus the lease heartbeat"""
+        for topic, group in self.handlers:
+            self.claim(topic, group)
+            thread = threading.Thread(target=self._consume, args=(topic, group),
+                                      name=f"bus-{group}-{topic}", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+        thread = threading.Thread(target=self._heartbeat, name="bus-heartbeat", daemon=True)
+        thread.start()
+        self.threads.append(thread)
+
+    def stop(self):
+        self.stopping.set()
+        for thread in self.threads:
+            thread.join()
+        # Hand the subscriptions over to a standby consumer right away
+        with self.lock:
+            self.conn.execute("DELETE FROM leases WHERE owner = ?", (self.owner,))
+        self.held.clear()
+
+    def _heartbeat(self):
+        """Renew held leases, and take over ones whose owner stopped renewing"""
+        while not self.stopping.wait(self.lease_seconds / 3):
+            for topic, group in list(self.handlers):
+                self.claim(topic, group)
+
+    def _consume(self, topic: str, group: str):
+        while not self.stopping.is_set():
+            if (topic, group) not in self.held:
+                # Standing by; the heartbeat takes the lease once it is free
+                self.stopping.wait(self.poll_interval)
+                continue
+            if not self.poll(topic, group):
+                self.stopping.wait(self.poll_interval)
+
+    def lag(self) -> Dict[str, int]:
+        """Events each (group, topic) still has to process"""
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT o.group_name, o.topic, "
+                "(SELECT COALESCE(MAX(id), 0) FROM events WHERE topic = o.topic) - o.last_id FROM offsets o"
+            ).fetchall()
+        return {f"{group}/{topic}": lag for group, topic, lag in rows}
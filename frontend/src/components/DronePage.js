@@ -1,14 +1,16 @@
-import React, { useState, useEffect } from 'react';
-import { Box, Paper, Typography, Grid } from '@mui/material';
+import React, { useState, useEffect, useRef } from 'react';
+import { Box, Paper, Typography, Grid, Chip } from '@mui/material';
 import { useParams } from 'react-router-dom';
 import { keyframes } from '@mui/system';
 import Sentral from './Sentral';
 import DetectionStats from './DetectionStats';
 import AlertLevel from './AlertLevel';
+import SpriteScrubber from './SpriteScrubber';
 import VisibilityIcon from '@mui/icons-material/Visibility';
 import SpeedIcon from '@mui/icons-material/Speed';
 import VerifiedIcon from '@mui/icons-material/Verified';
 import AccessTimeIcon from '@mui/icons-material/AccessTime';
+import { GATEWAY_URL } from '../services/api';
 
 const glowPulse = keyframes`
   0% { box-shadow: 0 0 10px rgba(0, 255, 200, 0.5); }
@@ -19,7 +21,14 @@ const glowPulse = keyframes`
 const DronePage = () => {
   const { id } = useParams();
   const [detectionData, setDetectionData] = useState(null);
+  const [videoId, setVideoId] = useState(id);
   const [videoSrc, setVideoSrc] = useState('');
+  // Thumbnail track for scrub previews of the full video
+  const [spriteVttSrc, setSpriteVttSrc] = useState(null);
+  const videoRef = useRef(null);
+  // Threat clips cut around high-threat tracks; null plays the full video
+  const [clips, setClips] = useState([]);
+  const [clipIndex, setClipIndex] = useState(null);
   const [error, setError] = useState(null);
   const [stats, setStats] = useState({
     fps: 0,
@@ -32,7 +41,7 @@ const DronePage = () => {
     const getVideoSource = async () => {
       // First try the numbered format
       let processedVideoSrc = `/processed_output/${id}.mp4`;
-      let jsonPath = `/processed_output/${id}.json`;
+      let detectionVideoId = id;
       
       // Check if it's one of the bottom three videos
       if (parseInt(id) >= 4) {
@@ -45,24 +54,34 @@ const DronePage = () => {
         const drone = drones.find(d => d.id === parseInt(id));
         if (drone) {
           processedVideoSrc = `/processed_output/${drone.filename}_detected.mp4`;
-          jsonPath = `/processed_output/${drone.filename}_detections.json`;
+          detectionVideoId = drone.filename;
         }
       }
 
       setVideoSrc(processedVideoSrc);
+      setVideoId(detectionVideoId);
 
       try {
-        const response = await fetch(jsonPath);
+        // Summary with server-computed totals from the detection API
+        const response = await fetch(`${GATEWAY_URL}/api/videos/${encodeURIComponent(detectionVideoId)}`);
         if (!response.ok) throw new Error('Failed to load detection data');
         const data = await response.json();
         setDetectionData(data);
-        if (data.video_info) {
-          setStats(prev => ({
-            ...prev,
-            fps: data.video_info.fps || 0,
-            totalDetections: Object.values(data.unique_objects || {}).reduce((a, b) => a + b, 0)
-          }));
+        // The MP4 is faststart, so it plays and seeks with range requests; the
+        // sprite sheet gives scrub previews without fetching any video
+        if (data.streams && data.streams.sprite_vtt) {
+          setSpriteVttSrc(`/processed_output/${data.streams.sprite_vtt}`);
         }
+        // Open on the first threat clip instead of the full-length recording
+        if (data.clips && data.clips.length > 0) {
+          setClips(data.clips);
+          setClipIndex(0);
+        }
+        setStats(prev => ({
+          ...prev,
+          fps: data.fps || 0,
+          totalDetections: data.total_detections
+        }));
       } catch (err) {
         console.error('Error loading detection data:', err);
         setError('Failed to load detection data');
@@ -193,7 +212,8 @@ const DronePage = () => {
           >
             <Box
               component="video"
-              src={videoSrc}
+              ref={videoRef}
+              key={clipIndex !== null ? clips[clipIndex].file : videoSrc}
               autoPlay
               loop
               muted
@@ -203,9 +223,41 @@ const DronePage = () => {
                 height: '100%',
                 objectFit: 'contain'
               }}
-            />
+            >
+              {clipIndex !== null ? (
+                <source src={`/processed_output/${clips[clipIndex].file}`} type="video/mp4" />
+              ) : (
+                <source src={videoSrc} type="video/mp4" />
+              )}
+            </Box>
           </Paper>
 
+          {/* Scrub previews of the full video */}
+          {clipIndex === null && spriteVttSrc && (
+            <SpriteScrubber vttSrc={spriteVttSrc} videoRef={videoRef} />
+          )}
+
+          {/* Threat clips */}
+          {clips.length > 0 && (
+            <Box sx={{ display: 'flex', flexWrap: 'wrap', gap: 1, mb: 3 }}>
+              {clips.map((clip, index) => (
+                <Chip
+                  key={clip.file}
+                  label={`${Object.keys(clip.classes).join(', ')} ${clip.start_s.toFixed(0)}-${clip.end_s.toFixed(0)}s`}
+                  onClick={() => setClipIndex(index)}
+                  color={clipIndex === index ? 'error' : 'default'}
+                  variant={clipIndex === index ? 'filled' : 'outlined'}
+                />
+              ))}
+              <Chip
+                label="Full video"
+                onClick={() => setClipIndex(null)}
+                color={clipIndex === null ? 'primary' : 'default'}
+                variant={clipIndex === null ? 'filled' : 'outlined'}
+              />
+            </Box>
+          )}
+
           {/* Stats Grid */}
           <Box sx={{ display: 'flex', justifyContent: 'center', width: '100%', mb: 3 }}>
             <Grid container spacing={2} sx={{ maxWidth: '1000px' }}>
@@ -270,7 +322,7 @@ const DronePage = () => {
           backdropFilter: 'blur(10px)',
           overflow: 'hidden'
         }}>
-          <Sentral detectionData={detectionData} />
+          <Sentral detectionData={detectionData} videoId={videoId} />
         </Box>
       </Box>
     </Box>
@@ -278,8 +330,8 @@ const DronePage = () => {
 };
 
 const calculateAlertLevel = (data) => {
-  if (!data?.unique_objects) return 'LOW';
-  const totalObjects = Object.values(data.unique_objects).reduce((a, b) => a + b, 0);
+  if (data?.total_detections === undefined) return 'LOW';
+  const totalObjects = data.total_detections;
   if (totalObjects > 50) return 'CRITICAL';
   if (totalObjects > 30) return 'HIGH';
   if (totalObjects > 10) return 'MEDIUM';
@@ -5,6 +5,7 @@ import SmartToyIcon from '@mui/icons-material/SmartToy';
 import AccountCircleIcon from '@mui/icons-material/AccountCircle';
 import MicIcon from '@mui/icons-material/Mic';
 import StopIcon from '@mui/icons-material/Stop';
+import { GATEWAY_URL } from '../services/api';
 
 const Sentral = ({ detectionData, videoId }) => {
   const [messages, setMessages] = useState([]);
@@ -65,7 +66,7 @@ const Sentral = ({ detectionData, videoId }) => {
           }
           
           // Create audio blob from recorded chunks
-          const audioBlob = new Blob(audioChunksRef.current, { type: 'audio/mp3' });
+          const audioBlob = new Blob(audioChunksRef.current, { type: mediaRecorder.mimeType || 'audio/webm' });
           audioChunksRef.current = [];
           
           // Process the recorded audio
@@ -106,25 +107,52 @@ const Sentral = ({ detectionData, videoId }) => {
       
       // Create FormData and append the audio blob
       const formData = new FormData();
-      formData.append('audio', audioBlob, 'recording.mp3');
+      formData.append('audio', audioBlob, 'recording');
       
       // Add threat data if available
       if (detectionData) {
         formData.append('threatData', JSON.stringify(detectionData));
       }
       
-      // Send to our custom endpoint
-      const response = await fetch('http://localhost:5003/api/voice-upload', {
+      // Send to our custom endpoint; the transcript streams back piece by piece
+      // (one JSON object per line) ahead of the final answer
+      const response = await fetch(`${GATEWAY_URL}/api/voice-upload`, {
         method: 'POST',
+        headers: { 'Accept': 'application/x-ndjson' },
         body: formData
       });
       
-      const data = await response.json();
+      const reader = response.body.getReader();
+      const decoder = new TextDecoder();
+      const heard = [];
+      let buffered = '';
+      let data = {};
+      for (;;) {
+        const { done, value } = await reader.read();
+        buffered += decoder.decode(value || new Uint8Array(), { stream: !done });
+        const lines = buffered.split('\n');
+        buffered = done ? '' : lines.pop();
+        for (const line of lines.filter(Boolean)) {
+          const event = JSON.parse(line);
+          if (event.success || event.error) {
+            data = event;
+          } else if (event.transcription) {
+            // Show what has been heard so far while the rest is transcribed
+            heard.push(event.transcription);
+            const partial = `Heard so far: ${heard.join(' ')}`;
+            setMessages(prev => [
+              ...prev.filter(msg => !(msg.sender === 'system' && msg.partial)),
+              { text: partial, sender: 'system', partial: true, timestamp: new Date() }
+            ]);
+          }
+        }
+        if (done) break;
+      }
       
       if (data.success) {
         // Add transcription to chat
         setMessages(prev => prev.filter(msg => 
-          msg.text !== "Processing your voice input..." || msg.sender !== 'system'
+          (msg.text !== "Processing your voice input..." || msg.sender !== 'system') && !msg.partial
         ));
         
         setMessages(prev => [...prev, {
@@ -151,7 +179,7 @@ const Sentral = ({ detectionData, videoId }) => {
     } catch (error) {
       console.error('Error in audio upload:', error);
       setMessages(prev => prev.filter(msg => 
-        msg.text !== "Processing your voice input..." || msg.sender !== 'system'
+        (msg.text !== "Processing your voice input..." || msg.sender !== 'system') && !msg.partial
       ));
       
       setMessages(prev => [...prev, {
@@ -173,7 +201,7 @@ const Sentral = ({ detectionData, videoId }) => {
     }]);
 
     try {
-      const response = await fetch('http://localhost:5003/api/voice-chat', {
+      const response = await fetch(`${GATEWAY_URL}/api/voice-chat`, {
         method: 'POST',
         headers: {
           'Content-Type': 'application/json',
@@ -220,38 +248,27 @@ const Sentral = ({ detectionData, videoId }) => {
   };
 
   useEffect(() => {
-    // When detectionData changes, fetch and display the analysis
-    if (detectionData) {
-      // Simulate fetching analysis from the text file
-      const analysisText = `THREAT ANALYSIS:
-      1. THREAT IDENTIFICATION:
-      - High Threat Objects: ${Object.entries(detectionData.unique_objects)
-        .filter(([obj]) => ['Mines', 'Drone', 'boat'].includes(obj))
-        .map(([obj, count]) => `${obj} (${count})`).join(', ')}
-      - Medium Threat Objects: ${Object.entries(detectionData.unique_objects)
-        .filter(([obj]) => ['truck', 'car', 'airplane', 'person'].includes(obj))
-        .map(([obj, count]) => `${obj} (${count})`).join(', ')}
-      
-      2. RISK ASSESSMENT:
-      - Overall Threat Level: ${Object.keys(detectionData.unique_objects).some(obj => 
-        ['Mines', 'Drone', 'boat'].includes(obj)) ? 'HIGH' : 'MEDIUM'}
-      - Video Duration: ${detectionData.video_info.total_frames / detectionData.video_info.fps} seconds
-      - Resolution: ${detectionData.video_info.resolution}
-
-      3. RECOMMENDATIONS:
-      ${Object.keys(detectionData.unique_objects).some(obj => 
-        ['Mines', 'Drone', 'boat'].includes(obj)) ? 
-        '- IMMEDIATE ACTIONS:\n  * Alert maritime security forces\n  * Deploy rapid response team\n  * Establish 1000m safety perimeter' :
-        '- STANDARD PROCEDURES:\n  * Continue monitoring\n  * Document observations'}`;
-
-      setMessages([{
-        text: analysisText,
-        sender: 'ai',
-        timestamp: new Date(),
-        isAnalysis: true
-      }]);
-    }
-  }, [detectionData]);
+    // Show the server-side threat analysis for the selected video
+    if (!videoId) return;
+    const controller = new AbortController();
+    fetch(`${GATEWAY_URL}/api/videos/${encodeURIComponent(videoId)}/analysis`, { signal: controller.signal })
+      .then(response => {
+        if (!response.ok) throw new Error('Failed to load threat analysis');
+        return response.json();
+      })
+      .then(analysis => {
+        setMessages([{
+          text: `THREAT ANALYSIS:\n${analysis.report}`,
+          sender: 'ai',
+          timestamp: new Date(),
+          isAnalysis: true
+        }]);
+      })
+      .catch(err => {
+        if (err.name !== 'AbortError') console.error('Error loading threat analysis:', err);
+      });
+    return () => controller.abort();
+  }, [videoId]);
 
   const handleEmergencyCall = async () => {
     const emergencyMessage = "🚨 EMERGENCY SERVICES NOTIFIED 🚨\nImmediate response teams have been alerted and are being dispatched to your location.\n\nPriority: HIGH\nResponse Units: Maritime Security, Coast Guard\nETA: 8-12 minutes\nAction Required: Maintain safe distance, continue monitoring";
@@ -264,14 +281,15 @@ const Sentral = ({ detectionData, videoId }) => {
     }]);
 
     try {
-      const response = await fetch('http://localhost:5001/api/emergency-call', {
+      const response = await fetch(`${GATEWAY_URL}/api/emergency-call`, {
         method: 'POST',
         headers: {
           'Content-Type': 'application/json',
         },
         body: JSON.stringify({
           message: emergencyMessage,
-          recipientNumber: '+17326198162'
+          recipientNumber: '+17326198162',
+          threat: detectionData ? { objects: detectionData.unique_objects } : undefined
         })
       });
 
@@ -13,6 +13,7 @@ import {
 } from '@mui/material';
 import DeleteIcon from '@mui/icons-material/Delete';
 import AddIcon from '@mui/icons-material/Add';
+import { GATEWAY_URL } from '../services/api';
 
 const SonarDetection = () => {
     const [readings, setReadings] = useState(['']);
@@ -53,7 +54,7 @@ const SonarDetection = () => {
             }
 
             // Send to backend
-            const response = await fetch('http://localhost:5001/api/predict', {
+            const response = await fetch(`${GATEWAY_URL}/api/predict`, {
                 method: 'POST',
                 headers: {
                     'Content-Type': 'application/json',
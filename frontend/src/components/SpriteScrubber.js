@@ -0,0 +1,111 @@
+import React, { useState, useEffect } from 'react';
+import { Box, Typography } from '@mui/material';
+
+// "00:01:02.500" -> 62.5
+const parseTimestamp = (text) =>
+  text.split(':').reduce((total, part) => total * 60 + parseFloat(part), 0);
+
+// WebVTT thumbnail track: each cue maps a time range to a sprite tile (file#xywh=x,y,w,h)
+const parseSpriteVtt = (text, baseUrl) => {
+  const cues = [];
+  const lines = text.split('\n').map(line => line.trim());
+  lines.forEach((line, index) => {
+    if (!line.includes('-->')) return;
+    const [start, end] = line.split('-->').map(part => parseTimestamp(part.trim()));
+    const [file, fragment] = (lines[index + 1] || '').split('#xywh=');
+    if (!fragment) return;
+    const [x, y, width, height] = fragment.split(',').map(Number);
+    cues.push({ start, end, url: `${baseUrl}/${file}`, x, y, width, height });
+  });
+  return cues;
+};
+
+const formatTime = (seconds) =>
+  `${Math.floor(seconds / 60)}:${String(Math.floor(seconds % 60)).padStart(2, '0')}`;
+
+/**
+ * Scrub bar with thumbnail previews from the sprite sheet written by the camera
+ * encode. Hovering shows the frame at that time from the one sprite image, so
+ * scrubbing fetches no video; clicking seeks the player there.
+ */
+const SpriteScrubber = ({ vttSrc, videoRef }) => {
+  const [cues, setCues] = useState([]);
+  const [hover, setHover] = useState(null);
+
+  useEffect(() => {
+    let cancelled = false;
+    const baseUrl = vttSrc.substring(0, vttSrc.lastIndexOf('/'));
+    fetch(vttSrc)
+      .then(response => (response.ok ? response.text() : ''))
+      .then(text => {
+        if (!cancelled) setCues(parseSpriteVtt(text, baseUrl));
+      })
+      .catch(err => console.error('Error loading thumbnail track:', err));
+    return () => { cancelled = true; };
+  }, [vttSrc]);
+
+  if (cues.length === 0) return null;
+  const duration = cues[cues.length - 1].end;
+
+  const timeAt = (event) => {
+    const rect = event.currentTarget.getBoundingClientRect();
+    const fraction = Math.min(1, Math.max(0, (event.clientX - rect.left) / rect.width));
+    return { fraction, time: fraction * duration };
+  };
+
+  const handleMove = (event) => {
+    const { fraction, time } = timeAt(event);
+    const cue = cues.find(c => time >= c.start && time < c.end) || cues[cues.length - 1];
+    setHover({ fraction, time, cue });
+  };
+
+  const handleClick = (event) => {
+    if (videoRef.current) {
+      videoRef.current.currentTime = timeAt(event).time;
+    }
+  };
+
+  return (
+    <Box
+      onMouseMove={handleMove}
+      onMouseLeave={() => setHover(null)}
+      onClick={handleClick}
+      sx={{
+        position: 'relative',
+        height: '12px',
+        borderRadius: '6px',
+        bgcolor: 'rgba(255,255,255,0.1)',
+        cursor: 'pointer'
+      }}
+    >
+      {hover && (
+        <Box
+          sx={{
+            position: 'absolute',
+            bottom: '18px',
+            left: `${hover.fraction * 100}%`,
+            transform: 'translateX(-50%)',
+            pointerEvents: 'none',
+            zIndex: 1
+          }}
+        >
+          <Box
+            sx={{
+              width: `${hover.cue.width}px`,
+              height: `${hover.cue.height}px`,
+              backgroundImage: `url(${hover.cue.url})`,
+              backgroundPosition: `-${hover.cue.x}px -${hover.cue.y}px`,
+              border: '1px solid rgba(255,255,255,0.3)',
+              borderRadius: '4px'
+            }}
+          />
+          <Typography variant="caption" sx={{ display: 'block', textAlign: 'center', color: '#fff' }}>
+            {formatTime(hover.time)}
+          </Typography>
+        </Box>
+      )}
+    </Box>
+  );
+};
+
+export default SpriteScrubber;
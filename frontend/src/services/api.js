@@ -1,6 +1,8 @@
 import axios from 'axios';
 
 const API_BASE_URL = process.env.REACT_APP_API_BASE_URL || 'http://localhost:8000';
+// gateway.py serves the sonar, voice and emergency call routes from one process
+export const GATEWAY_URL = process.env.REACT_APP_GATEWAY_URL || 'http://localhost:5050';
 
 export const analyzeThreat = async (sonarData, cameraData) => {
   try {
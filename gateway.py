@@ -0,0 +1,87 @@
+"""
+Single process serving the sonar, voice and emergency call routes.
+
+The three service modules are imported once, so the sonar model, the shared
+Gemini client, the LLM router (with its request coalescing) and the Twilio
+client each exist once and are shared by every route. Requests are handed to
+the service app whose URL map matches, which keeps each service's own request
+class, upload limits and metrics.
+
+    python serve.py gateway          # production, port 5050
+    python gateway.py                # development server
+"""
+
+import importlib.util
+import os
+import sys
+
+from flask import Flask
+from flask_cors import CORS
+from werkzeug.exceptions import MethodNotAllowed, NotFound
+from werkzeug.routing import RequestRedirect
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+# The one place the import path is set for the gateway: the shared root modules
+# (instrumentation, event_bus), and the service directories, whose modules
+# import their neighbours by bare name
+sys.path[:0] = [ROOT, os.path.join(ROOT, "plan_creation"), os.path.join(ROOT, "sonar")]
+from instrumentation import instrument_flask
+
+SERVICE_FILES = {
+    "sonar": os.path.join("sonar", "app.py"),
+    "voice": os.path.join("plan_creation", "voice_interaction_service.py"),
+    "emergency": os.path.join("plan_creation", "emergency_call_service.py"),
+    "detections": os.path.join("plan_creation", "detection_api.py"),
+}
+
+
+def load_service(name: str, relative_path: str):
+    """Import a service module from its file under a unique module name"""
+    spec = importlib.util.spec_from_file_location(f"sentral_{name}", os.path.join(ROOT, relative_path))
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[spec.name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+class ServiceRouter:
+    """WSGI middleware sending each request to the first service app with a matching route"""
+
+    def __init__(self, fallback, apps):
+        self.fallback = fallback
+        self.apps = apps
+
+    def __call__(self, environ, start_response):
+        for service_app in self.apps:
+            try:
+                service_app.url_map.bind_to_environ(environ).match()
+            except NotFound:
+                continue
+            except (MethodNotAllowed, RequestRedirect):
+                pass
+            return service_app(environ, start_response)
+        return self.fallback(environ, start_response)
+
+
+services = {name: load_service(name, path) for name, path in SERVICE_FILES.items()}
+
+app = Flask(__name__)
+CORS(app)
+instrument_flask(app, "gateway")
+app.wsgi_app = ServiceRouter(app.wsgi_app, [module.app for module in services.values()])
+
+
+def ready():
+    """Readiness checks of every mounted service, reported by serve.py at /readyz"""
+    checks = {}
+    for name, module in services.items():
+        if hasattr(module, "ready"):
+            checks.update({f"{name}.{check}": ok for check, ok in module.ready().items()})
+    return checks
+
+
+if __name__ == "__main__":
+    # Development server; use `python serve.py gateway` in production
+    from detection_store import index_json_dir
+    index_json_dir()
+    app.run(port=5050, threaded=True)
@@ -0,0 +1,434 @@
+"""
+Metrics and tracing shared by the Flask services and the Modal functions.
+
+Histograms and counters live in a process-wide registry and are exported in
+the Prometheus text format. span() times a stage (decode, inference, LLM call,
+transcription, Twilio dispatch...) into the stage histogram. When TRACE_DUMP
+is set, sampled spans are also appended to that file as Chrome trace events
+(open it in chrome://tracing or ui.perfetto.dev).
+
+A service running several worker processes (serve.py sets METRICS_DIR for
+that) shares its metrics through a directory: every process writes a
+snapshot of its registry there and /metrics sums them, so each scrape reports
+the service's totals whichever worker answers it.
+
+Recording a span costs a couple of microseconds: a bisect into the bucket
+list under a lock. Trace events are buffered and written in batches.
+"""
+
+import atexit
+import bisect
+import json
+import os
+import random
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Tuple
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Directory shared by the worker processes of one service, and how often each
+# process writes its snapshot there
+METRICS_DIR = os.getenv("METRICS_DIR")
+METRICS_FLUSH_S = float(os.getenv("METRICS_FLUSH_S", "1"))
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.values: Dict[Tuple[str, ...], float] = {}
+        self.lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0.0) + amount
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            values = [[list(key), value] for key, value in self.values.items()]
+        return {"type": "counter", "help": self.help, "labelnames": list(self.labelnames), "values": values}
+
+    def merge(self, snapshot: dict):
+        """Add the values of another process's snapshot"""
+        with self.lock:
+            for key, value in snapshot["values"]:
+                key = tuple(key)
+                self.values[key] = self.values.get(key, 0.0) + value
+
+    def reset(self):
+        self.lock = threading.Lock()
+        self.values = {}
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self.lock:
+            for key, value in sorted(self.values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {value:g}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, labelnames: Tuple[str, ...] = (), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # label values -> [per-bucket counts (+Inf last), sum, count]
+        self.series: Dict[Tuple[str, ...], list] = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.series.get(key)
+            if series is None:
+                series = self.series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            series = [[list(key), list(counts), total, count] for key, (counts, total, count) in self.series.items()]
+        return {"type": "histogram", "help": self.help, "labelnames": list(self.labelnames),
+                "buckets": list(self.buckets), "series": series}
+
+    def merge(self, snapshot: dict):
+        """Add the observations of another process's snapshot"""
+        with self.lock:
+            for key, counts, total, count in snapshot["series"]:
+                series = self.series.setdefault(tuple(key), [[0] * (len(self.buckets) + 1), 0.0, 0])
+                series[0] = [mine + theirs for mine, theirs in zip(series[0], counts)]
+                series[1] += total
+                series[2] += count
+
+    def reset(self):
+        self.lock = threading.Lock()
+        self.series = {}
+
+    def summary(self, since: Optional[Dict[Tuple[str, ...], Dict[str, float]]] = None
+                ) -> Dict[Tuple[str, ...], Dict[str, float]]:
+        """
+        Count, total and mean per label set.
+
+        Args:
+            since: An earlier summary to subtract, so a long-lived process can
+                report what one piece of work observed. Label sets with no new
+                observations are left out.
+        """
+        with self.lock:
+            totals = {key: (count, total) for key, (_, total, count) in self.series.items()}
+        result = {}
+        for key, (count, total) in totals.items():
+            if since and key in since:
+                count -= since[key]["count"]
+                total -= since[key]["sum"]
+            if since is not None and count == 0:
+                continue
+            result[key] = {"count": count, "sum": total, "mean": total / count if count else 0.0}
+        return result
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            series = [(key, list(counts), total, count) for key, (counts, total, count) in self.series.items()]
+        for key, counts, total, count in sorted(series):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = "+Inf" if bound == float("inf") else f"{bound:g}"
+                bucket_labels = _format_labels(self.labelnames, key, 'le="%s"' % le)
+                lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {total:g}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: Dict[str, object] = {}
+        self.lock = threading.Lock()
+        # MetricsStore shared with the other worker processes, if any
+        self.store: Optional["MetricsStore"] = None
+
+    def _get(self, cls, name, help, labelnames, **kwargs):
+        with self.lock:
+            metric = self.metrics.get(name)
+            if metric is None:
+                metric = self.metrics[name] = cls(name, help, tuple(labelnames), **kwargs)
+            return metric
+
+    def counter(self, name: str, help: str, labelnames=()) -> Counter:
+        return self._get(Counter, name, help, labelnames)
+
+    def histogram(self, name: str, help: str, labelnames=(), buckets=DEFAULT_BUCKETS) -> Histogram:
+        return self._get(Histogram, name, help, labelnames, buckets=buckets)
+
+    def snapshot(self) -> Dict[str, dict]:
+        """Every metric's values, JSON-serializable"""
+        with self.lock:
+            metrics = list(self.metrics.values())
+        return {metric.name: metric.snapshot() for metric in metrics}
+
+    def reset(self):
+        """
+        Drop every recorded value, in a freshly forked worker. The locks are
+        replaced too, since fork copies them in whatever state they were in.
+        """
+        self.lock = threading.Lock()
+        for metric in self.metrics.values():
+            metric.reset()
+
+    def render(self) -> str:
+        """All metrics in the Prometheus text exposition format, summed over worker processes"""
+        if self.store is not None:
+            metrics = self.store.combined()
+        else:
+            with self.lock:
+                metrics = list(self.metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+class TraceWriter:
+    """Buffers Chrome trace events and appends them to a file in batches"""
+
+    def __init__(self, path: str, sample_rate: float = 1.0, flush_every: int = 256):
+        self.path = path
+        self.sample_rate = sample_rate
+        self.flush_every = flush_every
+        self.buffer: List[str] = []
+        self.lock = threading.Lock()
+        # The trace viewers accept an unterminated JSON array, so events can simply be appended
+        if not os.path.exists(path) or os.path.getsize(path) == 0:
+            with open(path, "w") as f:
+                f.write("[\n")
+        atexit.register(self.flush)
+
+    def record(self, name: str, start: float, duration: float, args: Dict[str, str]):
+        event = json.dumps({
+            "name": name, "ph": "X", "pid": os.getpid(), "tid": threading.get_ident(),
+            "ts": round(start * 1e6), "dur": round(duration * 1e6), "args": args,
+        })
+        with self.lock:
+            self.buffer.append(event)
+            if len(self.buffer) < self.flush_every:
+                return
+            pending, self.buffer = self.buffer, []
+        self._write(pending)
+
+    def flush(self):
+        with self.lock:
+            pending, self.buffer = self.buffer, []
+        self._write(pending)
+
+    def _write(self, events: List[str]):
+        if events:
+            with open(self.path, "a") as f:
+                f.write(",\n".join(events) + ",\n")
+
+
+class MetricsStore:
+    """
+    Shares a registry with the other worker processes of a service.
+
+    Each process writes a snapshot of its registry to its own file in
+    `directory` every `flush_s` seconds (atomically, by rename), and combined()
+    sums its live values with every other process's last snapshot. Files of
+    workers that exited are kept, so counters never go backwards when gunicorn
+    replaces a worker.
+    """
+
+    def __init__(self, registry: Registry, directory: str, flush_s: float = 1.0):
+        self.registry = registry
+        self.directory = directory
+        self.flush_s = flush_s
+        os.makedirs(directory, exist_ok=True)
+        self.path = self._new_path()
+
+    def _new_path(self) -> str:
+        # The random part keeps a reused pid from overwriting an exited worker's totals
+        return os.path.join(self.directory, f"{os.getpid()}-{uuid.uuid4().hex[:8]}.json")
+
+    def start(self):
+        threading.Thread(target=self._run, name="metrics-store", daemon=True).start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.flush_s)
+            try:
+                self.flush()
+            except OSError as e:
+                print(f"Error writing metrics snapshot: {e}")
+
+    def flush(self):
+        temporary = self.path + ".tmp"
+        with open(temporary, "w") as f:
+            json.dump(self.registry.snapshot(), f)
+        os.replace(temporary, self.path)
+
+    def after_fork(self):
+        """In a new worker: the parent's values are in the parent's file, so start from zero"""
+        self.registry.reset()
+        self.path = self._new_path()
+        self.start()
+
+    def combined(self) -> list:
+        """Metrics holding this process's values plus every other process's snapshot"""
+        snapshots = [self.registry.snapshot()]
+        for name in sorted(os.listdir(self.directory)):
+            path = os.path.join(self.directory, name)
+            if not name.endswith(".json") or path == self.path:
+                continue
+            try:
+                with open(path, "r") as f:
+                    snapshots.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+        merged: Dict[str, object] = {}
+        for snapshot in snapshots:
+            for name, data in snapshot.items():
+                metric = merged.get(name)
+                if metric is None:
+                    if data["type"] == "counter":
+                        metric = Counter(name, data["help"], tuple(data["labelnames"]))
+                    else:
+                        metric = Histogram(name, data["help"], tuple(data["labelnames"]), data["buckets"])
+                    merged[name] = metric
+                metric.merge(data)
+        return list(merged.values())
+
+
+registry = Registry()
+
+if METRICS_DIR:
+    registry.store = MetricsStore(registry, METRICS_DIR, METRICS_FLUSH_S)
+    registry.store.start()
+    atexit.register(registry.store.flush)
+    # The preloading master records its own observations before forking the workers
+    os.register_at_fork(before=registry.store.flush, after_in_child=registry.store.after_fork)
+
+stage_seconds = registry.histogram(
+    "sentral_stage_duration_seconds", "Time spent in each processing stage", ("service", "stage"))
+errors_total = registry.counter(
+    "sentral_errors_total", "Errors by service and stage", ("service", "stage"))
+cache_total = registry.counter(
+    "sentral_cache_requests_total", "Cache lookups by cache and result", ("cache", "result"))
+
+_trace_path = os.getenv("TRACE_DUMP")
+tracer: Optional[TraceWriter] = (
+    TraceWriter(_trace_path, float(os.getenv("TRACE_SAMPLE_RATE", 1.0))) if _trace_path else None)
+
+
+class Span:
+    """Timing of one stage; `duration` (seconds) is set when the block exits"""
+
+    __slots__ = ("service", "stage", "labels", "duration")
+
+    def __init__(self, service: str, stage: str, labels: Dict[str, str]):
+        self.service = service
+        self.stage = stage
+        self.labels = labels
+        self.duration = 0.0
+
+
+@contextmanager
+def span(service: str, stage: str, **labels):
+    """
+    Time a block as a stage of a service. Exceptions are counted in
+    sentral_errors_total and re-raised. Extra labels only go to the trace.
+    """
+    current = Span(service, stage, labels)
+    started = time.perf_counter()
+    try:
+        yield current
+    except Exception:
+        errors_total.inc(service=service, stage=stage)
+        raise
+    finally:
+        current.duration = time.perf_counter() - started
+        stage_seconds.observe(current.duration, service=service, stage=stage)
+        if tracer is not None and (tracer.sample_rate >= 1.0 or random.random() < tracer.sample_rate):
+            tracer.record(stage, time.time() - current.duration, current.duration,
+                          dict(labels, service=service))
+
+
+def count_cache(cache: str, hit: bool):
+    cache_total.inc(cache=cache, result="hit" if hit else "miss")
+
+
+def count_error(service: str, stage: str):
+    errors_total.inc(service=service, stage=stage)
+
+
+def instrument_flask(app, service: str):
+    """
+    Record latency and status of every request to a Flask app and serve the
+    registry at /metrics.
+    """
+    from flask import Response, g, request
+
+    request_seconds = registry.histogram(
+        "sentral_http_request_duration_seconds", "HTTP request latency",
+        ("service", "endpoint", "method", "status"))
+
+    @app.before_request
+    def _start_timer():
+        g.instrumentation_started = time.perf_counter()
+
+    @app.after_request
+    def _record_request(response):
+        started = getattr(g, "instrumentation_started", None)
+        if started is not None:
+            duration = time.perf_counter() - started
+            endpoint = request.url_rule.rule if request.url_rule is not None else "unmatched"
+            request_seconds.observe(duration, service=service, endpoint=endpoint,
+                                    method=request.method, status=response.status_code)
+            if response.status_code >= 500:
+                errors_total.inc(service=service, stage="http")
+            if tracer is not None:
+                tracer.record(f"{request.method} {endpoint}", time.time() - duration, duration,
+                              {"service": service, "status": str(response.status_code)})
+        return response
+
+    @app.route("/metrics")
+    def metrics():
+        return Response(registry.render(), mimetype="text/plain; version=0.0.4")
+
+    return app
+
+
+if __name__ == "__main__":
+    # Per-span overhead with tracing disabled
+    n = 200000
+    started = time.perf_counter()
+    for _ in range(n):
+        pass
+    baseline = time.perf_counter() - started
+    started = time.perf_counter()
+    for _ in range(n):
+        with span("bench", "noop"):
+            pass
+    elapsed = time.perf_counter() - started
+    print(f"span overhead: {(elapsed - baseline) / n * 1e6:.2f} us per span")
+    print(registry.render())
@@ -0,0 +1,533 @@
+"""
+Continuous batching generation engine for the Llama service.
+
+Concurrent `generate` calls are queued and a single scheduler thread runs the
+model. Every decode iteration it retires finished sequences, admits waiting
+requests into the running batch (prefilled separately, then merged into the
+batch KV cache), and advances every active sequence by one token. Prompts are
+left-padded and admission prefers requests of similar length so padding waste
+stays bounded.
+
+Prompts that start with a registered prefix (the fixed system prompt or an
+instruction preamble) skip re-encoding it: the prefix KV cache is computed
+once, kept in a bounded LRU, and each matching request only prefills its
+suffix.
+
+The engine only needs a Hugging Face causal LM, so it can be exercised on CPU
+with a tiny randomly initialised model:
+
+    python llama_engine.py
+"""
+
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import Future
+from typing import Any, Dict, List, Optional, Sequence
+
+
+class GenerationRequest:
+    def __init__(self, prompt_ids: Sequence[int], max_new_tokens: int, temperature: float, top_p: float):
+        self.prompt_ids = list(prompt_ids)
+        self.max_new_tokens = max_new_tokens
+        self.temperature = temperature
+        self.top_p = top_p
+        self.generated: List[int] = []
+        self.future: Future = Future()
+        self.enqueued_at = time.perf_counter()
+
+
+def cache_tensors(cache) -> List[tuple]:
+    """Per-layer (key, value) tensors of a DynamicCache, across transformers versions"""
+    if hasattr(cache, "layers"):
+        return [(layer.keys, layer.values) for layer in cache.layers]
+    return list(zip(cache.key_cache, cache.value_cache))
+
+
+def build_cache(tensors: List[tuple]):
+    from transformers import DynamicCache
+
+    cache = DynamicCache()
+    for layer_idx, (keys, values) in enumerate(tensors):
+        cache.update(keys, values, layer_idx)
+    return cache
+
+
+class PrefixEntry:
+    def __init__(self, token_ids: tuple, tensors: List[tuple], last_logits):
+        self.token_ids = token_ids
+        self.tensors = tensors
+        self.last_logits = last_logits
+
+
+class PrefixCache:
+    """Bounded LRU of prefix KV caches, looked up by longest matching token prefix"""
+
+    def __init__(self, max_entries: int = 8):
+        self.max_entries = max_entries
+        self.entries: "OrderedDict[tuple, PrefixEntry]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __contains__(self, token_ids: tuple) -> bool:
+        return token_ids in self.entries
+
+    def add(self, entry: PrefixEntry):
+        self.entries[entry.token_ids] = entry
+        self.entries.move_to_end(entry.token_ids)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def lookup(self, prompt_ids: List[int]) -> Optional[PrefixEntry]:
+        best = None
+        for key, entry in self.entries.items():
+            if len(key) <= len(prompt_ids) and (best is None or len(key) > len(best.token_ids)):
+                if tuple(prompt_ids[:len(key)]) == key:
+                    best = entry
+        if best is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self.entries.move_to_end(best.token_ids)
+        return best
+
+
+class BatchState:
+    """KV cache, attention mask and pending next token for the running batch"""
+
+    def __init__(self, requests: List[GenerationRequest], cache, attention_mask, next_tokens):
+        self.requests = requests
+        self.cache = cache
+        self.attention_mask = attention_mask
+        self.next_tokens = next_tokens
+
+
+class HFModelRunner:
+    """Runs prefill and decode steps of a Hugging Face causal LM on left-padded batches"""
+
+    def __init__(self, model, pad_token_id: int = 0):
+        import torch
+
+        self.torch = torch
+        self.model = model
+        self.pad_token_id = pad_token_id
+        self.device = next(model.parameters()).device
+
+    def _forward(self, input_ids, attention_mask, cache=None):
+        position_ids = (attention_mask.long().cumsum(-1) - 1).clamp(min=0)
+        position_ids = position_ids[:, -input_ids.shape[1]:]
+        with self.torch.inference_mode():
+            out = self.model(
+                input_ids=input_ids,
+                attention_mask=attention_mask,
+                position_ids=position_ids,
+                past_key_values=cache,
+                use_cache=True,
+            )
+        return out.logits[:, -1, :], out.past_key_values
+
+    def prefill(self, requests: List[GenerationRequest]) -> BatchState:
+        """Encode a group of prompts together, left-padded to the longest one"""
+        torch = self.torch
+        length = max(len(r.prompt_ids) for r in requests)
+        input_ids = torch.full((len(requests), length), self.pad_token_id, dtype=torch.long)
+        attention_mask = torch.zeros((len(requests), length), dtype=torch.long)
+        for row, request in enumerate(requests):
+            n = len(request.prompt_ids)
+            input_ids[row, length - n:] = torch.tensor(request.prompt_ids, dtype=torch.long)
+            attention_mask[row, length - n:] = 1
+        input_ids = input_ids.to(self.device)
+        attention_mask = attention_mask.to(self.device)
+        logits, cache = self._forward(input_ids, attention_mask)
+        return BatchState(list(requests), cache, attention_mask, self.sample(logits, requests))
+
+    def encode_prefix(self, prefix_ids: Sequence[int]) -> PrefixEntry:
+        """Compute the KV cache of a single prefix for later reuse"""
+        torch = self.torch
+        input_ids = torch.tensor([list(prefix_ids)], dtype=torch.long, device=self.device)
+        logits, cache = self._forward(input_ids, torch.ones_like(input_ids))
+        return PrefixEntry(tuple(prefix_ids), cache_tensors(cache), logits)
+
+    def prefill_from_prefix(self, requests: List[GenerationRequest], entry: PrefixEntry) -> BatchState:
+        """
+        Prefill only what follows a cached prefix, for a group sharing that prefix.
+
+        The prefix cache is repeated across the group and the suffixes are padded
+        between the prefix and their own tokens; the attention mask hides the gap.
+        """
+        torch = self.torch
+        p = len(entry.token_ids)
+        suffixes = [r.prompt_ids[p:] for r in requests]
+        length = max(len(suffix) for suffix in suffixes)
+        # Cache updates concatenate into new tensors, so the stored prefix is never modified
+        cache = build_cache([
+            (k.expand(len(requests), -1, -1, -1), v.expand(len(requests), -1, -1, -1))
+            for k, v in entry.tensors
+        ])
+        if length == 0:
+            attention_mask = torch.ones((len(requests), p), dtype=torch.long, device=self.device)
+            logits = entry.last_logits.expand(len(requests), -1)
+            return BatchState(list(requests), cache, attention_mask, self.sample(logits, requests))
+
+        input_ids = torch.full((len(requests), length), self.pad_token_id, dtype=torch.long)
+        attention_mask = torch.ones((len(requests), p + length), dtype=torch.long)
+        for row, suffix in enumerate(suffixes):
+            attention_mask[row, p:p + length - len(suffix)] = 0
+            if suffix:
+                input_ids[row, length - len(suffix):] = torch.tensor(suffix, dtype=torch.long)
+        input_ids = input_ids.to(self.device)
+        attention_mask = attention_mask.to(self.device)
+        logits, cache = self._forward(input_ids, attention_mask, cache)
+        # A prompt equal to the prefix takes its first token from the prefix logits
+        for row, suffix in enumerate(suffixes):
+            if not suffix:
+                logits[row] = entry.last_logits[0]
+        return BatchState(list(requests), cache, attention_mask, self.sample(logits, requests))
+
+    def decode(self, state: BatchState):
+        """Feed each sequence its pending token and sample the next one"""
+        torch = self.torch
+        ones = torch.ones((len(state.requests), 1), dtype=state.attention_mask.dtype, device=self.device)
+        state.attention_mask = torch.cat([state.attention_mask, ones], dim=1)
+        logits, state.cache = self._forward(state.next_tokens.unsqueeze(1), state.attention_mask, state.cache)
+        state.next_tokens = self.sample(logits, state.requests)
+
+    def select(self, state: BatchState, keep: List[int]):
+        """Drop finished rows from the batch, trimming columns that became all padding"""
+        torch = self.torch
+        index = torch.tensor(keep, dtype=torch.long, device=self.device)
+        mask = state.attention_mask.index_select(0, index)
+        # Leading columns that are padding for every remaining row can be dropped
+        start = int((mask.sum(dim=0) > 0).long().argmax()) if mask.numel() else 0
+        tensors = [
+            (k.index_select(0, index)[:, :, start:], v.index_select(0, index)[:, :, start:])
+            for k, v in cache_tensors(state.cache)
+        ]
+        state.cache = build_cache(tensors)
+        state.attention_mask = mask[:, start:]
+        state.next_tokens = state.next_tokens.index_select(0, index)
+        state.requests = [state.requests[i] for i in keep]
+
+    def merge(self, state: BatchState, joined: BatchState) -> BatchState:
+        """Combine two batches, left-padding the shorter one along the sequence axis"""
+        torch = self.torch
+        length = max(state.attention_mask.shape[1], joined.attention_mask.shape[1])
+
+        def pad(tensor, dim):
+            missing = length - tensor.shape[dim]
+            if missing == 0:
+                return tensor
+            shape = list(tensor.shape)
+            shape[dim] = missing
+            return torch.cat([tensor.new_zeros(shape), tensor], dim=dim)
+
+        tensors = [
+            (torch.cat([pad(k1, 2), pad(k2, 2)], dim=0), torch.cat([pad(v1, 2), pad(v2, 2)], dim=0))
+            for (k1, v1), (k2, v2) in zip(cache_tensors(state.cache), cache_tensors(joined.cache))
+        ]
+        return BatchState(
+            state.requests + joined.requests,
+            build_cache(tensors),
+            torch.cat([pad(state.attention_mask, 1), pad(joined.attention_mask, 1)], dim=0),
+            torch.cat([state.next_tokens, joined.next_tokens], dim=0),
+        )
+
+    def sample(self, logits, requests: List[GenerationRequest]):
+        """Greedy for temperature 0, otherwise temperature + nucleus sampling per row"""
+        torch = self.torch
+        tokens = logits.argmax(dim=-1)
+        sampled_rows = [i for i, r in enumerate(requests) if r.temperature > 0]
+        if sampled_rows:
+            rows = torch.tensor(sampled_rows, device=logits.device)
+            temperature = torch.tensor([requests[i].temperature for i in sampled_rows], device=logits.device)
+            top_p = torch.tensor([requests[i].top_p for i in sampled_rows], device=logits.device)
+            probs = torch.softmax(logits.index_select(0, rows).float() / temperature[:, None], dim=-1)
+            sorted_probs, sorted_ids = probs.sort(dim=-1, descending=True)
+            # Keep the smallest prefix of tokens whose probability mass reaches top_p
+            drop = sorted_probs.cumsum(dim=-1) - sorted_probs > top_p[:, None]
+            sorted_probs = sorted_probs.masked_fill(drop, 0.0)
+            choice = torch.multinomial(sorted_probs, 1).squeeze(1)
+            tokens[rows] = sorted_ids.gather(1, choice[:, None]).squeeze(1)
+        return tokens
+
+
+class ContinuousBatchingEngine:
+    """
+    Iteration-level batching scheduler in front of a model runner.
+
+    Args:
+        runner: HFModelRunner (or any object with prefill/decode/select/merge/sample)
+        eos_token_ids: Token IDs that end a sequence
+        max_batch_size: Maximum number of sequences decoded together
+        max_wait_ms: How long an idle engine waits to gather a first batch
+        max_padding_ratio: Largest fraction of padding allowed when admitting a group
+        max_queue_ms: Requests older than this are admitted regardless of padding
+        max_prefixes: Number of prefix KV caches kept in the LRU
+    """
+
+    def __init__(self, runner, eos_token_ids: Sequence[int], max_batch_size: int = 16,
+                 max_wait_ms: float = 5.0, max_padding_ratio: float = 0.5, max_queue_ms: float = 200.0,
+                 max_prefixes: int = 8):
+        self.runner = runner
+        self.eos_token_ids = set(eos_token_ids)
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.max_padding_ratio = max_padding_ratio
+        self.max_queue = max_queue_ms / 1000
+        self.queue: deque = deque()
+        self.prefixes = PrefixCache(max_prefixes)
+        self.pending_prefixes: List[tuple] = []
+        # Prefixes taken off pending_prefixes whose KV state is still being computed
+        self.encoding_prefixes: set = set()
+        self.condition = threading.Condition()
+        self.stats_lock = threading.Lock()
+        self.batch_size_counts: Dict[int, int] = {}
+        self.queue_waits: deque = deque(maxlen=1024)
+        self.generated_tokens = 0
+        self.decode_steps = 0
+        self.prefill_seconds = 0.0
+        self.prefill_tokens = 0
+        self.reused_prefix_tokens = 0
+        self.running = True
+        self.thread = threading.Thread(target=self._loop, name="batching-engine", daemon=True)
+        self.thread.start()
+
+    def submit(self, prompt_ids: Sequence[int], max_new_tokens: int = 256,
+               temperature: float = 0.0, top_p: float = 1.0) -> Future:
+        """Queue a prompt; the returned future resolves to the generated token IDs"""
+        request = GenerationRequest(prompt_ids, max_new_tokens, temperature, top_p)
+        with self.condition:
+            self.queue.append(request)
+            self.condition.notify()
+        return request.future
+
+    def register_prefix(self, prefix_ids: Sequence[int]):
+        """Ask the engine to cache the KV state of a prefix shared by many prompts"""
+        prefix = tuple(prefix_ids)
+        with self.condition:
+            if (prefix and prefix not in self.prefixes and prefix not in self.pending_prefixes
+                    and prefix not in self.encoding_prefixes):
+                self.pending_prefixes.append(prefix)
+                self.condition.notify()
+
+    def generate(self, prompt_ids: Sequence[int], **kwargs) -> List[int]:
+        """Blocking wrapper around submit()"""
+        return self.submit(prompt_ids, **kwargs).result()
+
+    def shutdown(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+        self.thread.join()
+
+    def metrics(self) -> Dict[str, Any]:
+        """Batch size distribution, queue wait percentiles and throughput counters"""
+        with self.stats_lock:
+            waits = sorted(self.queue_waits)
+            sizes = dict(self.batch_size_counts)
+            steps = self.decode_steps
+            tokens = self.generated_tokens
+            prefill_seconds = self.prefill_seconds
+            prefill_tokens = self.prefill_tokens
+            reused = self.reused_prefix_tokens
+        with self.condition:
+            depth = len(self.queue)
+            hits, misses = self.prefixes.hits, self.prefixes.misses
+
+        def percentile(p):
+            return waits[min(len(waits) - 1, int(p * len(waits)))] * 1000 if waits else 0.0
+
+        return {
+            "queue_depth": depth,
+            "decode_steps": steps,
+            "generated_tokens": tokens,
+            "mean_batch_size": sum(s * c for s, c in sizes.items()) / steps if steps else 0.0,
+            "batch_size_histogram": sizes,
+            "queue_wait_ms_p50": percentile(0.50),
+            "queue_wait_ms_p95": percentile(0.95),
+            "prefill_ms_total": prefill_seconds * 1000,
+            "prefill_tokens": prefill_tokens,
+            "prefix_tokens_reused": reused,
+            "prefix_hits": hits,
+            "prefix_misses": misses,
+            "prefix_hit_rate": hits / (hits + misses) if hits + misses else 0.0,
+        }
+
+    def _admit(self, capacity: int) -> List[GenerationRequest]:
+        """Pick waiting requests for the next prefill, keeping padding waste bounded"""
+        if capacity <= 0 or not self.queue:
+            return []
+        now = time.perf_counter()
+        # The oldest request is always admitted so nothing starves
+        chosen = [self.queue.popleft()]
+        longest = len(chosen[0].prompt_ids)
+        total = longest
+        for request in list(self.queue):
+            if len(chosen) >= capacity:
+                break
+            n = len(request.prompt_ids)
+            new_longest = max(longest, n)
+            padding = new_longest * (len(chosen) + 1) - (total + n)
+            overdue = now - request.enqueued_at > self.max_queue
+            if overdue or padding <= self.max_padding_ratio * new_longest * (len(chosen) + 1):
+                self.queue.remove(request)
+                chosen.append(request)
+                longest, total = new_longest, total + n
+        for request in chosen:
+            self.queue_waits.append(now - request.enqueued_at)
+        return chosen
+
+    def _loop(self):
+        state: Optional[BatchState] = None
+        while True:
+            with self.condition:
+                if state is None:
+                    while self.running and not self.queue and not self.pending_prefixes:
+                        self.condition.wait()
+                    if not self.running:
+                        return
+                    # Give concurrent callers a moment to arrive so the first batch is not a single request
+                    deadline = time.perf_counter() + self.max_wait
+                    while len(self.queue) < self.max_batch_size and time.perf_counter() < deadline:
+                        self.condition.wait(deadline - time.perf_counter())
+                elif not self.running:
+                    return
+                new_prefixes, self.pending_prefixes = self.pending_prefixes, []
+                self.encoding_prefixes.update(new_prefixes)
+
+            joining = []
+            try:
+                # Newly registered prefixes are encoded before admission so the
+                # requests that triggered them can already reuse them
+                for prefix in new_prefixes:
+                    entry = self.runner.encode_prefix(prefix)
+                    with self.condition:
+                        self.prefixes.add(entry)
+                        self.encoding_prefixes.discard(prefix)
+                with self.condition:
+                    active = len(state.requests) if state is not None else 0
+                    with self.stats_lock:
+                        joining = self._admit(self.max_batch_size - active)
+                        matches = [self.prefixes.lookup(r.prompt_ids) for r in joining]
+                if joining:
+                    state = self._prefill(state, joining, matches)
+                if state is not None:
+                    state = self._step(state)
+            except Exception as e:
+                print(f"Error in batching engine: {e}")
+                with self.condition:
+                    # A prefix that failed to encode can be registered again
+                    self.encoding_prefixes.difference_update(new_prefixes)
+                for request in (state.requests if state is not None else []) + joining:
+                    if not request.future.done():
+                        request.future.set_exception(e)
+                state = None
+
+    def _prefill(self, state: Optional[BatchState], joining: List[GenerationRequest],
+                 matches: List[Optional[PrefixEntry]]) -> BatchState:
+        """Prefill admitted requests (reusing cached prefixes) and merge them into the batch"""
+        started = time.perf_counter()
+        groups = []
+        cold = [r for r, entry in zip(joining, matches) if entry is None]
+        if cold:
+            groups.append(self.runner.prefill(cold))
+        reused = 0
+        by_prefix: Dict[tuple, List[GenerationRequest]] = {}
+        for request, entry in zip(joining, matches):
+            if entry is not None:
+                by_prefix.setdefault(entry.token_ids, []).append(request)
+                reused += len(entry.token_ids)
+        for entry in {e.token_ids: e for e in matches if e is not None}.values():
+            groups.append(self.runner.prefill_from_prefix(by_prefix[entry.token_ids], entry))
+        for joined in groups:
+            state = joined if state is None else self.runner.merge(state, joined)
+        with self.stats_lock:
+            self.prefill_seconds += time.perf_counter() - started
+            self.prefill_tokens += sum(len(r.prompt_ids) for r in joining) - reused
+            self.reused_prefix_tokens += reused
+        return state
+
+    def _step(self, state: BatchState) -> Optional[BatchState]:
+        """Record each row's pending token, retire finished rows and decode the rest"""
+        keep = []
+        for row, (request, token) in enumerate(zip(state.requests, state.next_tokens.tolist())):
+            request.generated.append(token)
+            if token in self.eos_token_ids or len(request.generated) >= request.max_new_tokens:
+                request.future.set_result(request.generated)
+            else:
+                keep.append(row)
+        with self.stats_lock:
+            self.generated_tokens += len(state.requests)
+        if not keep:
+            return None
+        if len(keep) < len(state.requests):
+            self.runner.select(state, keep)
+        self.runner.decode(state)
+        with self.stats_lock:
+            self.decode_steps += 1
+            size = len(state.requests)
+            self.batch_size_counts[size] = self.batch_size_counts.get(size, 0) + 1
+        return state
+
+
+def _tiny_model():
+    import torch
+    from transformers import LlamaConfig, LlamaForCausalLM
+
+    torch.manual_seed(0)
+    config = LlamaConfig(
+        vocab_size=256, hidden_size=64, intermediate_size=128, num_hidden_layers=2,
+        num_attention_heads=4, num_key_value_heads=2, max_position_embeddings=512,
+    )
+    return LlamaForCausalLM(config).eval()
+
+
+def _check(model, prompts, max_new, eos, prefix=None):
+    """Run prompts concurrently through an engine and compare with sequential greedy decoding"""
+    from concurrent.futures import ThreadPoolExecutor
+
+    import torch
+
+    expected = []
+    start = time.perf_counter()
+    for prompt, n in zip(prompts, max_new):
+        out = model.generate(torch.tensor([prompt]), max_new_tokens=n, do_sample=False,
+                             eos_token_id=eos, pad_token_id=0)
+        expected.append(out[0, len(prompt):].tolist())
+    sequential = time.perf_counter() - start
+
+    engine = ContinuousBatchingEngine(HFModelRunner(model), eos_token_ids=[eos], max_batch_size=8)
+    if prefix:
+        engine.register_prefix(prefix)
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=len(prompts)) as pool:
+        results = list(pool.map(lambda args: engine.generate(args[0], max_new_tokens=args[1]),
+                                zip(prompts, max_new)))
+    batched = time.perf_counter() - start
+    engine.shutdown()
+
+    matches = sum(r == e for r, e in zip(results, expected))
+    print(f"Greedy outputs matching sequential generation: {matches}/{len(prompts)}")
+    print(f"Sequential: {sequential:.2f}s, continuous batching: {batched:.2f}s")
+    for key, value in engine.metrics().items():
+        print(f"  {key}: {value}")
+
+
+if __name__ == "__main__":
+    import random
+
+    model = _tiny_model()
+    eos = 255
+    random.seed(0)
+
+    print("Mixed prompts:")
+    prompts = [[random.randrange(1, 250) for _ in range(random.randint(4, 40))] for _ in range(32)]
+    max_new = [random.randint(8, 48) for _ in prompts]
+    _check(model, prompts, max_new, eos)
+
+    prefix = [random.randrange(1, 250) for _ in range(200)]
+    prompts = [prefix + [random.randrange(1, 250) for _ in range(random.randint(1, 20))] for _ in range(32)]
+    print("\nPrompts sharing a 200-token system prefix, no prefix cache:")
+    _check(model, prompts, max_new, eos)
+    print("\nSame prompts with the prefix registered:")
+    _check(model, prompts, max_new, eos, prefix=prefix)
@@ -1,72 +1,194 @@
+import resource
+import threading
+import time
+from collections import OrderedDict
+
 import modal
 
 MODEL_ID = "NousResearch/Meta-Llama-3.1-70B-Instruct"
 MODEL_REVISION = "d50656ee28e2c2906d317cbbb6fcb55eb4055a84"
 
-image = modal.Image.debian_slim().pip_install("transformers", "torch", "accelerate")
+image = (
+    modal.Image.debian_slim()
+    .pip_install("transformers>=4.56", "torch", "accelerate", "hf_transfer")
+    .env({"HF_HUB_ENABLE_HF_TRANSFER": "1"})
+    .add_local_python_source("llama_engine")
+)
 app = modal.App("llama-inference", image=image)
 
 GPU_CONFIG = "H100:2"
 
+# Concurrent inputs are decoded together by the continuous batching engine
+MAX_BATCH_SIZE = 32
+# Distinct system/preamble prefixes whose KV caches are kept on the GPU
+MAX_PREFIXES = 16
+# Tokenized system/preamble prefixes remembered on the host (cheap, so more than the GPU keeps)
+MAX_PREFIX_KEYS = 4 * MAX_PREFIXES
+
+DEFAULT_SYSTEM_PROMPT = "You are a helpful assistant."
+
 CACHE_DIR = "/cache"
 cache_vol = modal.Volume.from_name("hf-hub-cache", create_if_missing=True)
 
 
+def log_setup_stats(phase: str, started: float):
+    """Print elapsed time and peak host RSS (and GPU memory once torch is loaded)"""
+    peak_rss_gb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024 / 1024
+    message = f"[{phase}] {time.perf_counter() - started:.1f}s, peak host RSS {peak_rss_gb:.2f} GB"
+    try:
+        import torch
+
+        if torch.cuda.is_available():
+            gpu = ", ".join(
+                f"cuda:{i} {torch.cuda.max_memory_allocated(i) / 1024 ** 3:.1f} GB"
+                for i in range(torch.cuda.device_count())
+            )
+            message += f", peak GPU {gpu}"
+    except ImportError:
+        pass
+    print(message)
+
+
 @app.cls(
     gpu=GPU_CONFIG,
     volumes={CACHE_DIR: cache_vol},
-    allow_concurrent_inputs=15,
+    allow_concurrent_inputs=MAX_BATCH_SIZE,
     scaledown_window=60 * 10,
     timeout=60 * 60,
+    # Imports, tokenizer and the resolved snapshot are restored from a memory
+    # snapshot on cold start; only the GPU weight load runs every time
+    enable_memory_snapshot=True,
 )
 class Model:
-    @modal.enter()
-    def setup(self):
-        import torch
+    @modal.enter(snap=True)
+    def prepare(self):
+        started = time.perf_counter()
+
+        # Importing torch and transformers here puts them in the memory snapshot
+        import torch  # noqa: F401
 
-        from transformers import AutoModelForCausalLM, AutoTokenizer, pipeline
+        from transformers import AutoModelForCausalLM, AutoTokenizer  # noqa: F401
 
         from huggingface_hub import snapshot_download
 
-        # Download the model to the cache directory
-        model_path = snapshot_download(repo_id=MODEL_ID, cache_dir=CACHE_DIR)
+        # Download (or resolve from the volume cache) the pinned revision. Only the
+        # safetensors shards are needed; the original/ consolidated checkpoints
+        # would double the download.
+        self.model_path = snapshot_download(
+            repo_id=MODEL_ID,
+            revision=MODEL_REVISION,
+            cache_dir=CACHE_DIR,
+            allow_patterns=["*.json", "*.safetensors", "tokenizer*"],
+        )
+        print(f"Model snapshot at: {self.model_path}")
+
+        self.tokenizer = AutoTokenizer.from_pretrained(self.model_path)
+        log_setup_stats("prepare", started)
+
+    @modal.enter(snap=False)
+    def setup(self):
+        started = time.perf_counter()
 
-        print(f"Model downloaded to: {model_path}")
+        import torch
 
-        # Specify cache directory if needed
-        model = AutoModelForCausalLM.from_pretrained(MODEL_ID, cache_dir=CACHE_DIR)
-        tokenizer = AutoTokenizer.from_pretrained(MODEL_ID, cache_dir=CACHE_DIR)
+        from transformers import AutoModelForCausalLM
 
-        self.pipeline = pipeline(
-            "text-generation",
-            model=model,
-            revision=MODEL_REVISION,
-            tokenizer=tokenizer,
-            model_kwargs={"torch_dtype": torch.bfloat16},
+        # Load bf16 weights from the local snapshot straight onto the GPUs; without
+        # dtype and device_map the model is first materialized in fp32 on CPU
+        model = AutoModelForCausalLM.from_pretrained(
+            self.model_path,
+            dtype=torch.bfloat16,
             device_map="auto",
+            use_safetensors=True,
+            low_cpu_mem_usage=True,
         )
-
-    @modal.method()
-    def generate(self, input: str):
+        model.eval()
+
+        from llama_engine import ContinuousBatchingEngine, HFModelRunner
+
+        tokenizer = self.tokenizer
+        eos_token_ids = model.generation_config.eos_token_id
+        if isinstance(eos_token_ids, int):
+            eos_token_ids = [eos_token_ids]
+        pad_token_id = tokenizer.pad_token_id if tokenizer.pad_token_id is not None else eos_token_ids[0]
+
+        self.generation_config = model.generation_config
+        self.engine = ContinuousBatchingEngine(
+            HFModelRunner(model, pad_token_id=pad_token_id),
+            eos_token_ids=eos_token_ids,
+            max_batch_size=MAX_BATCH_SIZE,
+            max_prefixes=MAX_PREFIXES,
+        )
+        # (system, preamble) -> prefix token ids, so each prefix is tokenized once
+        self.prefix_ids: "OrderedDict[tuple, tuple]" = OrderedDict()
+        self.prefix_lock = threading.Lock()
+        # Warm the default system prompt so the first request already reuses it
+        self._prompt_ids(DEFAULT_SYSTEM_PROMPT, "", "Hello")
+        log_setup_stats("setup", started)
+
+    def _prompt_ids(self, system: str, preamble: str, input: str):
+        """Tokenize the chat prompt and register its fixed system/preamble prefix"""
         messages = [
             {
                 "role": "system",
-                "content": "You are a helpful assistant.",
+                "content": system,
             },
-            {"role": "user", "content": input},
+            {"role": "user", "content": preamble + input},
         ]
+        text = self.tokenizer.apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
+        prompt_ids = self.tokenizer(text, add_special_tokens=False)["input_ids"]
+
+        key = (system, preamble)
+        with self.prefix_lock:
+            prefix = self.prefix_ids.get(key)
+            if prefix is not None:
+                self.prefix_ids.move_to_end(key)
+        if prefix is None and input:
+            # The user turn is the last occurrence of its content in the rendered template
+            prefix_text = text[:text.rfind(preamble + input) + len(preamble)]
+            prefix_ids = self.tokenizer(prefix_text, add_special_tokens=False)["input_ids"]
+            # Tokens can merge across the boundary, so keep only the shared part
+            shared = 0
+            while shared < min(len(prefix_ids), len(prompt_ids)) and prefix_ids[shared] == prompt_ids[shared]:
+                shared += 1
+            prefix = tuple(prompt_ids[:shared])
+            with self.prefix_lock:
+                self.prefix_ids[key] = prefix
+                while len(self.prefix_ids) > MAX_PREFIX_KEYS:
+                    self.prefix_ids.popitem(last=False)
+        if prefix:
+            # The engine ignores prefixes it still holds, and encodes again one that
+            # its PrefixCache has evicted since (more than MAX_PREFIXES in use)
+            self.engine.register_prefix(prefix)
+        return prompt_ids
 
-        outputs = self.pipeline(
-            messages,
-            max_new_tokens=256,
+    @modal.method()
+    def generate(self, input: str, system: str = DEFAULT_SYSTEM_PROMPT, preamble: str = "",
+                 max_new_tokens: int = 256):
+        """
+        Generate a chat response.
+
+        `system` and `preamble` (fixed instructions placed before `input` in the
+        user turn) form a prefix whose KV cache is computed once and reused.
+        """
+        prompt_ids = self._prompt_ids(system, preamble, input)
+
+        # Sample with the model's default generation settings, as the pipeline did
+        config = self.generation_config
+        output_ids = self.engine.generate(
+            prompt_ids,
+            max_new_tokens=max_new_tokens,
+            temperature=(config.temperature or 1.0) if config.do_sample else 0.0,
+            top_p=config.top_p or 1.0,
         )
 
         # Extract the assistant's response
-        try:
-            return outputs[0]["generated_text"][-1]["content"]
-        except (KeyError, IndexError, TypeError):
-            # Fallback extraction in case the output format is different
-            return str(outputs[0]["generated_text"])
+        return self.tokenizer.decode(output_ids, skip_special_tokens=True).strip()
+
+    @modal.method()
+    def metrics(self):
+        """Batch size, queue wait, prefill and prefix hit statistics from the batching engine"""
+        return self.engine.metrics()
 
 
 # For testing and deployment
@@ -0,0 +1,144 @@
+"""
+Load test for the services started with serve.py.
+
+Sends requests from a pool of concurrent clients for a fixed duration and
+reports throughput and latency percentiles:
+
+    python loadtest.py http://localhost:5001/api/predict --body sonar_request.json
+
+With --workers, the service is started under serve.py once per worker count
+and the same load is replayed, showing how throughput scales:
+
+    LLM_BACKEND=fake python loadtest.py --service voice --workers 1,2,4 \\
+        --path /api/voice-chat --body '{"message": "status?"}'
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+
+def run_load(url: str, body: Optional[bytes], concurrency: int, duration: float, timeout: float = 30) -> Dict:
+    """Hammer url with `concurrency` clients for `duration` seconds"""
+    latencies: List[float] = []
+    errors = 0
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def client():
+        nonlocal errors
+        while time.perf_counter() < deadline:
+            request = urllib.request.Request(url, data=body, headers={"Content-Type": "application/json"})
+            started = time.perf_counter()
+            try:
+                with urllib.request.urlopen(request, timeout=timeout) as response:
+                    response.read()
+                ok = True
+            except (urllib.error.URLError, OSError):
+                ok = False
+            elapsed = time.perf_counter() - started
+            with lock:
+                if ok:
+                    latencies.append(elapsed)
+                else:
+                    errors += 1
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for _ in range(concurrency):
+            pool.submit(client)
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    def pct(p):
+        return latencies[min(len(latencies) - 1, int(p * len(latencies)))] * 1000 if latencies else float("nan")
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "rps": len(latencies) / elapsed,
+        "p50_ms": pct(0.5),
+        "p95_ms": pct(0.95),
+        "p99_ms": pct(0.99),
+    }
+
+
+def wait_ready(base_url: str, timeout: float = 60) -> bool:
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        try:
+            with urllib.request.urlopen(f"{base_url}/readyz", timeout=2) as response:
+                if response.status == 200:
+                    return True
+        except (urllib.error.URLError, OSError):
+            pass
+        time.sleep(0.25)
+    return False
+
+
+def compare_workers(service: str, path: str, body: Optional[bytes], worker_counts: List[int],
+                    threads: int, port: int, concurrency: int, duration: float):
+    """Start the service once per worker count and replay the same load against it"""
+    base_url = f"http://127.0.0.1:{port}"
+    print(f"{'workers':>7} {'rps':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'errors':>6}")
+    for workers in worker_counts:
+        server = subprocess.Popen(
+            [sys.executable, os.path.join(ROOT, "serve.py"), service, "--host", "127.0.0.1",
+             "--port", str(port), "--workers", str(workers), "--threads", str(threads)],
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        )
+        try:
+            if not wait_ready(base_url):
+                print(f"{workers:>7} service did not become ready")
+                continue
+            result = run_load(base_url + path, body, concurrency, duration)
+            print(f"{workers:>7} {result['rps']:>9.1f} {result['p50_ms']:>8.1f} {result['p95_ms']:>8.1f} "
+                  f"{result['p99_ms']:>8.1f} {result['errors']:>6}")
+        finally:
+            server.terminate()
+            server.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test a Sentral service")
+    parser.add_argument("url", nargs="?", help="Full URL of a running service endpoint")
+    parser.add_argument("--body", help="JSON request body, or a path to a JSON file (GET when omitted)")
+    parser.add_argument("--concurrency", type=int, default=16, help="Concurrent clients")
+    parser.add_argument("--duration", type=float, default=10, help="Seconds per run")
+    parser.add_argument("--service", help="Service to start with serve.py for --workers runs")
+    parser.add_argument("--path", default="/healthz", help="Endpoint path for --workers runs")
+    parser.add_argument("--workers", help="Comma-separated worker counts to compare, e.g. 1,2,4")
+    parser.add_argument("--threads", type=int, default=1, help="Threads per worker for --workers runs")
+    parser.add_argument("--port", type=int, default=5099, help="Port for --workers runs")
+    args = parser.parse_args()
+
+    body = None
+    if args.body:
+        if os.path.exists(args.body):
+            with open(args.body, "rb") as f:
+                body = f.read()
+        else:
+            body = json.dumps(json.loads(args.body)).encode()
+
+    if args.workers:
+        if not args.service:
+            parser.error("--workers requires --service")
+        compare_workers(args.service, args.path, body, [int(n) for n in args.workers.split(",")],
+                        args.threads, args.port, args.concurrency, args.duration)
+    elif args.url:
+        print(json.dumps(run_load(args.url, body, args.concurrency, args.duration), indent=2))
+    else:
+        parser.error("give a URL or --service with --workers")
+
+
+if __name__ == "__main__":
+    main()
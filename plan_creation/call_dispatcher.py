@@ -0,0 +1,227 @@
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+
+from instrumentation import span
+
+
+class RateLimiter:
+    """Token bucket limiting how many calls are placed per second"""
+
+    def __init__(self, rate: float, burst: int = 1):
+        self.rate = rate
+        self.capacity = max(1, burst)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Block until a token is available"""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class FakeCall:
+    def __init__(self, sid: str, to: str, url: str):
+        self.sid = sid
+        self.to = to
+        self.url = url
+        self.status = "queued"
+
+
+class FakeCallList:
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.created: List[FakeCall] = []
+        self.lock = threading.Lock()
+
+    def create(self, url, to, from_, **kwargs):
+        time.sleep(self.latency)
+        call = FakeCall(f"CA{uuid.uuid4().hex}", to, url)
+        with self.lock:
+            self.created.append(call)
+        return call
+
+
+class FakeTwilioClient:
+    """Local stand-in for twilio.rest.Client that records calls instead of dialing"""
+
+    def __init__(self, latency: float = 0.05):
+        self.calls = FakeCallList(latency)
+
+
+# How long a job, its script and its calls are kept after it was submitted.
+# Twilio fetches the TwiML and reports call status within minutes of dialing.
+JOB_TTL_S = float(os.getenv("CALL_JOB_TTL_S", 3600))
+
+
+class CallDispatcher:
+    """
+    Runs emergency call jobs on a worker pool.
+
+    Each job generates its speaking script once and then dials every recipient
+    concurrently, subject to a shared rate limit. Scripts are kept per job in a
+    message store so concurrent jobs never overwrite each other's TwiML. Jobs
+    older than job_ttl_s are evicted with their scripts and calls.
+    """
+
+    def __init__(
+        self,
+        twilio_client,
+        from_number: str,
+        twiml_base_url: str,
+        script_generator: Callable[[str, str, Optional[Dict[str, Any]]], str],
+        max_workers: int = 8,
+        calls_per_second: float = 1.0,
+        status_callback_url: Optional[str] = None,
+        job_ttl_s: float = JOB_TTL_S,
+    ):
+        self.client = twilio_client
+        self.from_number = from_number
+        self.twiml_base_url = twiml_base_url.rstrip("/")
+        self.script_generator = script_generator
+        self.status_callback_url = status_callback_url
+        self.job_ttl_s = job_ttl_s
+        self.rate_limiter = RateLimiter(calls_per_second, burst=max_workers)
+        # Script generation and dialing use separate pools so a burst of jobs
+        # waiting on the LLM can never starve the dialers
+        self.job_pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="call-job")
+        self.dial_pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="call-dial")
+        self.jobs: Dict[str, Dict[str, Any]] = {}
+        self.messages: Dict[str, str] = {}
+        self.calls_by_sid: Dict[str, Dict[str, Any]] = {}
+        self.lock = threading.Lock()
+        # Notified when a job finishes (dispatched or failed)
+        self.finished = threading.Condition(self.lock)
+
+    def submit(self, message: str, recipients: List[str], threat: Optional[Dict[str, Any]] = None) -> str:
+        """Queue a call job and return its ID immediately"""
+        job_id = uuid.uuid4().hex
+        job = {
+            "id": job_id,
+            "status": "queued",
+            "message": message,
+            "threat": threat,
+            "script": None,
+            "created_at": time.time(),
+            "time_to_dial_ms": None,
+            "calls": [{"to": number, "status": "pending", "sid": None, "error": None} for number in recipients],
+        }
+        with self.lock:
+            self._evict_expired(job["created_at"] - self.job_ttl_s)
+            self.jobs[job_id] = job
+        self.job_pool.submit(self._run_job, job)
+        return job_id
+
+    def get_job(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Return a snapshot of a job's state, or None if it is unknown"""
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is None:
+                return None
+            snapshot = dict(job)
+            snapshot["calls"] = [dict(call) for call in job["calls"]]
+            return snapshot
+
+    def wait(self, job_id: str, timeout: Optional[float] = None) -> Optional[Dict[str, Any]]:
+        """Block until a job is dispatched or failed (or the timeout passes); returns its snapshot"""
+        with self.finished:
+            self.finished.wait_for(
+                lambda: self.jobs.get(job_id, {}).get("status", "failed") in ("dispatched", "failed"), timeout)
+        return self.get_job(job_id)
+
+    def get_message(self, message_id: str) -> Optional[str]:
+        """Return the speaking script registered for a job"""
+        with self.lock:
+            return self.messages.get(message_id)
+
+    def set_message(self, message_id: str, script: str):
+        """Replace a job's script, e.g. when a refined version arrives after dialing started"""
+        with self.lock:
+            job = self.jobs.get(message_id)
+            # A refinement finishing after its job was evicted has nowhere to go
+            if job is None:
+                return
+            self.messages[message_id] = script
+            job["script"] = script
+
+    def update_call_status(self, sid: str, status: str):
+        """Record a status reported by the Twilio status callback"""
+        with self.lock:
+            call = self.calls_by_sid.get(sid)
+            if call is not None:
+                call["status"] = status
+
+    def _evict_expired(self, cutoff: float):
+        """Drop jobs created before cutoff; callers hold the lock"""
+        # Jobs are inserted in creation order, so the expired ones are at the front
+        while self.jobs:
+            job_id, job = next(iter(self.jobs.items()))
+            if job["created_at"] >= cutoff:
+                break
+            del self.jobs[job_id]
+            self.messages.pop(job_id, None)
+            for call in job["calls"]:
+                if call["sid"] is not None:
+                    self.calls_by_sid.pop(call["sid"], None)
+
+    def _run_job(self, job: Dict[str, Any]):
+        try:
+            self._set(job, status="generating_script")
+            with span("dispatcher", "script"):
+                script = self.script_generator(job["id"], job["message"], job["threat"])
+            with self.lock:
+                # A refined script may already have been registered by the generator
+                self.messages.setdefault(job["id"], script)
+                job["script"] = self.messages[job["id"]]
+                job["status"] = "dialing"
+            futures = [self.dial_pool.submit(self._dial, job, call) for call in job["calls"]]
+            for future in futures:
+                future.result()
+            failed = all(call["status"] == "failed" for call in job["calls"])
+            self._set(job, status="failed" if failed else "dispatched")
+        except Exception as e:
+            print(f"Error running call job {job['id']}: {e}")
+            self._set(job, status="failed", error=str(e))
+
+    def _dial(self, job: Dict[str, Any], call: Dict[str, Any]):
+        self.rate_limiter.acquire()
+        try:
+            kwargs = {}
+            if self.status_callback_url:
+                kwargs["status_callback"] = self.status_callback_url
+            with span("dispatcher", "twilio_dispatch"):
+                created = self.client.calls.create(
+                    url=f"{self.twiml_base_url}/twiml?messageId={job['id']}",
+                    to=call["to"],
+                    from_=self.from_number,
+                    **kwargs,
+                )
+            with self.lock:
+                call["sid"] = created.sid
+                call["status"] = created.status
+                if job["time_to_dial_ms"] is None:
+                    job["time_to_dial_ms"] = (time.time() - job["created_at"]) * 1000
+                self.calls_by_sid[created.sid] = call
+        except Exception as e:
+            print(f"Error calling {call['to']}: {e}")
+            with self.lock:
+                call["status"] = "failed"
+                call["error"] = str(e)
+
+    def _set(self, job: Dict[str, Any], **fields):
+        with self.lock:
+            job.update(fields)
+            if job["status"] in ("dispatched", "failed"):
+                self.finished.notify_all()
@@ -0,0 +1,225 @@
+import hashlib
+import json
+import re
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+from threat_scoring import get_scorer
+
+from instrumentation import count_cache
+
+LEVEL_ACTIONS = {
+    "HIGH": "Immediate response is required. Dispatch rapid response teams and establish a safety perimeter.",
+    "MEDIUM": "Increase surveillance of the area and notify local authorities.",
+    "LOW": "No immediate action is required. Continue monitoring.",
+}
+
+def _describe_objects(objects) -> str:
+    """Turn counts, names or detection records into a short spoken list"""
+    if isinstance(objects, dict):
+        items = list(objects.items())
+    else:
+        items = []
+        for obj in objects or []:
+            name = obj.get("type") if isinstance(obj, dict) else obj
+            items.append((name, 1))
+    phrases = []
+    for name, count in items:
+        name = str(name).replace("_", " ")
+        if count == 1:
+            phrases.append(f"one {name}")
+        else:
+            plural = name if name.endswith("s") else f"{name}s"
+            phrases.append(f"{count} {plural}")
+    if len(phrases) > 1:
+        return ", ".join(phrases[:-1]) + f" and {phrases[-1]}"
+    return phrases[0] if phrases else ""
+
+def _describe_location(location) -> str:
+    if isinstance(location, dict):
+        if location.get("area"):
+            return location["area"]
+        if "latitude" in location and "longitude" in location:
+            return f"latitude {location['latitude']}, longitude {location['longitude']}"
+        return ""
+    return str(location or "")
+
+def _strip_symbols(message: str) -> str:
+    """Drop emoji and other symbols that text-to-speech would read out literally"""
+    return re.sub(r"[^\w\s.,:;!?'()+-]", "", message).strip()
+
+def _spoken_message(message: str) -> str:
+    """The operator's message as sentences: one per line, without symbols"""
+    sentences = []
+    for line in (message or "").splitlines():
+        line = _strip_symbols(line)
+        if line:
+            sentences.append(line if line[-1] in ".!?" else f"{line}.")
+    return " ".join(sentences)
+
+def render_call_script(threat: Optional[Dict[str, Any]], message: str = "") -> str:
+    """
+    Build a speaking script directly from structured threat fields.
+
+    Args:
+        threat: Dictionary with optional level/threat_level, objects and location keys
+        message: Free-text alert from the operator (priority, response units, ETA...),
+            read after the detection details, or on its own when there are none
+
+    Returns:
+        A paragraph that can be read aloud by the call
+    """
+    threat = threat or {}
+    level = str(threat.get("level") or threat.get("threat_level") or "").upper()
+    if not level and isinstance(threat.get("objects"), dict):
+        level = get_scorer().score({"unique_objects": threat["objects"]})["level"]
+    objects = _describe_objects(threat.get("objects"))
+    location = _describe_location(threat.get("location"))
+    spoken_message = _spoken_message(message)
+    if not (level or objects or location):
+        return spoken_message
+
+    sentences = ["This is an automated emergency alert from the Sentral defense system."]
+    if level:
+        sentences.append(f"Threat level {level}.")
+    if objects:
+        sentences.append(f"Detected {objects}" + (f" near {location}." if location else "."))
+    elif location:
+        sentences.append(f"Location: {location}.")
+    if level in LEVEL_ACTIONS:
+        sentences.append(LEVEL_ACTIONS[level])
+    if spoken_message:
+        sentences.append(spoken_message)
+    if level:
+        sentences.append(f"Repeating: threat level {level}.")
+    return " ".join(sentences)
+
+def threat_signature(threat: Optional[Dict[str, Any]], message: str = "") -> str:
+    """Stable key for alerts that should share a refined script: same threat and same operator message"""
+    threat = threat or {}
+    key = {
+        "level": str(threat.get("level") or threat.get("threat_level") or "").upper(),
+        "objects": _describe_objects(threat.get("objects")),
+        "location": _describe_location(threat.get("location")),
+        "message": message,
+    }
+    return hashlib.sha256(json.dumps(key, sort_keys=True).encode()).hexdigest()
+
+
+class CallScriptEngine:
+    """
+    Returns a templated script instantly and refines it with the LLM in the background.
+
+    Refined scripts are cached by threat signature, so the next call for the same
+    kind of threat gets the LLM version with no added latency. The refiner gets
+    the template script and the operator's original message. Requests for a
+    signature already being refined wait for that refinement instead of
+    starting another one.
+    """
+
+    def __init__(self, refiner: Optional[Callable[[str, str], str]] = None, max_cached: int = 256, workers: int = 2):
+        self.refiner = refiner
+        self.max_cached = max_cached
+        self.cache: "OrderedDict[str, str]" = OrderedDict()
+        # Signature -> on_refined callbacks waiting for its refinement
+        self.pending: Dict[str, List[Callable[[str], None]]] = {}
+        self.lock = threading.Lock()
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="script-refine")
+        self.hits = 0
+        self.misses = 0
+
+    def script_for(self, message: str, threat: Optional[Dict[str, Any]] = None,
+                   on_refined: Optional[Callable[[str], None]] = None) -> str:
+        """
+        Return the best script available right now.
+
+        Args:
+            message: Free-text emergency message
+            threat: Structured threat fields (level, objects, location)
+            on_refined: Called with the LLM script once background refinement finishes
+
+        Returns:
+            A cached refined script, or the template script
+        """
+        signature = threat_signature(threat, message)
+        with self.lock:
+            cached = self.cache.get(signature)
+            if cached is not None:
+                self.cache.move_to_end(signature)
+                self.hits += 1
+                count_cache("call_script", True)
+                return cached
+            self.misses += 1
+        count_cache("call_script", False)
+
+        script = render_call_script(threat, message)
+        if self.refiner is not None:
+            self.pool.submit(self._refine, signature, script, message, on_refined)
+        return script
+
+    def _refine(self, signature: str, script: str, message: str, on_refined):
+        with self.lock:
+            # Queued behind a refinement of the same signature that has since finished
+            cached = self.cache.get(signature)
+            if cached is None:
+                waiting = self.pending.get(signature)
+                if waiting is None:
+                    self.pending[signature] = [on_refined] if on_refined is not None else []
+                elif on_refined is not None:
+                    waiting.append(on_refined)
+        if cached is not None:
+            if on_refined is not None:
+                on_refined(cached)
+            return
+        if waiting is not None:
+            return
+
+        refined = None
+        try:
+            refined = self.refiner(script, message)
+        except Exception as e:
+            print(f"Error refining call script: {e}")
+        with self.lock:
+            callbacks = self.pending.pop(signature)
+            if not refined or refined == script:
+                return
+            self.cache[signature] = refined
+            while len(self.cache) > self.max_cached:
+                self.cache.popitem(last=False)
+        for callback in callbacks:
+            try:
+                callback(refined)
+            except Exception as e:
+                print(f"Error delivering refined call script: {e}")
+
+
+def benchmark_time_to_dial(llm_latency: float = 1.5, jobs: int = 20):
+    """Compare time-to-dial for blocking LLM scripts against instant templates"""
+    from call_dispatcher import CallDispatcher, FakeTwilioClient
+
+    def slow_llm(text, message=None):
+        time.sleep(llm_latency)
+        return text
+
+    threat = {"level": "high", "objects": {"boat": 4, "Drone": 1}, "location": {"area": "Miami Harbor"}}
+
+    blocking = CallDispatcher(FakeTwilioClient(), "+10000000000", "http://localhost",
+                              lambda job_id, message, threat: slow_llm(message), calls_per_second=100)
+    engine = CallScriptEngine(refiner=slow_llm)
+    templated = CallDispatcher(FakeTwilioClient(), "+10000000000", "http://localhost", None, calls_per_second=100)
+    templated.script_generator = lambda job_id, message, threat: engine.script_for(
+        message, threat, on_refined=lambda script: templated.set_message(job_id, script))
+
+    for name, dispatcher in [("blocking LLM", blocking), ("template", templated)]:
+        job_ids = [dispatcher.submit("Emergency", ["+15555550100"], threat) for _ in range(jobs)]
+        while any(dispatcher.get_job(j)["status"] not in ("dispatched", "failed") for j in job_ids):
+            time.sleep(0.01)
+        latencies = sorted(dispatcher.get_job(j)["time_to_dial_ms"] for j in job_ids)
+        print(f"{name:>12}: median time-to-dial {latencies[len(latencies) // 2]:.1f} ms, "
+              f"max {latencies[-1]:.1f} ms over {jobs} jobs")
+    print(f"Template cache: {engine.hits} hits, {engine.misses} misses")
+
+if __name__ == "__main__":
+    benchmark_time_to_dial()
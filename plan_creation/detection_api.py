@@ -0,0 +1,104 @@
+from flask import Flask, request, jsonify
+from flask_cors import CORS
+from detection_store import DEFAULT_DB_PATH, DetectionStore, index_json_dir
+from instrumentation import instrument_flask
+
+app = Flask(__name__)
+CORS(app, expose_headers=['ETag'])
+instrument_flask(app, "detections")
+
+# Files in jsons/ are indexed once before the workers start (serve.py runs
+# detection_store.index_json_dir), not by every worker on import
+store = DetectionStore(DEFAULT_DB_PATH)
+
+MAX_PAGE_SIZE = 100
+
+def ready():
+    """Readiness checks reported by serve.py at /readyz"""
+    return {"store": store.generation() >= 0}
+
+def conditional(etag, build):
+    """
+    Answer 304 when the client already holds this ETag; otherwise build the body.
+    The ETag is checked before any query runs, so revalidation is a single read.
+    """
+    if request.if_none_match.contains(etag):
+        response = app.response_class(status=304)
+    else:
+        body = build()
+        if body is None:
+            return jsonify({'error': 'Not found'}), 404
+        response = jsonify(body)
+    response.set_etag(etag)
+    # Always revalidate, so new detections show up immediately
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+@app.route('/api/summary', methods=['GET'])
+def get_summary():
+    """Totals across all videos: per-class and per-level counts"""
+    return conditional(f"summary-{store.generation()}", store.totals)
+
+@app.route('/api/videos', methods=['GET'])
+def list_videos():
+    """One page of videos, newest first; pass the returned cursor as ?before= for the next page"""
+    try:
+        limit = min(max(int(request.args.get('limit', 20)), 1), MAX_PAGE_SIZE)
+        before = request.args.get('before', type=int)
+    except ValueError:
+        return jsonify({'error': 'limit must be an integer'}), 400
+    level = request.args.get('level')
+    class_name = request.args.get('class')
+
+    def build():
+        videos, next_cursor = store.list_videos(limit, before, level, class_name)
+        return {'videos': videos, 'next': next_cursor}
+
+    key = f"videos-{store.generation()}-{limit}-{before}-{level}-{class_name}"
+    return conditional(key, build)
+
+@app.route('/api/videos/<video_id>', methods=['GET'])
+def get_video(video_id):
+    """Summary of one video with its detected objects"""
+    seq = store.video_seq(video_id)
+    if seq is None:
+        return jsonify({'error': 'Unknown video'}), 404
+    return conditional(f"video-{video_id}-{seq}", lambda: store.get_video(video_id))
+
+@app.route('/api/videos/<video_id>/analysis', methods=['GET'])
+def get_analysis(video_id):
+    """Server-side threat assessment and report for one video"""
+    seq = store.video_seq(video_id)
+    if seq is None:
+        return jsonify({'error': 'Unknown video'}), 404
+    return conditional(f"analysis-{video_id}-{seq}", lambda: store.get_analysis(video_id))
+
+@app.route('/api/videos/<video_id>/tracks', methods=['GET'])
+def get_tracks(video_id):
+    """Tracks of one video, filtered by ?class= and the ?start=/?end= time window in seconds"""
+    seq = store.video_seq(video_id)
+    if seq is None:
+        return jsonify({'error': 'Unknown video'}), 404
+    class_name = request.args.get('class')
+    start_s = request.args.get('start', type=float)
+    end_s = request.args.get('end', type=float)
+    return conditional(
+        f"tracks-{video_id}-{seq}-{class_name}-{start_s}-{end_s}",
+        lambda: {'tracks': store.get_tracks(video_id, class_name, start_s, end_s)},
+    )
+
+@app.route('/api/detections', methods=['POST'])
+def ingest_detections():
+    """Index a detection summary: {"videoId": ..., "summary": {...}}"""
+    data = request.json or {}
+    video_id = data.get('videoId')
+    summary = data.get('summary')
+    if not video_id or not isinstance(summary, dict):
+        return jsonify({'error': 'Missing videoId or summary'}), 400
+    store.ingest(video_id, summary)
+    return jsonify({'success': True, 'videoId': video_id}), 201
+
+if __name__ == '__main__':
+    # Development server; use `python serve.py detections` in production
+    index_json_dir()
+    app.run(port=5004)
@@ -0,0 +1,316 @@
+import os
+import json
+import time
+import sqlite3
+import argparse
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+from threat_scoring import get_scorer
+from threat_response_creation import ANALYSIS_VERSION, analyze_threat_data, file_sha256
+
+DEFAULT_DB_PATH = os.getenv("DETECTION_DB", os.path.join(os.path.dirname(os.path.abspath(__file__)), "detections.db"))
+# Detection files indexed when the detection API starts
+DEFAULT_JSON_DIR = os.getenv("DETECTION_JSON_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "jsons"))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS videos (
+    video_id TEXT PRIMARY KEY,
+    seq INTEGER NOT NULL UNIQUE,
+    filename TEXT,
+    resolution TEXT,
+    fps REAL,
+    total_frames INTEGER,
+    duration_s REAL,
+    total_detections INTEGER NOT NULL,
+    level TEXT NOT NULL,
+    score REAL NOT NULL,
+    source_sha256 TEXT,
+    ingested_at REAL NOT NULL,
+    summary TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS videos_level_seq ON videos (level, seq);
+CREATE TABLE IF NOT EXISTS detections (
+    video_id TEXT NOT NULL,
+    class_name TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (video_id, class_name)
+);
+CREATE INDEX IF NOT EXISTS detections_class ON detections (class_name, video_id);
+CREATE TABLE IF NOT EXISTS tracks (
+    video_id TEXT NOT NULL,
+    tracker_id INTEGER NOT NULL,
+    class_name TEXT NOT NULL,
+    start_s REAL NOT NULL,
+    end_s REAL NOT NULL,
+    max_confidence REAL,
+    PRIMARY KEY (video_id, tracker_id)
+);
+CREATE INDEX IF NOT EXISTS tracks_video_time ON tracks (video_id, start_s);
+CREATE INDEX IF NOT EXISTS tracks_class_time ON tracks (class_name, start_s);
+CREATE TABLE IF NOT EXISTS analyses (
+    video_id TEXT PRIMARY KEY,
+    version INTEGER NOT NULL,
+    assessment TEXT NOT NULL,
+    report TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS class_totals (
+    class_name TEXT PRIMARY KEY,
+    total INTEGER NOT NULL,
+    videos INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS level_totals (
+    level TEXT PRIMARY KEY,
+    videos INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO meta (key, value) VALUES ('generation', 0);
+"""
+
+
+def video_id_for(path: str) -> str:
+    """Video ID of a detection file: its base name without the _detections suffix"""
+    base_name = os.path.splitext(os.path.basename(path))[0]
+    return base_name[:-len("_detections")] if base_name.endswith("_detections") else base_name
+
+
+class DetectionStore:
+    """
+    SQLite index over detection summaries and their analyses.
+
+    Per-class and per-level totals are maintained on ingest, so dashboard
+    aggregates are single-row reads. Every ingest bumps a generation counter
+    that the API uses as the ETag for list and aggregate responses.
+    """
+
+    def __init__(self, path: str = DEFAULT_DB_PATH):
+        self.path = path
+        # Other processes (API workers, the pipeline) write to the same file; wait for their locks
+        self.conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.lock = threading.Lock()
+        with self.lock, self.conn:
+            if path != ":memory:":
+                self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.executescript(SCHEMA)
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+    def generation(self) -> int:
+        with self.lock:
+            return self.conn.execute("SELECT value FROM meta WHERE key = 'generation'").fetchone()[0]
+
+    def source_digest(self, video_id: str) -> Optional[str]:
+        with self.lock:
+            row = self.conn.execute("SELECT source_sha256 FROM videos WHERE video_id = ?", (video_id,)).fetchone()
+        return row[0] if row else None
+
+    def ingest(self, video_id: str, summary: Dict[str, Any], source_sha256: Optional[str] = None):
+        """Insert or replace a video's summary, tracks and analysis and update the totals"""
+        assessment = get_scorer().score(summary)
+        report = analyze_threat_data(summary)
+        video_info = summary.get("video_info", {})
+        fps = video_info.get("fps") or 0
+        total_frames = video_info.get("total_frames") or video_info.get("processed_frames") or 0
+        objects = summary.get("unique_objects") or {}
+
+        with self.lock, self.conn:
+            # Take the write lock before reading the old row, so a concurrent ingest of the
+            # same video cannot slip in between _remove's SELECT and the INSERT
+            self.conn.execute("BEGIN IMMEDIATE")
+            self._remove(video_id)
+            generation = self.conn.execute(
+                "UPDATE meta SET value = value + 1 WHERE key = 'generation' RETURNING value").fetchone()[0]
+            self.conn.execute(
+                "INSERT INTO videos (video_id, seq, filename, resolution, fps, total_frames, duration_s, "
+                "total_detections, level, score, source_sha256, ingested_at, summary) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (video_id, generation, video_info.get("filename"), video_info.get("resolution"), fps,
+                 total_frames, total_frames / fps if fps else None, assessment["total_objects"],
+                 assessment["level"], assessment["score"], source_sha256, time.time(), json.dumps(summary)),
+            )
+            self.conn.executemany(
+                "INSERT INTO detections (video_id, class_name, count) VALUES (?, ?, ?)",
+                [(video_id, name, count) for name, count in objects.items()],
+            )
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO tracks (video_id, tracker_id, class_name, start_s, end_s, max_confidence) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                [(video_id, track["tracker_id"], track["class_name"], track.get("start_s", 0.0),
+                  track.get("end_s", 0.0), track.get("max_confidence")) for track in summary.get("tracks") or []],
+            )
+            self.conn.execute(
+                "INSERT INTO analyses (video_id, version, assessment, report) VALUES (?, ?, ?, ?)",
+                (video_id, ANALYSIS_VERSION, json.dumps(assessment), report),
+            )
+            self.conn.executemany(
+                "INSERT INTO class_totals (class_name, total, videos) VALUES (?, ?, 1) "
+                "ON CONFLICT (class_name) DO UPDATE SET total = total + excluded.total, videos = videos + 1",
+                list(objects.items()),
+            )
+            self.conn.execute(
+                "INSERT INTO level_totals (level, videos) VALUES (?, 1) "
+                "ON CONFLICT (level) DO UPDATE SET videos = videos + 1",
+                (assessment["level"],),
+            )
+
+    def _remove(self, video_id: str):
+        """Delete a video and take its counts out of the totals (caller holds the lock and the write transaction)"""
+        row = self.conn.execute("SELECT level FROM videos WHERE video_id = ?", (video_id,)).fetchone()
+        if row is None:
+            return
+        for class_name, count in self.conn.execute(
+                "SELECT class_name, count FROM detections WHERE video_id = ?", (video_id,)).fetchall():
+            self.conn.execute(
+                "UPDATE class_totals SET total = total - ?, videos = videos - 1 WHERE class_name = ?",
+                (count, class_name))
+        self.conn.execute("UPDATE level_totals SET videos = videos - 1 WHERE level = ?", (row["level"],))
+        self.conn.execute("DELETE FROM class_totals WHERE videos <= 0")
+        self.conn.execute("DELETE FROM level_totals WHERE videos <= 0")
+        for table in ("videos", "detections", "tracks", "analyses"):
+            self.conn.execute(f"DELETE FROM {table} WHERE video_id = ?", (video_id,))
+
+    def ingest_file(self, path: str, force: bool = False) -> bool:
+        """Ingest a detection JSON file unless the same content is already indexed"""
+        video_id = video_id_for(path)
+        digest = file_sha256(path)
+        if not force and self.source_digest(video_id) == digest:
+            return False
+        with open(path, "r") as f:
+            summary = json.load(f)
+        self.ingest(video_id, summary, digest)
+        return True
+
+    def ingest_dir(self, json_dir: str, force: bool = False) -> int:
+        ingested = 0
+        for name in sorted(os.listdir(json_dir)):
+            if name.endswith(".json"):
+                try:
+                    ingested += self.ingest_file(os.path.join(json_dir, name), force)
+                except (OSError, ValueError, sqlite3.Error) as e:
+                    print(f"Error ingesting {name}: {e}")
+        return ingested
+
+    def list_videos(self, limit: int = 20, before: Optional[int] = None, level: Optional[str] = None,
+                    class_name: Optional[str] = None) -> Tuple[List[Dict[str, Any]], Optional[int]]:
+        """
+        One page of videos, newest first (keyset pagination on seq).
+
+        Returns:
+            The rows and the cursor for the next page (None on the last page)
+        """
+        query = ("SELECT v.video_id, v.seq, v.filename, v.resolution, v.fps, v.duration_s, "
+                 "v.total_detections, v.level, v.score, v.ingested_at FROM videos v")
+        conditions, params = [], []
+        if class_name:
+            query += " JOIN detections d ON d.video_id = v.video_id AND d.class_name = ?"
+            params.append(class_name)
+        if level:
+            conditions.append("v.level = ?")
+            params.append(level.upper())
+        if before is not None:
+            conditions.append("v.seq < ?")
+            params.append(before)
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        query += " ORDER BY v.seq DESC LIMIT ?"
+        params.append(limit + 1)
+        with self.lock:
+            rows = [dict(row) for row in self.conn.execute(query, params).fetchall()]
+        next_cursor = rows[limit - 1]["seq"] if len(rows) > limit else None
+        return rows[:limit], next_cursor
+
+    def get_video(self, video_id: str) -> Optional[Dict[str, Any]]:
+        with self.lock:
+            row = self.conn.execute("SELECT * FROM videos WHERE video_id = ?", (video_id,)).fetchone()
+            if row is None:
+                return None
+            track_count = self.conn.execute(
+                "SELECT COUNT(*) FROM tracks WHERE video_id = ?", (video_id,)).fetchone()[0]
+        video = dict(row)
+        summary = json.loads(video.pop("summary"))
+        video["video_info"] = summary.get("video_info", {})
+        video["unique_objects"] = summary.get("unique_objects", {})
+        video["streams"] = summary.get("streams")
+        video["clips"] = summary.get("clips") or []
+        video["track_count"] = track_count
+        return video
+
+    def video_seq(self, video_id: str) -> Optional[int]:
+        with self.lock:
+            row = self.conn.execute("SELECT seq FROM videos WHERE video_id = ?", (video_id,)).fetchone()
+        return row[0] if row else None
+
+    def get_analysis(self, video_id: str) -> Optional[Dict[str, Any]]:
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT version, assessment, report FROM analyses WHERE video_id = ?", (video_id,)).fetchone()
+        if row is None:
+            return None
+        return {"video_id": video_id, "version": row["version"], **json.loads(row["assessment"]),
+                "report": row["report"]}
+
+    def get_tracks(self, video_id: str, class_name: Optional[str] = None, start_s: Optional[float] = None,
+                   end_s: Optional[float] = None) -> List[Dict[str, Any]]:
+        """Tracks of a video, optionally filtered by class and overlapping [start_s, end_s]"""
+        query = "SELECT tracker_id, class_name, start_s, end_s, max_confidence FROM tracks WHERE video_id = ?"
+        params: List[Any] = [video_id]
+        if class_name:
+            query += " AND class_name = ?"
+            params.append(class_name)
+        if end_s is not None:
+            query += " AND start_s <= ?"
+            params.append(end_s)
+        if start_s is not None:
+            query += " AND end_s >= ?"
+            params.append(start_s)
+        query += " ORDER BY start_s"
+        with self.lock:
+            return [dict(row) for row in self.conn.execute(query, params).fetchall()]
+
+    def totals(self) -> Dict[str, Any]:
+        """Dashboard aggregates, read from the maintained totals tables"""
+        with self.lock:
+            classes = {row["class_name"]: {"total": row["total"], "videos": row["videos"]}
+                       for row in self.conn.execute("SELECT * FROM class_totals ORDER BY total DESC")}
+            levels = {row["level"]: row["videos"] for row in self.conn.execute("SELECT * FROM level_totals")}
+        return {
+            "videos": sum(levels.values()),
+            "detections": sum(entry["total"] for entry in classes.values()),
+            "levels": levels,
+            "classes": classes,
+        }
+
+
+def index_json_dir(json_dir: str = DEFAULT_JSON_DIR, path: str = DEFAULT_DB_PATH) -> int:
+    """
+    Index a directory of detection files once, before the API's workers start
+    (see serve.py). The connection is closed again, so no forked worker inherits it.
+    """
+    if not os.path.isdir(json_dir):
+        return 0
+    store = DetectionStore(path)
+    try:
+        ingested = store.ingest_dir(json_dir)
+    finally:
+        store.close()
+    print(f"Indexed {ingested} new or changed detection file(s) from {json_dir}")
+    return ingested
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Index detection JSON files for the detection API")
+    parser.add_argument("--json-dir", default=DEFAULT_JSON_DIR, help="Directory containing detection JSON files")
+    parser.add_argument("--db", default=DEFAULT_DB_PATH, help="SQLite database path")
+    parser.add_argument("--force", action="store_true", help="Re-index every file")
+    args = parser.parse_args()
+
+    store = DetectionStore(args.db)
+    started = time.perf_counter()
+    ingested = store.ingest_dir(args.json_dir, args.force)
+    print(f"Indexed {ingested} new or changed file(s) in {time.perf_counter() - started:.2f}s")
+    print(json.dumps(store.totals(), indent=2))
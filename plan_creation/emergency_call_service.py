@@ -1,13 +1,18 @@
 from flask import Flask, request, jsonify, Response
 from flask_cors import CORS
 from twilio.rest import Client
+from twilio.request_validator import RequestValidator
 from twilio.twiml.voice_response import VoiceResponse
 import os
 from dotenv import load_dotenv
-import google.generativeai as genai
+from call_dispatcher import CallDispatcher, FakeTwilioClient
+from call_scripts import CallScriptEngine
+from llm_backends import CALL_SCRIPT_BUDGET_MS, complete
+from instrumentation import instrument_flask
 
 app = Flask(__name__)
 CORS(app)
+instrument_flask(app, "emergency")
 
 # Load environment variables
 load_dotenv()
@@ -16,35 +21,90 @@ load_dotenv()
 account_sid = os.getenv('TWILIO_ACCOUNT_SID')
 auth_token = os.getenv('TWILIO_AUTH_TOKEN')
 twilio_number = os.getenv('TWILIO_PHONE_NUMBER')
-client = Client(account_sid, auth_token)
+# Public URL Twilio uses to reach this service (for testing, an ngrok tunnel)
+public_base_url = os.getenv('PUBLIC_BASE_URL', "https://1d6c-2600-1700-1870-6920-00-3.ngrok-free.app")
 
-# Store the latest emergency message
-current_emergency_message = ""
+# The local stand-in is used only when asked for with TWILIO_FAKE=1. Without
+# credentials there is no client: /readyz fails and calls are refused, rather
+# than accepted and never dialed.
+if os.getenv('TWILIO_FAKE') == '1':
+    print("Using fake Twilio client; no real calls will be placed")
+    client = FakeTwilioClient()
+elif account_sid and auth_token:
+    client = Client(account_sid, auth_token)
+else:
+    print("Warning: TWILIO_ACCOUNT_SID/TWILIO_AUTH_TOKEN not set; emergency calls are disabled")
+    client = None
+# Checks that status callbacks really come from Twilio
+validator = RequestValidator(auth_token) if auth_token else None
 
-# Configure Gemini
-genai.configure(api_key=os.getenv('GEMINI_API_KEY'))
-
-def generate_call_script(emergency_message):
-    """Generate a more natural speaking script from the emergency message"""
+def generate_call_script(script, emergency_message=""):
+    """Generate a more natural speaking script from the template script and the operator's message"""
     try:
-        model = genai.GenerativeModel('gemini-pro')
         prompt = f"""
-        Convert this emergency alert message into a clear, concise speaking script for an automated emergency call:
+        Convert this emergency alert into a clear, concise speaking script for an automated emergency call.
+
+        Alert script:
+        {script}
+
+        Operator message (keep its priority, response units, ETA and required actions):
         {emergency_message}
         
         Make it sound natural and urgent but calm. Include only the most critical information.
         Format it as a simple paragraph that can be read aloud.
         """
-        response = model.generate_content(prompt)
-        return response.text
+        return complete(prompt, budget_ms=CALL_SCRIPT_BUDGET_MS)
     except Exception as e:
         print(f"Error generating script: {e}")
-        return emergency_message
+        return script
+
+# Calls start with a template script; the LLM version replaces it once ready
+script_engine = CallScriptEngine(refiner=generate_call_script)
+
+def build_call_script(job_id, emergency_message, threat):
+    return script_engine.script_for(
+        emergency_message,
+        threat,
+        on_refined=lambda script: dispatcher.set_message(job_id, script),
+    )
+
+dispatcher = CallDispatcher(
+    client,
+    from_number=twilio_number,
+    twiml_base_url=public_base_url,
+    script_generator=build_call_script,
+    max_workers=int(os.getenv('CALL_WORKERS', 8)),
+    calls_per_second=float(os.getenv('CALLS_PER_SECOND', 1.0)),
+    status_callback_url=f"{public_base_url}/twilio/status",
+)
+
+# When EVENT_BUS_PATH is set, alerts published by threat_pipeline.py are dialed
+# by this service (run the pipeline without --dispatch in that case)
+alert_pipeline = None
+if os.getenv('EVENT_BUS_PATH') and client is not None:
+    from threat_pipeline import EventBus, ThreatPipeline
+    alert_pipeline = ThreatPipeline(EventBus(os.environ['EVENT_BUS_PATH']))
+    alert_pipeline.subscribe_dispatcher(
+        dispatcher, [number for number in os.getenv('ALERT_RECIPIENTS', '').split(',') if number])
+    alert_pipeline.bus.start()
+
+def ready():
+    """Readiness checks reported by serve.py at /readyz"""
+    checks = {
+        "twilio_client": client is not None,
+        "from_number": bool(twilio_number) or isinstance(client, FakeTwilioClient),
+    }
+    if alert_pipeline is not None:
+        checks["event_bus"] = all(thread.is_alive() for thread in alert_pipeline.bus.threads)
+    return checks
 
 @app.route('/twiml', methods=['GET', 'POST'])
 def get_twiml():
     """Return TwiML for the emergency call"""
-    global current_emergency_message
+    message_id = request.values.get('messageId')
+    message = dispatcher.get_message(message_id) if message_id else None
+    if message is None:
+        return Response('Unknown message', status=404)
     
     # Create TwiML response
     response = VoiceResponse()
@@ -53,46 +113,65 @@ def get_twiml():
     response.pause(length=1)
     
     # Add the emergency message
-    response.say(current_emergency_message, voice='alice')
+    response.say(message, voice='alice')
     
     # Return the TwiML
     return Response(str(response), mimetype='text/xml')
 
+@app.route('/twilio/status', methods=['POST'])
+def twilio_status():
+    """Receive call progress updates from Twilio"""
+    if not isinstance(client, FakeTwilioClient):
+        # Twilio signs the callback URL it was given plus the form fields
+        signature = request.headers.get('X-Twilio-Signature', '')
+        if validator is None or not validator.validate(dispatcher.status_callback_url, request.form, signature):
+            return Response('Invalid signature', status=403)
+    dispatcher.update_call_status(request.values.get('CallSid'), request.values.get('CallStatus'))
+    return Response(status=204)
+
 @app.route('/api/emergency-call', methods=['POST'])
 def make_emergency_call():
     try:
-        global current_emergency_message
-        
         data = request.json
         emergency_message = data.get('message')
-        recipient_number = data.get('recipientNumber')
+        threat = data.get('threat')
+        recipients = list(data.get('recipientNumbers') or [])
+        if data.get('recipientNumber'):
+            recipients.append(data.get('recipientNumber'))
 
-        if not emergency_message or not recipient_number:
+        if not emergency_message or not recipients:
             return jsonify({'error': 'Missing required parameters'}), 400
+        if client is None:
+            return jsonify({'error': 'Twilio is not configured'}), 503
 
-        # Generate the call script
-        current_emergency_message = generate_call_script(emergency_message)
-        
-        # Get the public URL for our TwiML endpoint
-        # For testing, we'll use ngrok to expose our local server
-        twiml_url = "https://1d6c-2600-1700-1870-6920-00-3.ngrok-free.app/twiml"
-
-        # Make the call using our TwiML endpoint
-        call = client.calls.create(
-            url=twiml_url,
-            to=recipient_number,
-            from_=twilio_number
-        )
+        # Script generation and dialing happen on the dispatcher's worker pool
+        job_id = dispatcher.submit(emergency_message, recipients, threat)
 
         return jsonify({
             'success': True,
-            'callSid': call.sid,
-            'status': call.status,
-            'message': current_emergency_message
-        })
+            'jobId': job_id,
+            'status': 'queued',
+            'recipients': recipients
+        }), 202
 
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/emergency-call/<job_id>', methods=['GET'])
+def get_emergency_call(job_id):
+    """Report the status of a call job and each of its calls"""
+    job = dispatcher.get_job(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown job'}), 404
+    return jsonify(job)
+
+@app.route('/api/alerts/latency', methods=['GET'])
+def alert_latency():
+    """Detection-to-alert and detection-to-dial latency for bus alerts"""
+    if alert_pipeline is None:
+        return jsonify({'error': 'Event bus not configured'}), 404
+    return jsonify(alert_pipeline.latency_report())
+
 if __name__ == '__main__':
-    app.run(port=5001)
+    # Development server; use `python serve.py emergency` in production
+    app.run(port=5002)
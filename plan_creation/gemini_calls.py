@@ -1,59 +1,184 @@
-import requests
+import hashlib
+import io
 import json
 import os
+import sqlite3
 import time
 import argparse
-from google import genai
-from google.genai import types
 from dotenv import load_dotenv  # Import dotenv
 from typing import Dict, List, Any, ClassVar, Optional
-from langgraph.graph import StateGraph
-from langgraph.checkpoint.memory import MemorySaver
+from llm_backends import PLAN_BUDGET_MS, complete
+from threat_fusion import fuse_threats, load_records
+import structured_plan
 
+# LangGraph and the Gemini SDK are imported where they are used, so the voice
+# service can import this module for sniff_audio_mime and transcribe without
+# paying for either at startup. Clients come from llm_backends.get_gemini_client.
 
 # Load environment variables early to configure the API key
 load_dotenv()
-# Configure the Gemini API key
-try:
-    client = genai.Client(api_key=os.environ["GEMINI_API_KEY"])
-except KeyError:
-    print("Error: GEMINI_API_KEY not found in environment variables.")
-    print("Please ensure it is set in your .env file or environment.")
-    exit(1) # Exit if the key is not found
-
-def gemini_client(client, input_text):
-    response = client.models.generate_content(
-        model="gemini-2.0-flash",
-        contents=[input_text],
-        config=types.GenerateContentConfig(
-            system_instruction="You are a strategic emergency response system. You are to respond with concise, accurate, precise, and actionable responses. These responses will be used to generate a response plan.",
-            response_mime_type="text/plain"),
-    )
-    return response.text
-
-def transcribe(client, audio_file_path):
-    """
-    Transcribe an audio file using Gemini's speech-to-text capabilities.
+
+PLAN_SYSTEM_INSTRUCTION = "You are a strategic emergency response system. You are to respond with concise, accurate, precise, and actionable responses. These responses will be used to generate a response plan."
+
+# Fixed instructions that open each planning prompt. Keeping them ahead of the
+# per-threat data makes system instruction + preamble a shared prompt prefix
+# that a self-hosted model can cache (see llama_modal.Model.generate).
+ANALYSIS_PREAMBLE = """Analyze the following threat detection and provide a concise threat assessment.
+Provide a threat analysis including potential intent, capabilities, and immediate concerns.
+
+"""
+
+RESPONSE_PLAN_PREAMBLE = """Based on the following threat information and analysis, create a detailed response plan.
+Provide a step-by-step response plan including immediate actions, personnel required, and containment strategies.
+
+"""
+
+RESOURCES_PREAMBLE = """Based on the following response plan, identify and list all resources needed.
+List all personnel, equipment, vehicles, and other resources needed to execute this plan.
+Format as a numbered list.
+
+"""
+
+FINAL_RESPONSE_PREAMBLE = """Create a comprehensive threat response document with the sections below.
+Format this as a complete, professional security response document with clear section headings.
+
+"""
+
+# Completed and partially completed plans survive restarts here, so an
+# interrupted batch resumes where it stopped instead of starting over
+CHECKPOINT_DB = os.getenv("PLAN_CHECKPOINT_DB", os.path.join(os.path.dirname(os.path.abspath(__file__)), "plan_checkpoints.db"))
+
+# "graph" runs the four-step agent; "structured" asks for the whole plan in one
+# schema-constrained call and falls back to the graph if it does not validate
+PLAN_MODE = os.getenv("PLAN_MODE", "graph")
+
+# Camera keyframes attached to the threat analysis (0 sends text only). Each
+# keyframe is cropped to fit one 768x768 tile (see camera/keyframes.py), which
+# Gemini counts as IMAGE_TOKENS prompt tokens.
+MAX_PLAN_IMAGES = int(os.getenv("MAX_PLAN_IMAGES", "3"))
+IMAGE_TOKENS = 258
+
+# Planning calls and estimated tokens since the last reset, for comparing modes
+plan_usage = {"calls": 0, "prompt_tokens": 0, "output_tokens": 0, "image_tokens": 0}
+
+def reset_plan_usage():
+    plan_usage.update(calls=0, prompt_tokens=0, output_tokens=0, image_tokens=0)
+
+def load_keyframes(threat: Dict[str, Any], limit: int = MAX_PLAN_IMAGES) -> List[bytes]:
+    """
+    Read up to `limit` of the threat's keyframe JPEGs, best first.
+    
+    Keyframes that were not copied off the detection volume are skipped, so a
+    threat always plans, with or without its pictures.
+    """
+    images = []
+    for path in (threat.get("keyframes") or [])[:limit]:
+        try:
+            with open(path, "rb") as f:
+                images.append(f.read())
+        except OSError as e:
+            print(f"Skipping keyframe {path}: {e}")
+    return images
+
+def plan_llm(input_text, preamble="", schema=None, images=None):
+    """Run one planning step on the backend chosen for the plan latency budget"""
+    output = complete(input_text, budget_ms=PLAN_BUDGET_MS, system=PLAN_SYSTEM_INSTRUCTION,
+                      preamble=preamble, schema=schema, images=images)
+    plan_usage["calls"] += 1
+    plan_usage["image_tokens"] += IMAGE_TOKENS * len(images or [])
+    # The provider counts the response schema as prompt tokens too
+    schema_text = json.dumps(schema) if schema is not None else ""
+    plan_usage["prompt_tokens"] += structured_plan.estimate_tokens(
+        PLAN_SYSTEM_INSTRUCTION + preamble + input_text + schema_text)
+    plan_usage["output_tokens"] += structured_plan.estimate_tokens(output)
+    return output
+
+# Largest clip sent inline with the request; anything bigger goes through the
+# Files API, which uploads the stream in chunks instead of one base64 blob.
+INLINE_AUDIO_LIMIT = 8 * 1024 * 1024
+
+# Leading bytes of the container formats browsers and recorders produce.
+AUDIO_SIGNATURES = [
+    (b"\x1a\x45\xdf\xa3", "audio/webm"),
+    (b"OggS", "audio/ogg"),
+    (b"fLaC", "audio/flac"),
+    (b"ID3", "audio/mp3"),
+    (b"\xff\xfb", "audio/mp3"),
+    (b"\xff\xf3", "audio/mp3"),
+    (b"\xff\xf2", "audio/mp3"),
+    (b"\xff\xf1", "audio/aac"),
+    (b"\xff\xf9", "audio/aac"),
+]
+
+def sniff_audio_mime(header, default="audio/mp3"):
+    """
+    Guess the audio MIME type from the first bytes of a clip.
+    
+    Args:
+        header: At least the first 12 bytes of the audio data
+        default: MIME type to use when the format is not recognised
+        
+    Returns:
+        The detected MIME type
+    """
+    header = bytes(header[:12])
+    if header[:4] == b"RIFF" and header[8:12] == b"WAVE":
+        return "audio/wav"
+    if header[4:8] == b"ftyp":
+        return "audio/mp4"
+    for signature, mime_type in AUDIO_SIGNATURES:
+        if header.startswith(signature):
+            return mime_type
+    return default
+
+def transcribe(client, audio, mime_type=None):
+    """
+    Transcribe an audio clip using Gemini's speech-to-text capabilities.
     
     Args:
         client: The Gemini API client
-        audio_file_path: Path to the audio file to transcribe
+        audio: Raw audio bytes, a binary file-like object, or a path to an audio file
+        mime_type: MIME type of the audio (sniffed from the data when omitted)
         
     Returns:
         The transcribed text as a string
     """
+    from google.genai import types
+
+    uploaded = None
     try:
-        # Read the audio file
-        with open(audio_file_path, "rb") as f:
-            audio_data = f.read()
+        if isinstance(audio, str):
+            with open(audio, "rb") as f:
+                audio = f.read()
+        
+        if isinstance(audio, (bytes, bytearray, memoryview)):
+            size = len(audio)
+            header = bytes(audio[:12])
+        else:
+            # File-like object: measure it without reading it into memory
+            start = audio.tell()
+            header = audio.read(12)
+            size = audio.seek(0, os.SEEK_END) - start
+            audio.seek(start)
         
-        # Create the audio part correctly using the Part class
-        audio_part = types.Part(
-            inline_data=types.Blob(
-                mime_type="audio/mp3",
-                data=audio_data
+        mime_type = mime_type or sniff_audio_mime(header)
+        
+        if size <= INLINE_AUDIO_LIMIT:
+            data = audio if isinstance(audio, (bytes, bytearray, memoryview)) else audio.read()
+            audio_part = types.Part(
+                inline_data=types.Blob(
+                    mime_type=mime_type,
+                    data=bytes(data)
+                )
             )
-        )
+        else:
+            if isinstance(audio, (bytes, bytearray, memoryview)):
+                audio = io.BytesIO(audio)
+            uploaded = client.files.upload(
+                file=audio,
+                config=types.UploadFileConfig(mime_type=mime_type)
+            )
+            audio_part = types.Part.from_uri(file_uri=uploaded.uri, mime_type=mime_type)
         
         # Generate content with the text prompt and audio part
         response = client.models.generate_content(
@@ -71,6 +196,12 @@ def transcribe(client, audio_file_path):
     except Exception as e:
         print(f"Error transcribing audio: {e}")
         return ""
+    finally:
+        if uploaded is not None:
+            try:
+                client.files.delete(name=uploaded.name)
+            except Exception as e:
+                print(f"Warning: Failed to delete uploaded audio {uploaded.name}: {e}")
 
 # State definition for the agentic framework
 class ThreatResponseState(Dict[str, Any]):
@@ -82,6 +213,7 @@ class ThreatResponseState(Dict[str, Any]):
     response_plan: Optional[str] = None
     resources_needed: Optional[List[str]] = None
     final_response: Optional[str] = None
+    mode: Optional[str] = None
 
 # Function to load threat data from JSON files
 def load_threat_data(threat_file_path: str) -> Dict[str, Any]:
@@ -118,19 +250,19 @@ def analyze_threat(state: ThreatResponseState) -> ThreatResponseState:
     
     # Format the threat data into a descriptive prompt
     prompt = f"""
-    Analyze the following threat detection and provide a concise threat assessment:
-    
     Detected Object(s): {', '.join([obj['type'] for obj in threat['objects_detected']])}
     Threat Level: {threat['threat_level']}
     Location: Latitude {threat['coordinates']['latitude']}, Longitude {threat['coordinates']['longitude']}, Altitude {threat['coordinates']['altitude']}
     Conditions: {threat['environment_conditions']['time_of_day']} - {threat['environment_conditions']['weather']}
     Raw Description: {threat['raw_description']}
-    
-    Provide a threat analysis including potential intent, capabilities, and immediate concerns.
     """
+    # Later steps work from this analysis, so only this call carries the pictures
+    images = load_keyframes(threat)
+    if images:
+        prompt += f"Attached: {len(images)} camera keyframes of the detected objects, clearest first.\n"
     
-    # Get response from Gemini
-    analysis = gemini_client(client, prompt)
+    # Get response from the planning LLM
+    analysis = plan_llm(prompt, preamble=ANALYSIS_PREAMBLE, images=images)
     
     # Update state
     state["threat_analysis"] = analysis
@@ -150,8 +282,6 @@ def generate_response_plan(state: ThreatResponseState) -> ThreatResponseState:
     analysis = state["threat_analysis"]
     
     prompt = f"""
-    Based on the following threat information and analysis, create a detailed response plan:
-    
     THREAT INFORMATION:
     Detected Object(s): {', '.join([obj['type'] for obj in threat['objects_detected']])}
     Threat Level: {threat['threat_level']}
@@ -160,12 +290,10 @@ def generate_response_plan(state: ThreatResponseState) -> ThreatResponseState:
     
     THREAT ANALYSIS:
     {analysis}
-    
-    Provide a step-by-step response plan including immediate actions, personnel required, and containment strategies.
     """
     
-    # Get response from Gemini
-    response_plan = gemini_client(client, prompt)
+    # Get response from the planning LLM
+    response_plan = plan_llm(prompt, preamble=RESPONSE_PLAN_PREAMBLE)
     
     # Update state
     state["response_plan"] = response_plan
@@ -184,17 +312,12 @@ def identify_resources(state: ThreatResponseState) -> ThreatResponseState:
     response_plan = state["response_plan"]
     
     prompt = f"""
-    Based on the following response plan, identify and list all resources needed:
-    
     RESPONSE PLAN:
     {response_plan}
-    
-    List all personnel, equipment, vehicles, and other resources needed to execute this plan.
-    Format as a numbered list.
     """
     
-    # Get response from Gemini
-    resources = gemini_client(client, prompt)
+    # Get response from the planning LLM
+    resources = plan_llm(prompt, preamble=RESOURCES_PREAMBLE)
     
     # Update state with resources as a list (assuming the model returns a numbered list)
     # We'll process the raw text into a list
@@ -218,8 +341,6 @@ def finalize_response(state: ThreatResponseState) -> ThreatResponseState:
     resources = state["resources_needed"]
     
     prompt = f"""
-    Create a comprehensive threat response document with the following sections:
-    
     THREAT INFORMATION:
     Detected Object(s): {', '.join([obj['type'] for obj in threat['objects_detected']])}
     Threat Level: {threat['threat_level']}
@@ -235,25 +356,148 @@ def finalize_response(state: ThreatResponseState) -> ThreatResponseState:
     
     RESOURCES REQUIRED:
     {chr(10).join(resources)}
-    
-    Format this as a complete, professional security response document with clear section headings.
     """
     
-    # Get response from Gemini
-    final_response = gemini_client(client, prompt)
+    # Get response from the planning LLM
+    final_response = plan_llm(prompt, preamble=FINAL_RESPONSE_PREAMBLE)
     
     # Update state
     state["final_response"] = final_response
     return state
 
+def describe_threat(threat: Dict[str, Any]) -> str:
+    """The threat fields the planning prompts share"""
+    coordinates = threat.get('coordinates', {})
+    conditions = threat.get('environment_conditions', {})
+    return f"""
+    Detected Object(s): {', '.join([obj['type'] for obj in threat.get('objects_detected', [])])}
+    Threat Level: {threat.get('threat_level', 'unknown')}
+    Location: Latitude {coordinates.get('latitude')}, Longitude {coordinates.get('longitude')}, Altitude {coordinates.get('altitude')}
+    Conditions: {conditions.get('time_of_day', 'unknown')} - {conditions.get('weather', 'unknown')}
+    Raw Description: {threat.get('raw_description', '')}
+    """
+
+def plan_structured(threat: Dict[str, Any]) -> Optional[ThreatResponseState]:
+    """
+    Plan a threat with one structured-output call and a locally rendered document.
+    
+    Args:
+        threat: The threat record
+        
+    Returns:
+        The final state in the same shape as the agent graph's, or None when the
+        answer does not match the plan schema
+    """
+    summary = describe_threat(threat)
+    images = load_keyframes(threat)
+    prompt = summary
+    if images:
+        prompt += f"\nAttached: {len(images)} camera keyframes of the detected objects, clearest first.\n"
+    try:
+        answer = plan_llm(prompt, preamble=structured_plan.STRUCTURED_PLAN_PREAMBLE,
+                          schema=structured_plan.PLAN_SCHEMA, images=images)
+    except Exception as e:
+        print(f"Structured plan call failed: {e}")
+        return None
+    plan = structured_plan.parse_plan(answer)
+    if plan is None:
+        return None
+    return {
+        "threat_data": threat,
+        "threat_analysis": structured_plan.render_analysis(plan),
+        "response_plan": structured_plan.render_response_plan(plan),
+        "resources_needed": structured_plan.render_resources(plan),
+        "final_response": structured_plan.render_document(summary, plan),
+        "plan": plan,
+        "mode": "structured",
+    }
+
+def open_checkpointer(path: str = CHECKPOINT_DB):
+    """SQLite-backed LangGraph checkpointer that persists every finished node"""
+    from langgraph.checkpoint.sqlite import SqliteSaver
+    
+    saver = SqliteSaver(sqlite3.connect(path, check_same_thread=False))
+    saver.setup()
+    return saver
+
+def checkpoint_config(threat_file_path: str, index: int, threat: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Checkpoint thread for one threat, keyed by file, index and content, so an
+    edited threat is planned again instead of reusing the old plan.
+    """
+    digest = hashlib.sha256(json.dumps(threat, sort_keys=True, default=str).encode()).hexdigest()[:16]
+    return {"configurable": {"thread_id": f"{os.path.abspath(threat_file_path)}#{index}:{digest}"}}
+
+def plan_threat(agent, threat: Dict[str, Any], mode: str = PLAN_MODE,
+                config: Optional[Dict[str, Any]] = None) -> ThreatResponseState:
+    """
+    Plan one threat in the given mode, falling back to the agent graph.
+    
+    With a checkpoint `config` (and an agent compiled with a checkpointer), a
+    threat that already has a final response is returned from the checkpoint,
+    and a partially planned one resumes after its last finished node.
+    """
+    if config is not None:
+        snapshot = agent.get_state(config)
+        if snapshot.values.get("final_response"):
+            print("Already planned; reusing the checkpointed response")
+            return dict(snapshot.values)
+        if snapshot.next:
+            print(f"Resuming from checkpoint at {', '.join(snapshot.next)}")
+            final_state = agent.invoke(None, config)
+            final_state["mode"] = "graph"
+            return final_state
+    
+    if mode == "structured":
+        state = plan_structured(threat)
+        if state is not None:
+            if config is not None:
+                # Record the result as a finished graph run so reruns skip it
+                agent.update_state(config, state, as_node="finalize_response")
+            return state
+        print("Falling back to the multi-step agent")
+    final_state = agent.invoke({"threat_data": threat, "mode": "graph"}, config)
+    final_state["mode"] = "graph"
+    return final_state
+
+def compare_modes(threats: List[Dict[str, Any]]):
+    """Plan each threat in both modes and print calls, estimated tokens and latency"""
+    agent = create_threat_response_agent()
+    print(f"{'threat':>6} {'mode':>10} {'calls':>5} {'prompt tok':>10} {'image tok':>9} {'output tok':>10} "
+          f"{'seconds':>8}")
+    totals = {}
+    for index, threat in enumerate(threats, 1):
+        for mode in ("graph", "structured"):
+            reset_plan_usage()
+            started = time.perf_counter()
+            final_state = plan_threat(agent, threat, mode)
+            elapsed = time.perf_counter() - started
+            label = mode if final_state["mode"] == mode else f"{mode}*"
+            print(f"{index:>6} {label:>10} {plan_usage['calls']:>5} {plan_usage['prompt_tokens']:>10} "
+                  f"{plan_usage['image_tokens']:>9} {plan_usage['output_tokens']:>10} {elapsed:>8.2f}")
+            total = totals.setdefault(mode, [0, 0, 0, 0, 0.0])
+            for position, value in enumerate((plan_usage["calls"], plan_usage["prompt_tokens"],
+                                              plan_usage["image_tokens"], plan_usage["output_tokens"], elapsed)):
+                total[position] += value
+    for mode, (calls, prompt_tokens, image_tokens, output_tokens, elapsed) in totals.items():
+        print(f"{mode:>10}: {calls / len(threats):.1f} calls, {prompt_tokens / len(threats):.0f} prompt "
+              f"(+{image_tokens / len(threats):.0f} image) and {output_tokens / len(threats):.0f} output tokens, "
+              f"{elapsed / len(threats):.2f} s per threat")
+    print("(* fell back to the graph; text tokens are estimated at four characters per token)")
+
 # Create the agent workflow using LangGraph
-def create_threat_response_agent():
+def create_threat_response_agent(checkpointer=None):
     """
     Create and return the threat response agent workflow.
     
+    Args:
+        checkpointer: Optional LangGraph checkpointer (see open_checkpointer)
+        
     Returns:
         A callable graph that can be executed with threat data
     """
+    from langgraph.graph import StateGraph
+
     # Define the workflow
     workflow = StateGraph(ThreatResponseState)
     
@@ -272,59 +516,30 @@ def create_threat_response_agent():
     workflow.set_entry_point("analyze_threat")
     
     # Compile the workflow
-    return workflow.compile()
+    return workflow.compile(checkpointer=checkpointer)
 
-def process_threat_file(threat_file_path, output_dir=None):
+def plan_threats(threats, key_path, output_dir=None, mode=PLAN_MODE, checkpointer=None):
     """
-    Process a single threat file and generate a response.
+    Plan each threat in turn and save the responses as response_<n>.txt.
     
     Args:
-        threat_file_path: Path to the JSON file containing threat data
-        output_dir: Directory to save the output (defaults to None)
+        threats: Threat records (or fused incidents) to plan
+        key_path: File or directory the threats came from; keys their checkpoints
+        output_dir: Directory to save the outputs (defaults to None)
+        mode: "graph" or "structured" (see PLAN_MODE)
+        checkpointer: Optional checkpointer; finished threats are skipped on reruns
         
     Returns:
-        The final response
+        The final responses
     """
-    # Load the threat data
-    threat_data = load_threat_data(threat_file_path)
-    
-    # Create the agent
-    agent = create_threat_response_agent()
-    
-    # For a list of threat detections, process each one individually
+    agent = create_threat_response_agent(checkpointer)
     responses = []
-    
-    # Process each threat
-    if isinstance(threat_data, list):
-        for i, threat in enumerate(threat_data):
-            print(f"Processing threat {i+1}/{len(threat_data)}...")
-            
-            # Initialize the agent state
-            state = {"threat_data": threat}
-            
-            # Run the agent
-            final_state = agent.invoke(state)
-            
-            # Get the final response
-            response = final_state["final_response"]
-            responses.append(response)
-            
-            # Save the response to a file if output_dir is specified
-            if output_dir:
-                os.makedirs(output_dir, exist_ok=True)
-                output_file = os.path.join(output_dir, f"response_{i+1}.txt")
-                with open(output_file, 'w') as f:
-                    f.write(response)
-                print(f"Response saved to {output_file}")
-    else:
-        # If threat_data is a single threat (not a list)
-        print("Processing single threat...")
-        
-        # Initialize the agent state
-        state = {"threat_data": threat_data}
+    for i, threat in enumerate(threats):
+        print(f"Processing threat {i+1}/{len(threats)}...")
         
         # Run the agent
-        final_state = agent.invoke(state)
+        config = checkpoint_config(key_path, i, threat) if checkpointer else None
+        final_state = plan_threat(agent, threat, mode, config)
         
         # Get the final response
         response = final_state["final_response"]
@@ -333,31 +548,86 @@ def process_threat_file(threat_file_path, output_dir=None):
         # Save the response to a file if output_dir is specified
         if output_dir:
             os.makedirs(output_dir, exist_ok=True)
-            output_file = os.path.join(output_dir, "response.txt")
+            output_file = os.path.join(output_dir, f"response_{i+1}.txt" if len(threats) > 1 else "response.txt")
             with open(output_file, 'w') as f:
                 f.write(response)
             print(f"Response saved to {output_file}")
-    
     return responses
 
-def process_all_threats(threats_dir, output_dir=None):
+def fuse_and_report(records, sources):
+    """Fuse records into incidents and print what fusion saved"""
+    threats, fusion = fuse_threats(records, sources)
+    print(f"Fused {fusion['reports']} reports into {fusion['incidents']} incidents "
+          f"(cluster sizes {fusion['cluster_sizes']}, {fusion['llm_calls_saved']} LLM calls saved)")
+    return threats
+
+def process_threat_file(threat_file_path, output_dir=None, fuse=True, mode=PLAN_MODE, checkpointer=None):
+    """
+    Process a single threat file and generate a response.
+    
+    Args:
+        threat_file_path: Path to the JSON file containing threat data
+        output_dir: Directory to save the output (defaults to None)
+        fuse: Merge reports of the same incident so each incident is planned once
+        mode: "graph" or "structured" (see PLAN_MODE)
+        checkpointer: Optional checkpointer; finished threats are skipped on reruns
+        
+    Returns:
+        The final responses
+    """
+    # Load the threat data; a file holds one threat or a list of them
+    threat_data = load_threat_data(threat_file_path)
+    threats = threat_data if isinstance(threat_data, list) else [threat_data] if threat_data else []
+    
+    # Fusion also turns sensor detections (e.g. mock_detections.json) into agent threat records
+    if fuse and threats:
+        name = os.path.basename(threat_file_path)
+        threats = fuse_and_report(threats, [name] if len(threats) == 1 else
+                                  [f"{name}#{i + 1}" for i in range(len(threats))])
+    
+    return plan_threats(threats, threat_file_path, output_dir, mode, checkpointer)
+
+def process_all_threats(threats_dir, output_dir=None, fuse=True, mode=PLAN_MODE, checkpointer=None):
     """
     Process all JSON files in the threats directory.
     
+    With fusion, the reports of every file are clustered together, so several
+    drones and a sonar contact reporting one incident in separate files are
+    planned once (responses go to <output_dir>/incidents). Without it, each file
+    is planned on its own.
+    
     Args:
         threats_dir: Directory containing the threat JSON files
         output_dir: Directory to save the outputs (defaults to None)
+        fuse: Merge reports of the same incident across all files
+        mode: "graph" or "structured" (see PLAN_MODE)
+        checkpointer: Optional checkpointer shared by every file
     """
     # Get a list of all JSON files in the threats directory
-    json_files = [os.path.join(threats_dir, f) for f in os.listdir(threats_dir) if f.endswith('.json')]
+    json_files = sorted(os.path.join(threats_dir, f) for f in os.listdir(threats_dir) if f.endswith('.json'))
     
     print(f"Found {len(json_files)} threat files in {threats_dir}")
     
+    if fuse:
+        records, sources = [], []
+        for json_file in json_files:
+            try:
+                file_records, file_sources = load_records([json_file])
+            except (OSError, ValueError) as e:
+                print(f"Error loading threat data from {json_file}: {e}")
+                continue
+            records += file_records
+            sources += file_sources
+        threats = fuse_and_report(records, sources)
+        plan_threats(threats, threats_dir, os.path.join(output_dir, "incidents") if output_dir else None,
+                     mode, checkpointer)
+        return
+    
     # Process each file
     for json_file in json_files:
         print(f"\nProcessing {os.path.basename(json_file)}...")
         file_output_dir = os.path.join(output_dir, os.path.basename(json_file).split('.')[0]) if output_dir else None
-        process_threat_file(json_file, file_output_dir)
+        process_threat_file(json_file, file_output_dir, fuse, mode, checkpointer)
 
 def main():
     """
@@ -367,9 +637,28 @@ def main():
     parser.add_argument("--threats-dir", default="plan_creation/threats", help="Directory containing threat JSON files")
     parser.add_argument("--output-dir", default="plan_creation/responses", help="Directory to save response outputs")
     parser.add_argument("--file", help="Process a specific threat file instead of the entire directory")
+    parser.add_argument("--no-fuse", action="store_true", help="Plan every report separately instead of once per incident")
+    parser.add_argument("--mode", choices=["graph", "structured"], default=PLAN_MODE,
+                        help="Four-step agent graph or one structured-output call")
+    parser.add_argument("--checkpoint-db", default=CHECKPOINT_DB,
+                        help="SQLite file for plan checkpoints; reruns skip finished threats")
+    parser.add_argument("--no-checkpoint", action="store_true", help="Plan every threat from scratch")
+    parser.add_argument("--compare", action="store_true",
+                        help="Plan the fused demo incidents in both modes and compare tokens and latency")
     
     args = parser.parse_args()
     
+    # Fail before planning starts rather than on the first Gemini call
+    if os.getenv("LLM_BACKEND") != "fake" and not os.getenv("GEMINI_API_KEY"):
+        print("Error: GEMINI_API_KEY not found in environment variables.")
+        print("Please ensure it is set in your .env file or environment.")
+        exit(1)
+    
+    if args.compare:
+        from threat_fusion import demo_records
+        compare_modes(fuse_threats(*demo_records())[0])
+        return
+    
     # Set the base directory to the project root
     base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
     
@@ -382,15 +671,17 @@ def main():
         print(f"Error: Threats directory {threats_dir} does not exist")
         exit(1)
     
+    checkpointer = None if args.no_checkpoint else open_checkpointer(args.checkpoint_db)
+    
     # Process a specific file or all files
     if args.file:
         file_path = os.path.join(threats_dir, args.file) if not os.path.isabs(args.file) else args.file
         if not os.path.exists(file_path):
             print(f"Error: File {file_path} does not exist")
             exit(1)
-        process_threat_file(file_path, output_dir)
+        process_threat_file(file_path, output_dir, not args.no_fuse, args.mode, checkpointer)
     else:
-        process_all_threats(threats_dir, output_dir)
+        process_all_threats(threats_dir, output_dir, not args.no_fuse, args.mode, checkpointer)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,433 @@
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, List, Optional
+
+from instrumentation import count_error, registry
+
+llm_seconds = registry.histogram(
+    "sentral_llm_request_duration_seconds", "LLM call latency by backend", ("backend",))
+llm_hedges = registry.counter(
+    "sentral_llm_hedges_total", "Hedged LLM requests by outcome", ("backend", "winner"))
+llm_coalesced = registry.counter(
+    "sentral_llm_coalesced_total", "LLM calls answered by an identical in-flight request")
+llm_tokens = registry.counter(
+    "sentral_llm_tokens_total", "Tokens reported by the LLM provider", ("backend", "kind"))
+
+# Latency budgets (ms) used by the callers to pick a backend
+CALL_SCRIPT_BUDGET_MS = 2000
+VOICE_BUDGET_MS = 5000
+PLAN_BUDGET_MS = 60000
+
+
+class LatencyTracker:
+    """Rolling window of request latencies"""
+
+    def __init__(self, window: int = 200):
+        self.samples = deque(maxlen=window)
+        self.lock = threading.Lock()
+
+    def record(self, seconds: float):
+        with self.lock:
+            self.samples.append(seconds)
+
+    def __len__(self):
+        return len(self.samples)
+
+    def percentile(self, p: float) -> Optional[float]:
+        with self.lock:
+            if not self.samples:
+                return None
+            ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(p * len(ordered)))]
+
+
+class LLMBackend:
+    """
+    Interface for text generation backends.
+
+    Subclasses implement _generate. `expected_ms` is the latency assumed for
+    routing until enough real samples have been observed.
+    """
+
+    name = "backend"
+
+    def __init__(self, expected_ms: float):
+        self.expected_ms = expected_ms
+        self.latency = LatencyTracker()
+
+    def generate(self, prompt: str, system: Optional[str] = None, preamble: str = "",
+                 schema: Optional[Dict[str, Any]] = None, images: Optional[List[bytes]] = None) -> str:
+        """
+        Generate a completion.
+
+        Args:
+            prompt: Per-request prompt text
+            system: Optional system instruction
+            preamble: Fixed instructions placed before the prompt (cacheable prefix)
+            schema: Optional JSON schema; the backend is asked for a JSON document
+                matching it (callers must still validate the result)
+            images: Optional JPEG images sent after the prompt; text-only backends ignore them
+
+        Returns:
+            The generated text
+        """
+        started = time.perf_counter()
+        try:
+            return self._generate(prompt, system, preamble, schema, images)
+        except Exception:
+            count_error("llm", self.name)
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            self.latency.record(elapsed)
+            llm_seconds.observe(elapsed, backend=self.name)
+
+    def p95_ms(self) -> float:
+        """Observed p95 latency, or the expected latency before any samples"""
+        p95 = self.latency.percentile(0.95) if len(self.latency) >= 10 else None
+        return p95 * 1000 if p95 is not None else self.expected_ms
+
+    def ready(self) -> bool:
+        """Whether the backend can serve requests (used by the services' readiness checks)"""
+        return True
+
+    def _generate(self, prompt: str, system: Optional[str], preamble: str,
+                  schema: Optional[Dict[str, Any]] = None, images: Optional[List[bytes]] = None) -> str:
+        raise NotImplementedError
+
+
+_gemini_clients: Dict[str, object] = {}
+_gemini_lock = threading.Lock()
+
+def get_gemini_client(api_key: Optional[str] = None):
+    """
+    Shared google.genai client, created once per API key so its HTTP connection
+    pool is reused by every backend and service.
+
+    Raises:
+        KeyError: If no key is given and GEMINI_API_KEY is not set
+    """
+    api_key = api_key or os.environ["GEMINI_API_KEY"]
+    with _gemini_lock:
+        if api_key not in _gemini_clients:
+            from google import genai
+
+            _gemini_clients[api_key] = genai.Client(api_key=api_key)
+        return _gemini_clients[api_key]
+
+
+class GeminiBackend(LLMBackend):
+    def __init__(self, model: str, expected_ms: float):
+        super().__init__(expected_ms)
+        self.model = model
+        self.name = model
+
+    def ready(self) -> bool:
+        return bool(os.getenv("GEMINI_API_KEY"))
+
+    def _generate(self, prompt, system, preamble, schema=None, images=None):
+        from google.genai import types
+
+        if schema is None:
+            config = types.GenerateContentConfig(system_instruction=system, response_mime_type="text/plain")
+        else:
+            config = types.GenerateContentConfig(
+                system_instruction=system,
+                response_mime_type="application/json",
+                response_schema=schema)
+        response = get_gemini_client().models.generate_content(
+            model=self.model,
+            contents=[preamble + prompt] + [
+                types.Part.from_bytes(data=image, mime_type="image/jpeg") for image in images or []],
+            config=config,
+        )
+        usage = getattr(response, "usage_metadata", None)
+        if usage is not None:
+            llm_tokens.inc(usage.prompt_token_count or 0, backend=self.name, kind="prompt")
+            llm_tokens.inc(usage.candidates_token_count or 0, backend=self.name, kind="output")
+        return response.text
+
+
+class LlamaModalBackend(LLMBackend):
+    """The self-hosted llama_modal.Model, looked up once and reused"""
+
+    name = "llama-modal"
+
+    def __init__(self, expected_ms: float, app_name: str = "llama-inference", cls_name: str = "Model"):
+        super().__init__(expected_ms)
+        self.app_name = app_name
+        self.cls_name = cls_name
+        self._model = None
+        self._found = False
+        self._lock = threading.Lock()
+
+    def _handle(self):
+        with self._lock:
+            if self._model is None:
+                import modal
+
+                self._model = modal.Cls.from_name(self.app_name, self.cls_name)()
+            return self._model
+
+    def ready(self) -> bool:
+        """Whether the deployed app can be found; the lookup is repeated until it succeeds once"""
+        if not self._found:
+            try:
+                import modal
+
+                modal.Cls.from_name(self.app_name, self.cls_name).hydrate()
+            except Exception as e:
+                print(f"Llama app {self.app_name}/{self.cls_name} is not reachable: {e}")
+                return False
+            self._found = True
+        return True
+
+    def _generate(self, prompt, system, preamble, schema=None, images=None):
+        # Text-only model: images are dropped and the prompt's text description is used alone
+        kwargs = {"preamble": preamble}
+        if system:
+            kwargs["system"] = system
+        if schema is not None:
+            # No constrained decoding on the self-hosted model; ask for the shape instead
+            prompt = f"{prompt}\n\nRespond with only a JSON document matching this schema:\n{json.dumps(schema)}"
+        return self._handle().generate.remote(prompt, **kwargs)
+
+
+class FakeBackend(LLMBackend):
+    """
+    Local backend for tests and offline runs.
+
+    Args:
+        name: Name reported by the backend
+        latency_ms: Typical latency
+        tail_ms: Latency of slow requests
+        tail_rate: Fraction of requests that take tail_ms
+        responder: Builds the response from (prompt, system, preamble); echoes by default,
+            or returns a placeholder document for schema requests
+        image_ms: Extra latency per attached image
+    """
+
+    def __init__(self, name: str = "fake", latency_ms: float = 50, tail_ms: float = 0,
+                 tail_rate: float = 0.0, responder: Callable[[str, Optional[str], str], str] = None,
+                 image_ms: float = 0):
+        super().__init__(latency_ms)
+        self.name = name
+        self.latency_ms = latency_ms
+        self.tail_ms = tail_ms
+        self.tail_rate = tail_rate
+        self.default_responder = lambda prompt, system, preamble: f"[{name}] {preamble}{prompt}".strip()
+        self.responder = responder or self.default_responder
+        self.image_ms = image_ms
+        self.calls = 0
+
+    def _generate(self, prompt, system, preamble, schema=None, images=None):
+        self.calls += 1
+        slow = self.tail_rate and random.random() < self.tail_rate
+        time.sleep(((self.tail_ms if slow else self.latency_ms) + self.image_ms * len(images or [])) / 1000)
+        if schema is not None and self.responder is self.default_responder:
+            return json.dumps(placeholder_for(schema, self.name))
+        return self.responder(prompt, system, preamble)
+
+
+def placeholder_for(schema: Dict[str, Any], text: str = "placeholder"):
+    """Smallest document matching a JSON schema, used by FakeBackend"""
+    kind = schema.get("type")
+    if "enum" in schema:
+        return schema["enum"][0]
+    if kind == "object":
+        return {key: placeholder_for(value, text) for key, value in schema.get("properties", {}).items()}
+    if kind == "array":
+        return [placeholder_for(schema.get("items", {}), text) for _ in range(max(1, schema.get("minItems", 1)))]
+    if kind == "integer":
+        return max(1, schema.get("minimum", 1))
+    if kind == "number":
+        return float(schema.get("minimum", 1))
+    if kind == "boolean":
+        return False
+    return f"[{text}]"
+
+
+class HedgedBackend(LLMBackend):
+    """
+    Sends a request to the primary backend and, if it has not answered within the
+    primary's p95 latency, fires the same request at a backup. The first
+    successful answer wins.
+    """
+
+    def __init__(self, primary: LLMBackend, backup: LLMBackend, max_workers: int = 16):
+        super().__init__(primary.expected_ms)
+        self.primary = primary
+        self.backup = backup
+        self.name = f"{primary.name}|hedge:{backup.name}"
+        self.pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="llm-hedge")
+        self.hedges = 0
+        self.backup_wins = 0
+
+    def ready(self) -> bool:
+        # Either side can answer on its own
+        return self.primary.ready() or self.backup.ready()
+
+    def _generate(self, prompt, system, preamble, schema=None, images=None):
+        first = self.pool.submit(self.primary.generate, prompt, system, preamble, schema, images)
+        done, _ = wait([first], timeout=self.primary.p95_ms() / 1000)
+        if done and first.exception() is None:
+            return first.result()
+
+        self.hedges += 1
+        second = self.pool.submit(self.backup.generate, prompt, system, preamble, schema, images)
+        pending = {first, second}
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    if future is second:
+                        self.backup_wins += 1
+                    llm_hedges.inc(backend=self.name, winner="backup" if future is second else "primary")
+                    return future.result()
+                error = future.exception()
+        raise error
+
+
+class SingleFlight:
+    """
+    Request coalescing: concurrent callers with the same key share one call.
+    The first caller runs it; the others wait for its result (or exception).
+    """
+
+    def __init__(self):
+        self.calls: Dict[Any, Future] = {}
+        self.lock = threading.Lock()
+        self.shared = 0
+
+    def do(self, key, fn: Callable[[], Any]):
+        with self.lock:
+            future = self.calls.get(key)
+            leader = future is None
+            if leader:
+                future = self.calls[key] = Future()
+            else:
+                self.shared += 1
+        if not leader:
+            llm_coalesced.inc()
+            return future.result()
+        try:
+            result = fn()
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]
+
+
+class LLMRouter:
+    """
+    Routes each call to the most capable backend whose p95 latency fits the
+    caller's budget. Backends are listed from most to least capable; when none
+    fits, the fastest is used. Identical calls already in flight are coalesced.
+    """
+
+    def __init__(self, backends: List[LLMBackend]):
+        self.backends = backends
+        self.inflight = SingleFlight()
+
+    def route(self, budget_ms: Optional[float] = None) -> LLMBackend:
+        if budget_ms is None:
+            return self.backends[0]
+        for backend in self.backends:
+            if backend.p95_ms() <= budget_ms:
+                return backend
+        return min(self.backends, key=lambda backend: backend.p95_ms())
+
+    def ready(self) -> Dict[str, bool]:
+        """Readiness of each backend, by name"""
+        return {backend.name: backend.ready() for backend in self.backends}
+
+    def generate(self, prompt: str, budget_ms: Optional[float] = None,
+                 system: Optional[str] = None, preamble: str = "",
+                 schema: Optional[Dict[str, Any]] = None, images: Optional[List[bytes]] = None) -> str:
+        backend = self.route(budget_ms)
+        schema_key = json.dumps(schema, sort_keys=True) if schema is not None else None
+        images_key = tuple(hashlib.sha1(image).hexdigest() for image in images or [])
+        return self.inflight.do(
+            (backend.name, system, preamble, prompt, schema_key, images_key),
+            lambda: backend.generate(prompt, system=system, preamble=preamble, schema=schema, images=images))
+
+
+def build_router_from_env() -> LLMRouter:
+    """
+    Build the router from environment settings.
+
+    LLM_BACKEND=fake     use local fake backends only (no network)
+    LLM_PRIMARY=llama    send full plans to the self-hosted Llama service first
+    LLM_HEDGE=1          hedge the primary backend with the other one
+    """
+    if os.getenv("LLM_BACKEND") == "fake":
+        return LLMRouter([
+            FakeBackend("fake-large", latency_ms=400, image_ms=150),
+            FakeBackend("fake-small", latency_ms=50),
+        ])
+
+    gemini = GeminiBackend("gemini-2.0-flash", expected_ms=4000)
+    fast = GeminiBackend("gemini-2.0-flash-lite", expected_ms=1200)
+    backends = [gemini]
+    if os.getenv("LLM_PRIMARY") == "llama":
+        backends = [LlamaModalBackend(expected_ms=15000)]
+        if os.getenv("LLM_HEDGE") == "1":
+            backends = [HedgedBackend(backends[0], gemini)]
+        backends.append(gemini)
+    elif os.getenv("LLM_HEDGE") == "1":
+        backends = [HedgedBackend(gemini, LlamaModalBackend(expected_ms=15000))]
+    backends.append(fast)
+    return LLMRouter(backends)
+
+
+_router: Optional[LLMRouter] = None
+_router_lock = threading.Lock()
+
+def get_router() -> LLMRouter:
+    global _router
+    with _router_lock:
+        if _router is None:
+            _router = build_router_from_env()
+        return _router
+
+def complete(prompt: str, budget_ms: Optional[float] = None,
+             system: Optional[str] = None, preamble: str = "",
+             schema: Optional[Dict[str, Any]] = None, images: Optional[List[bytes]] = None) -> str:
+    """Generate text (or JSON matching `schema`) with the backend that fits the latency budget"""
+    return get_router().generate(prompt, budget_ms=budget_ms, system=system, preamble=preamble,
+                                 schema=schema, images=images)
+
+
+if __name__ == "__main__":
+    # Tail latency of a heavy-tailed backend, with and without a hedge
+    def run(backend, n=500):
+        latencies = []
+        for i in range(n):
+            started = time.perf_counter()
+            backend.generate(f"request {i}")
+            latencies.append((time.perf_counter() - started) * 1000)
+        latencies.sort()
+        return latencies[n // 2], latencies[int(n * 0.95)], latencies[int(n * 0.99)]
+
+    random.seed(0)
+    plain = FakeBackend("primary", latency_ms=20, tail_ms=400, tail_rate=0.03)
+    print("unhedged  p50 %.0f ms, p95 %.0f ms, p99 %.0f ms" % run(plain))
+
+    random.seed(0)
+    hedged = HedgedBackend(
+        FakeBackend("primary", latency_ms=20, tail_ms=400, tail_rate=0.03),
+        FakeBackend("backup", latency_ms=40),
+    )
+    print("hedged    p50 %.0f ms, p95 %.0f ms, p99 %.0f ms" % run(hedged))
+    print(f"hedges fired: {hedged.hedges}, won by backup: {hedged.backup_wins}")
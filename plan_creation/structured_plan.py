@@ -0,0 +1,161 @@
+"""
+Single-call structured threat response plans.
+
+The agent graph in gemini_calls.py makes four planning calls per threat and
+resends each earlier answer as prompt text. Here one call returns the analysis,
+plan and resources as JSON matching PLAN_SCHEMA, and the final document is
+rendered locally from a template. The result is validated against the schema;
+callers fall back to the graph when it does not validate.
+"""
+
+import json
+import math
+from typing import Any, Dict, List, Optional
+
+PLAN_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "analysis": {
+            "type": "object",
+            "properties": {
+                "summary": {"type": "string"},
+                "intent": {"type": "string"},
+                "capabilities": {"type": "array", "items": {"type": "string"}},
+                "immediate_concerns": {"type": "array", "items": {"type": "string"}},
+            },
+            "required": ["summary", "intent", "capabilities", "immediate_concerns"],
+        },
+        "plan": {
+            "type": "object",
+            "properties": {
+                "immediate_actions": {"type": "array", "items": {"type": "string"}, "minItems": 1},
+                "personnel": {"type": "array", "items": {"type": "string"}},
+                "containment": {"type": "array", "items": {"type": "string"}},
+            },
+            "required": ["immediate_actions", "personnel", "containment"],
+        },
+        "resources": {
+            "type": "array",
+            "minItems": 1,
+            "items": {
+                "type": "object",
+                "properties": {
+                    "category": {"type": "string", "enum": ["personnel", "equipment", "vehicle", "other"]},
+                    "item": {"type": "string"},
+                    "quantity": {"type": "integer", "minimum": 1},
+                },
+                "required": ["category", "item", "quantity"],
+            },
+        },
+    },
+    "required": ["analysis", "plan", "resources"],
+}
+
+STRUCTURED_PLAN_PREAMBLE = """Analyze the following threat detection and produce a complete response in one answer:
+a concise threat assessment (potential intent, capabilities, immediate concerns), a step-by-step
+response plan (immediate actions, personnel required, containment strategies) and every resource
+needed to execute it (personnel, equipment, vehicles, other) with quantities.
+
+"""
+
+_TYPES = {
+    "object": dict,
+    "array": list,
+    "string": str,
+    "integer": int,
+    "number": (int, float),
+    "boolean": bool,
+}
+
+
+def validate(value: Any, schema: Dict[str, Any], path: str = "$") -> List[str]:
+    """
+    Check a decoded JSON value against the subset of JSON schema used here
+    (type, properties, required, items, enum, minItems, minimum).
+
+    Returns:
+        A list of errors; empty when the value is valid
+    """
+    kind = schema.get("type")
+    expected = _TYPES.get(kind)
+    if expected and (not isinstance(value, expected) or (kind in ("integer", "number") and isinstance(value, bool))):
+        return [f"{path}: expected {kind}"]
+    errors = []
+    if "enum" in schema and value not in schema["enum"]:
+        errors.append(f"{path}: {value!r} not in {schema['enum']}")
+    if "minimum" in schema and value < schema["minimum"]:
+        errors.append(f"{path}: below minimum {schema['minimum']}")
+    if kind == "object":
+        for key in schema.get("required", []):
+            if key not in value:
+                errors.append(f"{path}.{key}: missing")
+        for key, subschema in schema.get("properties", {}).items():
+            if key in value:
+                errors.extend(validate(value[key], subschema, f"{path}.{key}"))
+    elif kind == "array":
+        if len(value) < schema.get("minItems", 0):
+            errors.append(f"{path}: fewer than {schema['minItems']} items")
+        for index, item in enumerate(value):
+            errors.extend(validate(item, schema.get("items", {}), f"{path}[{index}]"))
+    elif kind == "string" and not value.strip() and "enum" not in schema:
+        errors.append(f"{path}: empty")
+    return errors
+
+
+def parse_plan(text: str) -> Optional[Dict[str, Any]]:
+    """Decode and validate a model answer; None when it is not a valid plan"""
+    text = (text or "").strip()
+    # Tolerate a fenced answer from backends without constrained decoding
+    if text.startswith("```"):
+        text = text.strip("`")
+        text = text[text.find("{"):]
+    try:
+        plan = json.loads(text)
+    except ValueError:
+        return None
+    errors = validate(plan, PLAN_SCHEMA)
+    if errors:
+        print(f"Structured plan failed validation: {'; '.join(errors[:5])}")
+        return None
+    return plan
+
+
+def _bullets(items: List[str]) -> str:
+    return "\n".join(f"- {item}" for item in items) or "- None identified"
+
+
+def render_resources(plan: Dict[str, Any]) -> List[str]:
+    """Numbered resource lines in the shape the graph's resources_needed uses"""
+    return [f"{index}. {r['item']} x{r['quantity']} ({r['category']})"
+            for index, r in enumerate(plan["resources"], 1)]
+
+
+def render_analysis(plan: Dict[str, Any]) -> str:
+    analysis = plan["analysis"]
+    return (f"{analysis['summary']}\n\nPotential intent: {analysis['intent']}\n\n"
+            f"Capabilities:\n{_bullets(analysis['capabilities'])}\n\n"
+            f"Immediate concerns:\n{_bullets(analysis['immediate_concerns'])}")
+
+
+def render_response_plan(plan: Dict[str, Any]) -> str:
+    steps = plan["plan"]
+    actions = "\n".join(f"{index}. {action}" for index, action in enumerate(steps["immediate_actions"], 1))
+    return (f"Immediate actions:\n{actions}\n\nPersonnel required:\n{_bullets(steps['personnel'])}\n\n"
+            f"Containment:\n{_bullets(steps['containment'])}")
+
+
+def render_document(threat_summary: str, plan: Dict[str, Any]) -> str:
+    """The final threat response document, rendered locally instead of by a fourth LLM call"""
+    sections = [
+        ("THREAT SUMMARY", "\n".join(line.strip() for line in threat_summary.strip().splitlines())),
+        ("THREAT ANALYSIS", render_analysis(plan)),
+        ("RESPONSE PLAN", render_response_plan(plan)),
+        ("RESOURCES REQUIRED", "\n".join(render_resources(plan))),
+    ]
+    body = "\n\n".join(f"{title}\n{'-' * len(title)}\n{text}" for title, text in sections)
+    return f"THREAT RESPONSE DOCUMENT\n{'=' * 24}\n\n{body}\n"
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (about four characters per token) for comparing prompt sizes"""
+    return math.ceil(len(text or "") / 4)
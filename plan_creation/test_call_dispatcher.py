@@ -0,0 +1,97 @@
+import threading
+import time
+
+from call_dispatcher import CallDispatcher, FakeTwilioClient, RateLimiter
+
+RECIPIENTS = ["+15550000001", "+15550000002", "+15550000003"]
+
+
+def make_dispatcher(client=None, script_generator=None, **kwargs):
+    return CallDispatcher(client or FakeTwilioClient(latency=0), "+10000000000", "http://localhost/",
+                          script_generator or (lambda job_id, message, threat: f"script: {message}"), **kwargs)
+
+
+def test_job_dials_every_recipient_with_its_own_script():
+    client = FakeTwilioClient(latency=0)
+    dispatcher = make_dispatcher(client, calls_per_second=100)
+    first = dispatcher.submit("Mines near the harbor", RECIPIENTS)
+    second = dispatcher.submit("Boats at the cable", RECIPIENTS[:1])
+    job = dispatcher.wait(first, timeout=5)
+    assert dispatcher.wait(second, timeout=5)["status"] == "dispatched"
+
+    assert job["status"] == "dispatched"
+    assert job["time_to_dial_ms"] is not None
+    assert sorted(call["to"] for call in job["calls"]) == RECIPIENTS
+    assert all(call["sid"] and call["status"] == "queued" for call in job["calls"])
+    assert dispatcher.get_message(first) == "script: Mines near the harbor"
+    assert dispatcher.get_message(second) == "script: Boats at the cable"
+    assert {call.url for call in client.calls.created} == {
+        f"http://localhost/twiml?messageId={first}", f"http://localhost/twiml?messageId={second}"}
+
+
+def test_rate_limit_spaces_out_calls():
+    limiter = RateLimiter(rate=20, burst=2)
+    started = time.monotonic()
+    for _ in range(6):
+        limiter.acquire()
+    # Two calls from the burst, then four at 20 per second
+    assert time.monotonic() - started >= 4 / 20 * 0.9
+
+
+def test_dispatcher_rate_limit_applies_across_jobs():
+    client = FakeTwilioClient(latency=0)
+    dispatcher = make_dispatcher(client, max_workers=2, calls_per_second=20)
+    started = time.monotonic()
+    job_ids = [dispatcher.submit("Alert", RECIPIENTS) for _ in range(2)]
+    for job_id in job_ids:
+        assert dispatcher.wait(job_id, timeout=5)["status"] == "dispatched"
+    assert len(client.calls.created) == 6
+    assert time.monotonic() - started >= 4 / 20 * 0.9
+
+
+def test_failed_calls_fail_the_job():
+    class BrokenCalls:
+        def create(self, **kwargs):
+            raise RuntimeError("Twilio unreachable")
+
+    client = FakeTwilioClient()
+    client.calls = BrokenCalls()
+    dispatcher = make_dispatcher(client, calls_per_second=100)
+    job = dispatcher.wait(dispatcher.submit("Alert", RECIPIENTS[:2]), timeout=5)
+    assert job["status"] == "failed"
+    assert [call["error"] for call in job["calls"]] == ["Twilio unreachable"] * 2
+
+
+def test_wait_times_out_on_a_running_job():
+    release = threading.Event()
+
+    def slow_script(job_id, message, threat):
+        release.wait(5)
+        return message
+
+    dispatcher = make_dispatcher(script_generator=slow_script, calls_per_second=100)
+    job_id = dispatcher.submit("Alert", RECIPIENTS[:1])
+    started = time.monotonic()
+    assert dispatcher.wait(job_id, timeout=0.1)["status"] == "generating_script"
+    assert time.monotonic() - started < 1
+    release.set()
+    assert dispatcher.wait(job_id, timeout=5)["status"] == "dispatched"
+    # Unknown jobs return straight away
+    assert dispatcher.wait("missing", timeout=5) is None
+
+
+def test_expired_jobs_are_evicted_with_their_scripts_and_calls():
+    dispatcher = make_dispatcher(calls_per_second=100, job_ttl_s=0.2)
+    old = dispatcher.submit("Old alert", RECIPIENTS[:1])
+    old_sid = dispatcher.wait(old, timeout=5)["calls"][0]["sid"]
+    time.sleep(0.3)
+    new = dispatcher.submit("New alert", RECIPIENTS[:1])
+    assert dispatcher.wait(new, timeout=5)["status"] == "dispatched"
+
+    assert dispatcher.get_job(old) is None
+    assert dispatcher.get_message(old) is None
+    assert old_sid not in dispatcher.calls_by_sid
+    # A late refinement for the evicted job is dropped
+    dispatcher.set_message(old, "refined")
+    assert dispatcher.get_message(old) is None
+    assert dispatcher.get_job(new) is not None
@@ -0,0 +1,74 @@
+import threading
+
+from call_scripts import CallScriptEngine, render_call_script
+
+THREAT = {"level": "high", "objects": {"boat": 4, "Drone": 1}, "location": {"area": "Miami Harbor"}}
+
+
+class GatedRefiner:
+    """Refiner that blocks until released, counting LLM calls"""
+
+    def __init__(self):
+        self.release = threading.Event()
+        self.started = threading.Event()
+        self.calls = 0
+
+    def __call__(self, script, message):
+        self.calls += 1
+        self.started.set()
+        self.release.wait(5)
+        return f"refined: {message}"
+
+
+def test_template_script():
+    script = render_call_script(THREAT, "Units en route 🚨")
+    assert "Threat level HIGH." in script
+    assert "Detected 4 boats and one Drone near Miami Harbor." in script
+    assert script.endswith("Units en route. Repeating: threat level HIGH.")
+
+
+def test_concurrent_requests_share_one_refinement():
+    refiner = GatedRefiner()
+    engine = CallScriptEngine(refiner=refiner, workers=4)
+    received = []
+    template = engine.script_for("Evacuate", THREAT, on_refined=received.append)
+    assert refiner.started.wait(5)
+    for _ in range(3):
+        assert engine.script_for("Evacuate", THREAT, on_refined=received.append) == template
+    refiner.release.set()
+    engine.pool.shutdown(wait=True)
+
+    assert refiner.calls == 1
+    assert received == ["refined: Evacuate"] * 4
+    assert engine.script_for("Evacuate", THREAT) == "refined: Evacuate"
+    assert (engine.hits, engine.misses) == (1, 4)
+
+
+def test_job_queued_behind_finished_refinement_uses_cache():
+    refiner = GatedRefiner()
+    refiner.release.set()
+    # One worker: the second job runs only after the first refinement is cached
+    engine = CallScriptEngine(refiner=refiner, workers=1)
+    received = []
+    engine.pool.submit(engine._refine, "sig", "template", "Evacuate", received.append)
+    engine.pool.submit(engine._refine, "sig", "template", "Evacuate", received.append)
+    engine.pool.shutdown(wait=True)
+
+    assert refiner.calls == 1
+    assert received == ["refined: Evacuate", "refined: Evacuate"]
+    assert engine.pending == {}
+
+
+def test_failed_refinement_keeps_template():
+    def failing(script, message):
+        raise RuntimeError("LLM unavailable")
+
+    engine = CallScriptEngine(refiner=failing)
+    received = []
+    template = engine.script_for("Evacuate", THREAT, on_refined=received.append)
+    engine.pool.shutdown(wait=True)
+
+    assert received == []
+    assert engine.pending == {}
+    assert engine.cache == {}
+    assert template == render_call_script(THREAT, "Evacuate")
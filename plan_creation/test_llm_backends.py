@@ -0,0 +1,124 @@
+import threading
+import time
+
+import pytest
+
+from llm_backends import FakeBackend, GeminiBackend, HedgedBackend, LLMRouter, SingleFlight, placeholder_for
+
+
+class FailingBackend(FakeBackend):
+    def _generate(self, prompt, system, preamble, schema=None, images=None):
+        self.calls += 1
+        time.sleep(self.latency_ms / 1000)
+        raise RuntimeError(f"{self.name} failed")
+
+
+def test_fast_primary_is_not_hedged():
+    primary, backup = FakeBackend("primary", latency_ms=5), FakeBackend("backup", latency_ms=5)
+    primary.expected_ms = 500
+    hedged = HedgedBackend(primary, backup)
+    assert hedged.generate("hello") == "[primary] hello"
+    assert (primary.calls, backup.calls, hedged.hedges) == (1, 0, 0)
+
+
+def test_slow_primary_is_hedged_and_backup_wins():
+    primary, backup = FakeBackend("primary", latency_ms=500), FakeBackend("backup", latency_ms=5)
+    primary.expected_ms = 20
+    hedged = HedgedBackend(primary, backup)
+    started = time.perf_counter()
+    assert hedged.generate("hello") == "[backup] hello"
+    assert time.perf_counter() - started < 0.4
+    assert (hedged.hedges, hedged.backup_wins) == (1, 1)
+
+
+def test_failed_primary_falls_back_to_backup():
+    primary, backup = FailingBackend("primary", latency_ms=1), FakeBackend("backup", latency_ms=5)
+    primary.expected_ms = 500
+    hedged = HedgedBackend(primary, backup)
+    assert hedged.generate("hello") == "[backup] hello"
+    assert hedged.backup_wins == 1
+
+
+def test_hedge_raises_when_both_fail():
+    hedged = HedgedBackend(FailingBackend("primary", latency_ms=1), FailingBackend("backup", latency_ms=1))
+    with pytest.raises(RuntimeError):
+        hedged.generate("hello")
+
+
+def test_single_flight_shares_one_call():
+    flight = SingleFlight()
+    release = threading.Event()
+    calls = []
+
+    def fn():
+        calls.append(1)
+        release.wait(5)
+        return "result"
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(flight.do("key", fn))) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    while flight.shared < 4:
+        time.sleep(0.01)
+    release.set()
+    for thread in threads:
+        thread.join()
+    assert calls == [1]
+    assert results == ["result"] * 5
+    assert flight.calls == {}
+    # Once the call finished, the next one runs again
+    assert flight.do("key", lambda: "again") == "again"
+
+
+def test_single_flight_shares_the_exception():
+    flight = SingleFlight()
+    release = threading.Event()
+
+    def fn():
+        release.wait(5)
+        raise ValueError("boom")
+
+    errors = []
+
+    def call():
+        try:
+            flight.do("key", fn)
+        except ValueError as e:
+            errors.append(str(e))
+
+    threads = [threading.Thread(target=call) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    while flight.shared < 2:
+        time.sleep(0.01)
+    release.set()
+    for thread in threads:
+        thread.join()
+    assert errors == ["boom"] * 3
+    assert flight.calls == {}
+
+
+def test_router_picks_the_backend_that_fits_the_budget():
+    large, small = FakeBackend("large", latency_ms=400), FakeBackend("small", latency_ms=50)
+    router = LLMRouter([large, small])
+    assert router.route() is large
+    assert router.route(budget_ms=1000) is large
+    assert router.route(budget_ms=100) is small
+    assert router.route(budget_ms=10) is small
+
+
+def test_fake_backend_answers_schema_requests():
+    schema = {"type": "object", "properties": {"level": {"enum": ["HIGH", "LOW"]},
+                                               "steps": {"type": "array", "items": {"type": "string"}}}}
+    assert placeholder_for(schema, "fake") == {"level": "HIGH", "steps": ["[fake]"]}
+    assert FakeBackend(latency_ms=0).generate("plan", schema=schema) == '{"level": "HIGH", "steps": ["[fake]"]}'
+
+
+def test_router_reports_each_backends_readiness(monkeypatch):
+    monkeypatch.delenv("GEMINI_API_KEY", raising=False)
+    gemini, fake = GeminiBackend("gemini-test", expected_ms=500), FakeBackend("fake")
+    router = LLMRouter([HedgedBackend(gemini, fake), gemini, fake])
+    assert router.ready() == {"gemini-test|hedge:fake": True, "gemini-test": False, "fake": True}
+    monkeypatch.setenv("GEMINI_API_KEY", "test-key")
+    assert all(router.ready().values())
@@ -0,0 +1,59 @@
+import json
+
+from llm_backends import placeholder_for
+from structured_plan import PLAN_SCHEMA, parse_plan, render_document, render_resources, validate
+
+
+def valid_plan():
+    return {
+        "analysis": {"summary": "Two boats near the cable landing.", "intent": "Surveillance",
+                     "capabilities": ["Fast approach"], "immediate_concerns": ["Cable damage"]},
+        "plan": {"immediate_actions": ["Dispatch patrol", "Alert coast guard"], "personnel": ["Patrol crew"],
+                 "containment": []},
+        "resources": [{"category": "vehicle", "item": "Patrol boat", "quantity": 2}],
+    }
+
+
+def test_valid_plan_has_no_errors():
+    assert validate(valid_plan(), PLAN_SCHEMA) == []
+    assert validate(placeholder_for(PLAN_SCHEMA), PLAN_SCHEMA) == []
+
+
+def test_errors_name_the_path():
+    plan = valid_plan()
+    del plan["analysis"]["intent"]
+    plan["plan"]["immediate_actions"] = []
+    plan["resources"][0].update(category="boat", quantity=0)
+    plan["analysis"]["capabilities"] = ["  "]
+    assert sorted(validate(plan, PLAN_SCHEMA)) == sorted([
+        "$.analysis.intent: missing",
+        "$.analysis.capabilities[0]: empty",
+        "$.plan.immediate_actions: fewer than 1 items",
+        "$.resources[0].category: 'boat' not in ['personnel', 'equipment', 'vehicle', 'other']",
+        "$.resources[0].quantity: below minimum 1",
+    ])
+
+
+def test_types_are_strict():
+    assert validate(True, {"type": "integer"}) == ["$: expected integer"]
+    assert validate(2.5, {"type": "integer"}) == ["$: expected integer"]
+    assert validate(2.5, {"type": "number"}) == []
+    assert validate({"a": 1}, {"type": "array"}) == ["$: expected array"]
+
+
+def test_parse_plan_accepts_fenced_json_and_rejects_invalid():
+    text = json.dumps(valid_plan())
+    assert parse_plan(text) == valid_plan()
+    assert parse_plan(f"```json\n{text}\n```") == valid_plan()
+    assert parse_plan("not json") is None
+    assert parse_plan(json.dumps({"analysis": {}})) is None
+    assert parse_plan(None) is None
+
+
+def test_document_sections():
+    document = render_document("Boats detected\n   near the harbor", valid_plan())
+    assert document.startswith("THREAT RESPONSE DOCUMENT\n")
+    assert "Boats detected\nnear the harbor" in document
+    assert "1. Dispatch patrol\n2. Alert coast guard" in document
+    assert "Containment:\n- None identified" in document
+    assert render_resources(valid_plan()) == ["1. Patrol boat x2 (vehicle)"]
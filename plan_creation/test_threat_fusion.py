@@ -0,0 +1,86 @@
+import math
+
+from threat_fusion import (cell_size, demo_records, distance_m, fuse_reports, fuse_threats, geohash,
+                           neighbours, normalize_report, precision_for)
+
+
+def report(lat, lon, time=0.0, level="Medium", objects=("boat",), source="r"):
+    return normalize_report({
+        "timestamp": time, "threat_level": level,
+        "coordinates": {"latitude": lat, "longitude": lon, "altitude": 100},
+        "objects_detected": [{"type": name} for name in objects],
+        "environment_conditions": {"time_of_day": "day", "weather": "clear"},
+    }, source)
+
+
+def test_geohash_known_values():
+    assert geohash(57.64911, 10.40744, 11) == "u4pruydqqvj"
+    assert geohash(42.605, -5.603, 5) == "ezs42"
+
+
+def test_neighbours_cover_the_radius():
+    radius = 1000
+    precision = precision_for(radius)
+    lat_deg, lon_deg = cell_size(precision)
+    assert lat_deg * 111320 >= radius
+    # Points within the radius in any direction hash to the point's cell or a neighbour
+    cells = set(neighbours(25.7617, -80.1918, precision))
+    for bearing in range(0, 360, 15):
+        dlat = radius * 0.99 * math.cos(math.radians(bearing)) / 111320
+        dlon = radius * 0.99 * math.sin(math.radians(bearing)) / (111320 * math.cos(math.radians(25.7617)))
+        assert geohash(25.7617 + dlat, -80.1918 + dlon, precision) in cells
+
+
+def test_neighbours_wrap_the_antimeridian():
+    cells = neighbours(0.0, 179.999, 5)
+    assert len(cells) == 9
+    assert any(cell == geohash(0.0, -179.99, 5) for cell in cells)
+
+
+def test_reports_cluster_by_distance_and_time():
+    reports = [
+        report(25.7617, -80.1918, 0, source="a"),
+        report(25.7650, -80.1918, 60, source="b"),    # ~370 m away
+        report(25.7617, -80.1918, 5000, source="c"),  # same place, much later
+        report(25.9000, -80.1918, 30, source="d"),    # ~15 km away
+    ]
+    incidents = fuse_reports(reports, radius_m=1000, window_s=600)
+    assert sorted(sorted(r["source"] for r in incident.reports) for incident in incidents) == [
+        ["a", "b"], ["c"], ["d"]]
+    assert distance_m(25.7617, -80.1918, 25.7650, -80.1918) < 400
+
+
+def test_incident_level_uses_the_agent_vocabulary():
+    sonar = normalize_report({"timestamp": 10, "location": {"latitude": 25.7620, "longitude": -80.1920},
+                              "detections": [{"type": "underwater_contact", "confidence": 0.8}],
+                              "alert_level": "critical"}, "sonar")
+    threats, _ = fuse_threats([report(25.7617, -80.1918)["record"], sonar["record"]], ["drone", "sonar"])
+    assert [threat["threat_level"] for threat in threats] == ["High"]
+
+    threats, _ = fuse_threats([sonar["record"]], ["sonar"])
+    assert threats[0]["threat_level"] == "High"
+    elevated = {**sonar["record"], "alert_level": "elevated"}
+    assert fuse_threats([elevated], ["sonar"])[0][0]["threat_level"] == "Medium"
+
+
+def test_demo_merges_one_incident():
+    records, sources = demo_records()
+    threats, summary = fuse_threats(records, sources)
+    assert summary["cluster_sizes"] == [6, 1]
+    assert summary["llm_calls_saved"] == 20
+    incident = threats[0]
+    assert incident["threat_level"] == "High"
+    assert {obj["type"]: obj["count"] for obj in incident["objects_detected"]} == {
+        "boat": 5, "drone": 2, "underwater_contact": 1}
+    [observation] = next(obj for obj in incident["objects_detected"]
+                         if obj["type"] == "underwater_contact")["observations"]
+    assert observation == {"source": "sonar-1", "confidence": 0.85}
+    # The unrelated agent record is planned unchanged
+    assert threats[1] == records[-1]
+
+
+def test_records_without_a_position_pass_through():
+    record = {"threat_level": "Low", "objects_detected": [{"type": "buoy"}]}
+    threats, summary = fuse_threats([record])
+    assert threats == [record]
+    assert summary["incidents"] == 1
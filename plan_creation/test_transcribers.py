@@ -0,0 +1,87 @@
+import io
+import wave
+
+import numpy as np
+
+from transcribers import SAMPLE_RATE, FakeTranscriber, decode_audio, speech_chunks, synthetic_speech, to_wav
+
+
+def bursts(layout, sample_rate=SAMPLE_RATE):
+    """Tones for the (seconds, voiced) spans in layout over faint noise"""
+    rng = np.random.default_rng(0)
+    parts = []
+    for seconds, voiced in layout:
+        t = np.arange(int(seconds * sample_rate)) / sample_rate
+        part = rng.normal(0, 0.002, len(t))
+        if voiced:
+            part += 0.3 * np.sin(2 * np.pi * 180 * t)
+        parts.append(part)
+    return np.concatenate(parts).astype(np.float32)
+
+
+def test_chunks_follow_pauses():
+    samples = bursts([(0.5, False), (1.0, True), (0.8, False), (1.5, True), (0.5, False)])
+    chunks = speech_chunks(samples)
+    assert len(chunks) == 2
+    (first_start, first_end), (second_start, second_end) = chunks
+    # Padded by up to 150 ms around each burst
+    assert 0.3 * SAMPLE_RATE <= first_start <= 0.5 * SAMPLE_RATE
+    assert 1.5 * SAMPLE_RATE <= first_end <= 1.7 * SAMPLE_RATE
+    assert first_end < second_start
+    assert 3.8 * SAMPLE_RATE <= second_end <= 4.0 * SAMPLE_RATE
+
+
+def test_short_gaps_and_blips():
+    # A 150 ms dip is bridged; a 90 ms click is not speech
+    samples = bursts([(0.5, False), (1.0, True), (0.15, False), (1.0, True), (1.0, False), (0.09, True),
+                      (1.0, False)])
+    assert len(speech_chunks(samples)) == 1
+
+
+def test_long_speech_is_cut_without_overlap():
+    samples = bursts([(0.3, False), (40.0, True), (0.3, False)])
+    chunks = speech_chunks(samples, max_chunk_s=15)
+    assert len(chunks) >= 3
+    assert all(end - start <= 15.2 * SAMPLE_RATE for start, end in chunks)
+    # The sides of each cut meet exactly, so nothing is transcribed twice
+    for (_, end), (start, _) in zip(chunks, chunks[1:]):
+        assert end == start
+
+
+def test_silence_and_empty_input():
+    assert speech_chunks(np.zeros(SAMPLE_RATE, dtype=np.float32)) == []
+    assert speech_chunks(np.zeros(10, dtype=np.float32)) == []
+
+
+def wav_bytes(data: bytes, width: int, channels: int = 1, rate: int = SAMPLE_RATE) -> bytes:
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as wav:
+        wav.setnchannels(channels)
+        wav.setsampwidth(width)
+        wav.setframerate(rate)
+        wav.writeframes(data)
+    return buffer.getvalue()
+
+
+def test_decode_pcm_widths():
+    samples = np.sin(np.linspace(0, 20, 1600)).astype(np.float32) * 0.5
+    np.testing.assert_allclose(decode_audio(to_wav(samples)), samples, atol=1e-4)
+    as_24 = (np.round(samples * 2 ** 23).astype("<i4").view(np.uint8).reshape(-1, 4)[:, :3]).tobytes()
+    np.testing.assert_allclose(decode_audio(wav_bytes(as_24, 3)), samples, atol=1e-6)
+    as_8 = (np.round(samples * 127) + 128).astype(np.uint8).tobytes()
+    np.testing.assert_allclose(decode_audio(wav_bytes(as_8, 1)), samples, atol=1e-2)
+
+
+def test_decode_mixes_down_and_resamples():
+    stereo = np.stack([np.full(4800, 0.5), np.full(4800, -0.25)], axis=1)
+    data = (stereo * 32767).astype(np.int16).tobytes()
+    decoded = decode_audio(io.BytesIO(wav_bytes(data, 2, channels=2, rate=48000)))
+    assert len(decoded) == 1600
+    np.testing.assert_allclose(decoded, 0.125, atol=1e-4)
+
+
+def test_fake_transcriber_streams_one_piece_per_chunk():
+    samples = synthetic_speech(12)
+    pieces = list(FakeTranscriber(rtf=0).stream(to_wav(samples)))
+    assert len(pieces) == len(speech_chunks(samples)) > 1
+    assert all(piece.endswith("s of speech]") for piece in pieces)
@@ -0,0 +1,405 @@
+"""
+Spatial-temporal fusion of threat reports before LLM planning.
+
+Drones and sonar often report the same incident several times. Planning each
+report separately costs a full four-call agent run per report, so reports are
+first clustered into incidents: two reports belong to the same incident when
+they are within FUSION_RADIUS_M metres and FUSION_WINDOW_S seconds of each
+other. Reports are bucketed by geohash, so each report is only compared with
+the open incidents in its own and the eight neighbouring cells.
+
+Both report shapes in this directory are understood: agent threat records
+(`coordinates`, `objects_detected`, `threat_level`) and sensor detections such
+as mock_detections.json (`location`, `detections`, `alert_level`). Incidents
+are returned as agent threat records, so they can be planned directly. A report
+that nothing was fused with keeps all of its fields, and merged objects keep
+each report's own object fields (confidence, speed, heading, behaviour...).
+
+    python threat_fusion.py mock_detections.json threats/*.json
+    python threat_fusion.py --demo
+"""
+
+import argparse
+import json
+import math
+import os
+import time
+from collections import Counter
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+FUSION_RADIUS_M = float(os.getenv("FUSION_RADIUS_M", "1000"))
+FUSION_WINDOW_S = float(os.getenv("FUSION_WINDOW_S", "600"))
+
+# LLM calls made by one run of the threat response agent (gemini_calls.py)
+CALLS_PER_PLAN = 4
+
+LEVEL_RANK = {"low": 1, "elevated": 2, "medium": 2, "moderate": 2, "high": 3, "critical": 4}
+# Threat level words the agent prompts use, by rank; sensor levels are mapped onto them
+AGENT_LEVELS = {1: "Low", 2: "Medium", 3: "High", 4: "High"}
+
+_BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+EARTH_RADIUS_M = 6371000.0
+METRES_PER_DEGREE = 111320.0
+
+
+def geohash(lat: float, lon: float, precision: int) -> str:
+    """Standard base32 geohash of a point"""
+    lat_range, lon_range = [-90.0, 90.0], [-180.0, 180.0]
+    chars, bits, value, even = [], 0, 0, True
+    while len(chars) < precision:
+        span, coordinate = (lon_range, lon) if even else (lat_range, lat)
+        middle = (span[0] + span[1]) / 2
+        if coordinate >= middle:
+            value = (value << 1) | 1
+            span[0] = middle
+        else:
+            value <<= 1
+            span[1] = middle
+        even = not even
+        bits += 1
+        if bits == 5:
+            chars.append(_BASE32[value])
+            bits, value = 0, 0
+    return "".join(chars)
+
+
+def cell_size(precision: int) -> Tuple[float, float]:
+    """(latitude, longitude) extent of a geohash cell in degrees"""
+    bits = 5 * precision
+    return 180.0 / 2 ** (bits // 2), 360.0 / 2 ** ((bits + 1) // 2)
+
+
+def precision_for(radius_m: float, max_latitude: float = 70.0) -> int:
+    """
+    Finest geohash precision whose cells are at least radius_m across, so that
+    every report within radius_m of a point lies in its cell or a neighbour.
+    """
+    precision = 1
+    while precision < 12:
+        lat_deg, lon_deg = cell_size(precision + 1)
+        height = lat_deg * METRES_PER_DEGREE
+        width = lon_deg * METRES_PER_DEGREE * math.cos(math.radians(max_latitude))
+        if min(height, width) < radius_m:
+            break
+        precision += 1
+    return precision
+
+
+def neighbours(lat: float, lon: float, precision: int) -> List[str]:
+    """The cell containing the point and its eight neighbours"""
+    lat_deg, lon_deg = cell_size(precision)
+    cells = []
+    for dlat in (-lat_deg, 0.0, lat_deg):
+        for dlon in (-lon_deg, 0.0, lon_deg):
+            neighbour_lat = max(-90.0, min(90.0, lat + dlat))
+            neighbour_lon = (lon + dlon + 180.0) % 360.0 - 180.0
+            cells.append(geohash(neighbour_lat, neighbour_lon, precision))
+    return list(dict.fromkeys(cells))
+
+
+def distance_m(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    """Great-circle (haversine) distance in metres"""
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    dphi = phi2 - phi1
+    dlambda = math.radians(lon2 - lon1)
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlambda / 2) ** 2
+    return 2 * EARTH_RADIUS_M * math.asin(math.sqrt(a))
+
+
+def _parse_time(value) -> Optional[float]:
+    if isinstance(value, (int, float)):
+        return float(value)
+    if isinstance(value, str):
+        try:
+            return datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp()
+        except ValueError:
+            return None
+    return None
+
+
+def normalize_report(record: Dict[str, Any], source: str = "") -> Optional[Dict[str, Any]]:
+    """
+    Reduce a threat record or sensor detection to position, time, objects and level.
+
+    Returns:
+        The normalized report, or None when the record has no usable position
+    """
+    position = record.get("coordinates") or record.get("location") or {}
+    try:
+        lat, lon = float(position["latitude"]), float(position["longitude"])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+    object_records = [obj for obj in record.get("objects_detected", record.get("detections", []))
+                      if isinstance(obj, dict)]
+    objects = [obj.get("type", "unknown") for obj in object_records]
+
+    timestamp = None
+    for key in ("timestamp", "detected_at", "time"):
+        timestamp = _parse_time(record.get(key))
+        if timestamp is not None:
+            break
+
+    return {
+        "lat": lat,
+        "lon": lon,
+        "altitude": position.get("altitude"),
+        "area": position.get("area"),
+        "time": timestamp,
+        "objects": objects,
+        "object_records": object_records,
+        "level": str(record.get("threat_level") or record.get("alert_level") or "unknown"),
+        "source": source,
+        "record": record,
+    }
+
+
+class Incident:
+    """A cluster of reports believed to describe the same event"""
+
+    def __init__(self, report: Dict[str, Any]):
+        self.reports = [report]
+        self.lat = report["lat"]
+        self.lon = report["lon"]
+        self.first_time = self.last_time = report["time"]
+
+    def add(self, report: Dict[str, Any]):
+        self.reports.append(report)
+        count = len(self.reports)
+        # Running centroid; incidents span at most a few kilometres
+        self.lat += (report["lat"] - self.lat) / count
+        self.lon += (report["lon"] - self.lon) / count
+        if report["time"] is not None:
+            self.first_time = report["time"] if self.first_time is None else min(self.first_time, report["time"])
+            self.last_time = report["time"] if self.last_time is None else max(self.last_time, report["time"])
+
+    def matches(self, report: Dict[str, Any], radius_m: float, window_s: float) -> bool:
+        if report["time"] is not None and self.last_time is not None:
+            if report["time"] - self.last_time > window_s or self.first_time - report["time"] > window_s:
+                return False
+        return distance_m(self.lat, self.lon, report["lat"], report["lon"]) <= radius_m
+
+    def to_threat(self) -> Dict[str, Any]:
+        """
+        Merge the evidence into one agent threat record. A single agent threat
+        record is returned unchanged; a single sensor detection keeps its own
+        fields next to the agent ones.
+        """
+        reports = self.reports
+        if len(reports) == 1 and "objects_detected" in reports[0]["record"]:
+            return reports[0]["record"]
+        primary = max(reports, key=lambda r: LEVEL_RANK.get(r["level"].lower(), 0))
+        # An unrecognised level is passed through rather than guessed
+        level = AGENT_LEVELS.get(LEVEL_RANK.get(primary["level"].lower(), 0), primary["level"])
+        object_counts: Counter = Counter()
+        object_sources: Dict[str, List[str]] = {}
+        # Every report's own record of the object, so nothing it measured is lost
+        observations: Dict[str, List[Dict[str, Any]]] = {}
+        for report in reports:
+            for obj in report["object_records"]:
+                name = obj.get("type", "unknown")
+                object_counts[name] += obj.get("count", 1) if isinstance(obj.get("count"), int) else 1
+                object_sources.setdefault(name, [])
+                if report["source"] not in object_sources[name]:
+                    object_sources[name].append(report["source"])
+                fields = {key: value for key, value in obj.items() if key not in ("type", "count")}
+                if fields:
+                    observations.setdefault(name, []).append({"source": report["source"], **fields})
+        altitudes = [r["altitude"] for r in reports if isinstance(r["altitude"], (int, float))]
+        conditions = next((r["record"]["environment_conditions"] for r in reports
+                           if "environment_conditions" in r["record"]), None)
+        if conditions is None:
+            sensor = next((r["record"].get("environmental_conditions") for r in reports
+                           if r["record"].get("environmental_conditions")), {})
+            conditions = {"time_of_day": sensor.get("time_of_day", "unknown"),
+                          "weather": f"visibility {sensor.get('visibility', 'unknown')}, "
+                                     f"sea state {sensor.get('sea_state', 'unknown')}"}
+
+        descriptions = []
+        for report in reports:
+            description = report["record"].get("raw_description")
+            if not description:
+                description = f"{report['source'] or 'sensor'} reported {', '.join(report['objects']) or 'a contact'}"
+            descriptions.append(description)
+        if len(reports) > 1:
+            raw_description = f"{len(reports)} correlated reports: " + " | ".join(descriptions)
+        else:
+            raw_description = descriptions[0]
+
+        threat = {
+            "threat_level": level,
+            "coordinates": {
+                "latitude": round(self.lat, 6),
+                "longitude": round(self.lon, 6),
+                "altitude": max(altitudes) if altitudes else 0,
+            },
+            "objects_detected": [
+                {"type": obj, "count": count, "sources": object_sources[obj],
+                 **({"observations": observations[obj]} if obj in observations else {})}
+                for obj, count in object_counts.most_common()
+            ],
+            "environment_conditions": conditions,
+            "raw_description": raw_description,
+            "first_seen": self.first_time,
+            "last_seen": self.last_time,
+            "fused_from": [r["source"] for r in reports],
+            # Camera keyframes of every report; the planner caps how many it attaches
+            "keyframes": list(dict.fromkeys(path for r in reports for path in r["record"].get("keyframes") or [])),
+        }
+        if len(reports) == 1:
+            # A lone sensor detection: keep its timestamp, area and other fields too
+            return {**reports[0]["record"], **threat}
+        return threat
+
+
+def fuse_reports(reports: List[Dict[str, Any]], radius_m: float = FUSION_RADIUS_M,
+                 window_s: float = FUSION_WINDOW_S) -> List[Incident]:
+    """
+    Cluster normalized reports into incidents.
+
+    Reports are processed in time order; each joins the nearest open incident
+    in its neighbourhood that is within radius_m and window_s, or starts a new
+    one. Reports without a timestamp match on position alone.
+    """
+    precision = precision_for(radius_m)
+    cells: Dict[str, List[Incident]] = {}
+    incidents: List[Incident] = []
+
+    ordered = sorted(reports, key=lambda r: (r["time"] is None, r["time"] or 0.0))
+    for report in ordered:
+        candidates = [
+            incident
+            for cell in neighbours(report["lat"], report["lon"], precision)
+            for incident in cells.get(cell, [])
+            if incident.matches(report, radius_m, window_s)
+        ]
+        if candidates:
+            incident = min(candidates, key=lambda i: distance_m(i.lat, i.lon, report["lat"], report["lon"]))
+            old_cell = geohash(incident.lat, incident.lon, precision)
+            incident.add(report)
+            new_cell = geohash(incident.lat, incident.lon, precision)
+            if new_cell != old_cell:
+                cells[old_cell].remove(incident)
+                cells.setdefault(new_cell, []).append(incident)
+        else:
+            incident = Incident(report)
+            incidents.append(incident)
+            cells.setdefault(geohash(incident.lat, incident.lon, precision), []).append(incident)
+    return incidents
+
+
+def fuse_threats(records: List[Dict[str, Any]], sources: Optional[List[str]] = None,
+                 radius_m: float = FUSION_RADIUS_M, window_s: float = FUSION_WINDOW_S
+                 ) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+    """
+    Fuse raw threat records into incident threat records.
+
+    Args:
+        records: Threat records or sensor detections
+        sources: Optional label per record (file name, drone id), kept as evidence
+        radius_m: Maximum distance between reports of one incident
+        window_s: Maximum time gap between reports of one incident
+
+    Returns:
+        The incident threat records (records without a position pass through
+        unchanged) and a report with cluster sizes and saved LLM calls
+    """
+    sources = sources or [f"report {i + 1}" for i in range(len(records))]
+    normalized, passthrough = [], []
+    for record, source in zip(records, sources):
+        report = normalize_report(record, source)
+        if report is None:
+            passthrough.append(record)
+        else:
+            normalized.append(report)
+
+    incidents = fuse_reports(normalized, radius_m, window_s)
+    threats = [incident.to_threat() for incident in incidents] + passthrough
+    sizes = sorted((len(incident.reports) for incident in incidents), reverse=True) + [1] * len(passthrough)
+    report = {
+        "reports": len(records),
+        "incidents": len(threats),
+        "cluster_sizes": sizes,
+        "plans_saved": len(records) - len(threats),
+        "llm_calls_saved": (len(records) - len(threats)) * CALLS_PER_PLAN,
+    }
+    return threats, report
+
+
+def load_records(paths: List[str]) -> Tuple[List[Dict[str, Any]], List[str]]:
+    """Read every record from the given JSON files (a file may hold one record or a list)"""
+    records, sources = [], []
+    for path in paths:
+        with open(path, "r") as f:
+            data = json.load(f)
+        items = data if isinstance(data, list) else [data]
+        name = os.path.basename(path)
+        for index, item in enumerate(items):
+            records.append(item)
+            sources.append(name if len(items) == 1 else f"{name}#{index + 1}")
+    return records, sources
+
+
+def demo_records() -> Tuple[List[Dict[str, Any]], List[str]]:
+    """Five drones and a sonar contact on one incident, plus an unrelated report"""
+    base = time.time()
+    records, sources = [], []
+    for drone in range(5):
+        records.append({
+            "timestamp": base + drone * 20,
+            "threat_level": "High" if drone == 2 else "Medium",
+            "coordinates": {"latitude": 25.7617 + drone * 0.001, "longitude": -80.1918 - drone * 0.0008,
+                            "altitude": 120 + drone * 5},
+            "objects_detected": [{"type": "boat"}, {"type": "drone"}] if drone % 2 else [{"type": "boat"}],
+            "environment_conditions": {"time_of_day": "day", "weather": "clear"},
+            "raw_description": f"Drone {drone + 1}: fast vessel heading west",
+        })
+        sources.append(f"drone-{drone + 1}")
+    records.append({
+        "timestamp": datetime.fromtimestamp(base + 45, timezone.utc).isoformat(),
+        "location": {"latitude": 25.7630, "longitude": -80.1925, "area": "Miami Harbor"},
+        "detections": [{"type": "underwater_contact", "confidence": 0.85}],
+        "alert_level": "elevated",
+    })
+    sources.append("sonar-1")
+    records.append({
+        "timestamp": base + 30,
+        "threat_level": "Low",
+        "coordinates": {"latitude": 26.1224, "longitude": -80.1373, "altitude": 100},
+        "objects_detected": [{"type": "buoy"}],
+        "environment_conditions": {"time_of_day": "day", "weather": "clear"},
+        "raw_description": "Drone 6: stationary object off Fort Lauderdale",
+    })
+    sources.append("drone-6")
+    return records, sources
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Cluster threat reports into incidents")
+    parser.add_argument("files", nargs="*", help="Threat or detection JSON files")
+    parser.add_argument("--radius", type=float, default=FUSION_RADIUS_M, help="Incident radius in metres")
+    parser.add_argument("--window", type=float, default=FUSION_WINDOW_S, help="Incident time window in seconds")
+    parser.add_argument("--demo", action="store_true", help="Fuse a synthetic multi-drone incident")
+    parser.add_argument("--output", help="Write the incident threat records to this JSON file")
+    args = parser.parse_args()
+
+    if args.demo:
+        records, sources = demo_records()
+    elif args.files:
+        records, sources = load_records(args.files)
+    else:
+        parser.error("give threat files or --demo")
+
+    started = time.perf_counter()
+    threats, report = fuse_threats(records, sources, args.radius, args.window)
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    for threat in threats:
+        objects = ", ".join(f"{o['type']} x{o.get('count', 1)}" for o in threat.get("objects_detected", []))
+        print(f"- {threat.get('threat_level')}: {objects} from {', '.join(threat.get('fused_from') or ['a single report'])}")
+    print(f"{report['reports']} reports -> {report['incidents']} incidents in {elapsed_ms:.1f} ms; "
+          f"cluster sizes {report['cluster_sizes']}; "
+          f"{report['plans_saved']} plans / {report['llm_calls_saved']} LLM calls saved")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(threats, f, indent=2)
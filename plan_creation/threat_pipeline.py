@@ -0,0 +1,273 @@
+import os
+import json
+import time
+import argparse
+import threading
+from typing import Any, Dict, List, Optional
+
+from event_bus import EventBus
+from threat_response_creation import analyze_threat_data, write_atomic
+from threat_scoring import LEVELS, get_scorer
+from call_dispatcher import CallDispatcher, FakeTwilioClient
+from call_scripts import CallScriptEngine
+from llm_backends import LatencyTracker
+
+# Topics. Detection summaries arrive once per processed video, track events as
+# soon as the camera sees a new high-threat track, alerts go to the dispatcher.
+DETECTIONS = "detections"
+TRACK_EVENTS = "track_events"
+ALERTS = "alerts"
+
+DEFAULT_BUS_PATH = os.getenv(
+    "EVENT_BUS_PATH", os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "events.db"))
+
+# Minimum level that raises an alert, and how long repeated alerts for the same
+# source and class are suppressed
+ALERT_LEVEL = os.getenv("ALERT_LEVEL", "HIGH").upper()
+ALERT_COOLDOWN_S = float(os.getenv("ALERT_COOLDOWN_S", 60))
+# How long the dispatcher consumer waits for an alert's calls to be placed
+DIAL_TIMEOUT_S = float(os.getenv("DIAL_TIMEOUT_S", 60))
+
+# Where modal_detection.py copies the camera outputs; keyframe paths in
+# detection summaries are relative to it
+PROCESSED_OUTPUT_DIR = os.getenv(
+    "PROCESSED_OUTPUT_DIR", os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "processed_output"))
+
+
+def detection_to_threat(summary: Dict[str, Any], assessment: Dict[str, Any]) -> Dict[str, Any]:
+    """Convert a camera detection summary into the threat record the agent expects"""
+    video_info = summary.get("video_info", {})
+    objects = [{"type": name, "count": count} for name, count in (summary.get("unique_objects") or {}).items()]
+    # Best views first, so a tighter image cap in the planner keeps the clearest ones
+    keyframes = sorted(summary.get("keyframes") or [], key=lambda k: -k.get("confidence", 0.0))
+    return {
+        "objects_detected": objects,
+        "threat_level": assessment["level"],
+        "coordinates": summary.get("coordinates") or {"latitude": "unknown", "longitude": "unknown", "altitude": "unknown"},
+        "environment_conditions": summary.get("environment_conditions") or {"time_of_day": "unknown", "weather": "unknown"},
+        "raw_description": f"Drone camera feed {video_info.get('filename', 'unknown')}: "
+                           + "; ".join(assessment["alerts"] or [f"{assessment['total_objects']} objects detected"]),
+        "keyframes": [os.path.join(PROCESSED_OUTPUT_DIR, keyframe["file"]) for keyframe in keyframes],
+    }
+
+
+class ThreatPipeline:
+    """
+    Consumers wiring the event bus to the analysis report, the threat response
+    agent and the emergency call dispatcher.
+
+    Alerts carry the time of the original detection, so the dispatcher consumer
+    can measure detection-to-alert latency across every stage.
+    """
+
+    def __init__(self, bus: EventBus, output_dir: str = "analysis_results"):
+        self.bus = bus
+        self.output_dir = output_dir
+        self.alert_tier = LEVELS.index(ALERT_LEVEL)
+        self.last_alert: Dict[tuple, float] = {}
+        self.lock = threading.Lock()
+        self.detection_to_alert = LatencyTracker(window=1000)
+        self.detection_to_dial = LatencyTracker(window=1000)
+        self.pending_jobs: Dict[str, float] = {}
+        self.dispatcher: Optional[CallDispatcher] = None
+
+    def subscribe_analysis(self):
+        self.bus.subscribe(DETECTIONS, "analysis", self.on_detection)
+        self.bus.subscribe(TRACK_EVENTS, "analysis", self.on_track_event)
+
+    def subscribe_store(self, store):
+        """Index detection summaries for the detection API (detection_api.py)"""
+        def on_detection(event):
+            store.ingest(os.path.splitext(event.get("source", "detection"))[0], event["summary"])
+
+        self.bus.subscribe(DETECTIONS, "store", on_detection)
+
+    def subscribe_agent(self, output_dir: str = "responses"):
+        # The agent pulls in langgraph and the Gemini client, so only load it when used
+        from gemini_calls import create_threat_response_agent
+
+        agent = create_threat_response_agent()
+
+        def on_detection(event):
+            summary = event["summary"]
+            threat = detection_to_threat(summary, get_scorer().score(summary))
+            final_state = agent.invoke({"threat_data": threat})
+            base_name = os.path.splitext(event.get("source", "detection"))[0]
+            os.makedirs(output_dir, exist_ok=True)
+            output_file = os.path.join(output_dir, f"{base_name}_response.txt")
+            write_atomic(output_file, final_state["final_response"])
+            print(f"Agent response saved to {output_file}")
+
+        self.bus.subscribe(DETECTIONS, "agent", on_detection)
+
+    def _log_alert(self, event: Dict[str, Any]):
+        detected_at = event["detected_at"]
+        self.detection_to_alert.record(time.time() - detected_at)
+        print(f"ALERT [{event['level']}] {event['source']}: {event['reason']} "
+              f"({(time.time() - detected_at) * 1000:.0f} ms after detection)")
+
+    def subscribe_alert_log(self):
+        """
+        Print alerts and track their latency without dialing. Uses its own group,
+        so it never takes alerts from the "dispatcher" group that a call service
+        (emergency_call_service.py) consumes on the same bus.
+        """
+        self.bus.subscribe(ALERTS, "alert_log", self._log_alert)
+
+    def subscribe_dispatcher(self, dispatcher: CallDispatcher, recipients: List[str]):
+        self.dispatcher = dispatcher
+
+        def on_alert(event):
+            self._log_alert(event)
+            detected_at = event["detected_at"]
+            if not recipients:
+                return
+            job_id = dispatcher.submit(event["reason"], recipients,
+                                       {"level": event["level"], "objects": event["objects"]})
+            with self.lock:
+                self.pending_jobs[job_id] = detected_at
+            # Wait for the dial, so an alert nobody could be called for is retried by the bus
+            # (and dead-lettered if it keeps failing) instead of being acknowledged
+            job = dispatcher.wait(job_id, DIAL_TIMEOUT_S)
+            if job is not None and job["status"] == "failed":
+                errors = "; ".join(call["error"] for call in job["calls"] if call["error"]) or job.get("error")
+                raise RuntimeError(f"No call placed for alert from {event['source']}: {errors}")
+
+        self.bus.subscribe(ALERTS, "dispatcher", on_alert)
+
+    def on_detection(self, event: Dict[str, Any]):
+        summary = event["summary"]
+        base_name = os.path.splitext(event.get("source", "detection"))[0]
+        os.makedirs(self.output_dir, exist_ok=True)
+        output_file = os.path.join(self.output_dir, f"{base_name}_analysis.txt")
+        write_atomic(output_file, analyze_threat_data(summary))
+
+        assessment = get_scorer().score(summary)
+        if LEVELS.index(assessment["level"]) >= self.alert_tier:
+            reason = "; ".join(assessment["alerts"]) or f"{assessment['level']} threat objects detected"
+            self._alert(event, assessment["level"], summary.get("unique_objects") or {}, reason, key="summary")
+
+    def on_track_event(self, event: Dict[str, Any]):
+        class_name = event["class_name"]
+        tier = get_scorer().tier(class_name)
+        if tier < self.alert_tier:
+            return
+        reason = f"{class_name} detected at {event.get('time_s', 0):.1f}s (track {event.get('tracker_id')})"
+        self._alert(event, LEVELS[tier], {class_name: 1}, reason, key=class_name)
+
+    def _alert(self, event: Dict[str, Any], level: str, objects: Dict[str, int], reason: str, key: str):
+        source = event.get("source", "unknown")
+        now = time.time()
+        with self.lock:
+            last = self.last_alert.get((source, key))
+            if last is not None and now - last < ALERT_COOLDOWN_S:
+                return
+            self.last_alert[(source, key)] = now
+        self.bus.publish(ALERTS, {
+            "source": source,
+            "level": level,
+            "objects": objects,
+            "reason": reason,
+            "detected_at": event.get("detected_at", event["_published_at"]),
+        })
+
+    def latency_report(self) -> Dict[str, Any]:
+        """Detection-to-alert and detection-to-first-dial latency percentiles in ms"""
+        if self.dispatcher is not None:
+            with self.lock:
+                pending = list(self.pending_jobs.items())
+            for job_id, detected_at in pending:
+                job = self.dispatcher.get_job(job_id)
+                if job and job["time_to_dial_ms"] is not None:
+                    self.detection_to_dial.record(job["created_at"] - detected_at + job["time_to_dial_ms"] / 1000)
+                    with self.lock:
+                        self.pending_jobs.pop(job_id, None)
+                elif job and job["status"] == "failed":
+                    with self.lock:
+                        self.pending_jobs.pop(job_id, None)
+        report = {}
+        for name, tracker in [("detection_to_alert", self.detection_to_alert),
+                              ("detection_to_dial", self.detection_to_dial)]:
+            p50, p95 = tracker.percentile(0.5), tracker.percentile(0.95)
+            report[name] = {
+                "count": len(tracker),
+                "p50_ms": None if p50 is None else round(p50 * 1000, 1),
+                "p95_ms": None if p95 is None else round(p95 * 1000, 1),
+            }
+        report["lag"] = self.bus.lag()
+        report["dead_letters"] = len(self.bus.dead_letters())
+        return report
+
+
+def build_dispatcher(calls_per_second: float = float(os.getenv("CALLS_PER_SECOND", 1.0))) -> CallDispatcher:
+    """Dispatcher for running the pipeline standalone; dials through the fake Twilio client"""
+    engine = CallScriptEngine()
+    return CallDispatcher(FakeTwilioClient(), "+10000000000", "http://localhost",
+                          lambda job_id, message, threat: engine.script_for(message, threat),
+                          calls_per_second=calls_per_second)
+
+
+def replay(bus: EventBus, json_dir: str, repeat: int = 1):
+    """
+    Publish the detection JSONs in json_dir as if they came from the camera, with
+    one track event per high-threat class ahead of each summary.
+    """
+    scorer = get_scorer()
+    names = sorted(name for name in os.listdir(json_dir) if name.endswith(".json"))
+    for round_index in range(repeat):
+        for name in names:
+            with open(os.path.join(json_dir, name), "r") as f:
+                summary = json.load(f)
+            source = f"{round_index}-{summary.get('video_info', {}).get('filename', name)}"
+            for tracker_id, class_name in enumerate(summary.get("unique_objects") or {}):
+                if scorer.tier(class_name) == len(LEVELS) - 1:
+                    bus.publish(TRACK_EVENTS, {"source": source, "tracker_id": tracker_id, "class_name": class_name,
+                                               "frame": 1, "time_s": 0.0, "detected_at": time.time()})
+            bus.publish(DETECTIONS, {"source": source, "summary": summary, "detected_at": time.time()})
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Consume camera events: analysis, agent and emergency calls")
+    parser.add_argument("--bus", default=DEFAULT_BUS_PATH, help="SQLite event bus shared with the camera")
+    parser.add_argument("--output-dir", default="analysis_results", help="Directory for analysis reports")
+    parser.add_argument("--agent", action="store_true", help="Also run the Gemini threat response agent")
+    parser.add_argument("--store", nargs="?", const="", metavar="DB",
+                        help="Index summaries in the detection API database (default DETECTION_DB)")
+    parser.add_argument("--dispatch", action="store_true",
+                        help="Place calls to ALERT_RECIPIENTS (fake Twilio client) for each alert")
+    parser.add_argument("--replay", metavar="JSON_DIR", help="Publish the detection JSONs in a directory, then exit")
+    parser.add_argument("--repeat", type=int, default=1, help="Times to replay the directory")
+    args = parser.parse_args()
+
+    bus = EventBus(args.bus, max_pending=int(os.getenv("EVENT_BUS_MAX_PENDING", 1000)))
+    pipeline = ThreatPipeline(bus, args.output_dir)
+    pipeline.subscribe_analysis()
+    if args.store is not None:
+        from detection_store import DEFAULT_DB_PATH, DetectionStore
+        pipeline.subscribe_store(DetectionStore(args.store or DEFAULT_DB_PATH))
+    if args.agent:
+        pipeline.subscribe_agent()
+    if args.dispatch:
+        recipients = [number for number in os.getenv("ALERT_RECIPIENTS", "").split(",") if number]
+        pipeline.subscribe_dispatcher(build_dispatcher(), recipients)
+    else:
+        # Without --dispatch another process (emergency_call_service.py) owns the dispatcher group
+        pipeline.subscribe_alert_log()
+    bus.start()
+
+    if args.replay:
+        replay(bus, args.replay, args.repeat)
+        report = pipeline.latency_report()
+        while any(report["lag"].values()) or pipeline.pending_jobs:
+            time.sleep(0.1)
+            report = pipeline.latency_report()
+        print(json.dumps(report, indent=2))
+        bus.stop()
+    else:
+        print(f"Consuming events from {args.bus} (Ctrl+C to stop)...")
+        try:
+            while True:
+                time.sleep(10)
+                print(json.dumps(pipeline.latency_report()))
+        except KeyboardInterrupt:
+            bus.stop()
@@ -1,56 +1,68 @@
 import os
 import json
 import time
+import argparse
+import hashlib
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
 from typing import Dict, Any, List, Optional
+from threat_scoring import get_scorer
+
+LEVEL_SUMMARIES = {
+    "HIGH": "  * Presence of high-threat objects requires immediate attention",
+    "MEDIUM": "  * Potential security concerns detected",
+    "LOW": "  * No immediate threats detected",
+}
+
+LEVEL_RECOMMENDATIONS = {
+    "HIGH": [
+        "- IMMEDIATE ACTIONS:",
+        "  * Alert maritime security forces",
+        "  * Deploy rapid response team",
+        "  * Establish 1000m safety perimeter",
+        "  * Initiate continuous monitoring"
+    ],
+    "MEDIUM": [
+        "- ACTIONS REQUIRED:",
+        "  * Increase surveillance",
+        "  * Notify local authorities",
+        "  * Maintain 500m observation zone",
+        "  * Document all activities"
+    ],
+    "LOW": [
+        "- STANDARD PROCEDURES:",
+        "  * Continue regular monitoring",
+        "  * Log all observations",
+        "  * Maintain normal security protocols"
+    ],
+}
 
 def analyze_threat_data(threat_data: Dict[str, Any]) -> str:
     """Analyze threat data and provide a manual assessment"""
-    unique_objects = threat_data.get("unique_objects", {})
     video_info = threat_data.get("video_info", {})
     
+    # Classify objects with the shared scoring tables
+    assessment = get_scorer().score(threat_data)
+    overall = assessment["level"]
+    
     # Perform manual analysis based on object types and counts
     analysis = []
     
     # 1. THREAT IDENTIFICATION
     analysis.append("1. THREAT IDENTIFICATION:")
-    total_objects = sum(unique_objects.values())
-    
-    # Classify objects by threat level
-    high_threat = {"Mines", "Drone", "boat"}
-    medium_threat = {"truck", "car", "airplane", "person"}
-    low_threat = {"bird", "horse", "cow", "sheep", "rocks", "Fish and plants", "bicycle", "umbrella", "kite", "bus"}
-    
-    threat_levels = {
-        "High": [],
-        "Medium": [],
-        "Low": []
-    }
-    
-    for obj, count in unique_objects.items():
-        if obj in high_threat:
-            threat_levels["High"].append(f"{obj} (Count: {count})")
-        elif obj in medium_threat:
-            threat_levels["Medium"].append(f"{obj} (Count: {count})")
-        else:
-            threat_levels["Low"].append(f"{obj} (Count: {count})")
+    total_objects = assessment["total_objects"]
     
-    for level, objects in threat_levels.items():
+    for level, objects in assessment["objects"].items():
         if objects:
-            analysis.append(f"- {level} Threat Objects: {', '.join(objects)}")
+            listed = ", ".join(f"{obj} (Count: {count})" for obj, count in objects)
+            analysis.append(f"- {level.title()} Threat Objects: {listed}")
     
     # 2. RISK ASSESSMENT
     analysis.append("\n2. RISK ASSESSMENT:")
     
-    # Calculate overall threat level
-    if any(obj in high_threat for obj in unique_objects):
-        analysis.append("- Overall Threat Level: HIGH")
-        analysis.append("  * Presence of high-threat objects requires immediate attention")
-    elif any(obj in medium_threat for obj in unique_objects):
-        analysis.append("- Overall Threat Level: MEDIUM")
-        analysis.append("  * Potential security concerns detected")
-    else:
-        analysis.append("- Overall Threat Level: LOW")
-        analysis.append("  * No immediate threats detected")
+    # Overall threat level
+    analysis.append(f"- Overall Threat Level: {overall}")
+    analysis.append(LEVEL_SUMMARIES[overall])
     
     # Video context
     analysis.append(f"- Video Duration: {video_info.get('total_frames', 0) / video_info.get('fps', 1):.1f} seconds")
@@ -58,39 +70,13 @@ def analyze_threat_data(threat_data: Dict[str, Any]) -> str:
     
     # 3. RECOMMENDATIONS
     analysis.append("\n3. RECOMMENDATIONS:")
-    if any(obj in high_threat for obj in unique_objects):
-        analysis.extend([
-            "- IMMEDIATE ACTIONS:",
-            "  * Alert maritime security forces",
-            "  * Deploy rapid response team",
-            "  * Establish 1000m safety perimeter",
-            "  * Initiate continuous monitoring"
-        ])
-    elif any(obj in medium_threat for obj in unique_objects):
-        analysis.extend([
-            "- ACTIONS REQUIRED:",
-            "  * Increase surveillance",
-            "  * Notify local authorities",
-            "  * Maintain 500m observation zone",
-            "  * Document all activities"
-        ])
-    else:
-        analysis.extend([
-            "- STANDARD PROCEDURES:",
-            "  * Continue regular monitoring",
-            "  * Log all observations",
-            "  * Maintain normal security protocols"
-        ])
+    analysis.extend(LEVEL_RECOMMENDATIONS[overall])
     
     # 4. SPECIAL CONSIDERATIONS
     analysis.append("\n4. SPECIAL CONSIDERATIONS:")
     
-    # Check for unusual combinations
-    if "Mines" in unique_objects and "Drone" in unique_objects:
-        analysis.append("- CRITICAL: Potential coordinated threat detected (Mine + Drone combination)")
-    
-    if "boat" in unique_objects and unique_objects.get("person", 0) > 10:
-        analysis.append("- WARNING: Large number of personnel with watercraft - assess for suspicious activity")
+    # Unusual combinations flagged by the scoring rules
+    analysis.extend(f"- {alert}" for alert in assessment["alerts"])
     
     # Add temporal context
     total_frames = video_info.get("total_frames", 0)
@@ -112,49 +98,212 @@ def load_threat_data(threat_file_path: str) -> Dict[str, Any]:
         print(f"Error loading threat data: {e}")
         return {}
 
-def process_json_file(json_path: str):
+# Video fields the analysis reads; the rest of a summary (tracks, clips, keyframes,
+# timings...) can be large and is left out of the report
+REPORT_VIDEO_FIELDS = ("filename", "resolution", "fps", "total_frames")
+
+def is_detection_summary(threat_data: Any) -> bool:
+    """Whether parsed JSON is a detection summary the analysis can use"""
+    return isinstance(threat_data, dict) and ("unique_objects" in threat_data or "video_info" in threat_data)
+
+def report_input(threat_data: Dict[str, Any]) -> Dict[str, Any]:
+    """The fields of a detection summary that the analysis is based on"""
+    video_info = threat_data.get("video_info") or {}
+    return {
+        "video_info": {key: video_info[key] for key in REPORT_VIDEO_FIELDS if key in video_info},
+        "unique_objects": threat_data.get("unique_objects") or {},
+    }
+
+def write_atomic(path: str, content: str):
+    """Write a file so readers only ever see the old or the complete new version"""
+    directory = os.path.dirname(path) or "."
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-", suffix=os.path.basename(path))
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write(content)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+
+def process_json_file(json_path: str, output_dir: str = "analysis_results") -> Optional[str]:
     """Process a single JSON file and save results to a txt file"""
     print(f"\nProcessing {json_path}...")
     
     # Load the threat data
     threat_data = load_threat_data(json_path)
-    if not threat_data:
-        print(f"Failed to load threat data from {json_path}")
-        return
+    if not is_detection_summary(threat_data):
+        print(f"No detection data in {json_path}")
+        return None
     
-    # Analyze the threat
-    analysis = analyze_threat_data(threat_data)
+    # Analyze the threat; a malformed summary must not take the whole batch down
+    try:
+        analysis = analyze_threat_data(threat_data)
+    except Exception as e:
+        print(f"Could not analyze {json_path}: {e}")
+        return None
     
     # Create output filename
     base_name = os.path.splitext(os.path.basename(json_path))[0]
-    output_dir = "analysis_results"
     os.makedirs(output_dir, exist_ok=True)
     output_file = os.path.join(output_dir, f"{base_name}_analysis.txt")
     
+    report = [
+        "THREAT ANALYSIS REPORT\n",
+        f"Generated on: {time.strftime('%Y-%m-%d %H:%M:%S')}\n",
+        f"Source file: {json_path}\n",
+        f"{'='*80}\n\n",
+        "DETECTION DATA:\n",
+        "-" * 40 + "\n",
+        json.dumps(report_input(threat_data), indent=2),
+        "\n\n",
+        "THREAT ANALYSIS:\n",
+        "-" * 40 + "\n",
+        analysis,
+    ]
+    
     # Save results to file
-    with open(output_file, 'w') as f:
-        f.write(f"THREAT ANALYSIS REPORT\n")
-        f.write(f"Generated on: {time.strftime('%Y-%m-%d %H:%M:%S')}\n")
-        f.write(f"Source file: {json_path}\n")
-        f.write(f"{'='*80}\n\n")
-        
-        f.write("ORIGINAL DETECTION DATA:\n")
-        f.write("-" * 40 + "\n")
-        f.write(json.dumps(threat_data, indent=2))
-        f.write("\n\n")
-        
-        f.write("THREAT ANALYSIS:\n")
-        f.write("-" * 40 + "\n")
-        f.write(analysis)
+    write_atomic(output_file, "".join(report))
     
     print(f"Analysis saved to: {output_file}")
+    return output_file
+
+# Bump when the report format or scoring changes so every input is re-analyzed
+ANALYSIS_VERSION = 3
+MANIFEST_NAME = ".manifest.json"
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 16), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def load_manifest(output_dir: str) -> Dict[str, Any]:
+    """Load the manifest of analyzed inputs, discarding it if it is from another version"""
+    try:
+        with open(os.path.join(output_dir, MANIFEST_NAME), 'r') as f:
+            manifest = json.load(f)
+        if manifest.get("version") == ANALYSIS_VERSION:
+            return manifest
+    except (OSError, ValueError):
+        pass
+    return {"version": ANALYSIS_VERSION, "files": {}}
+
+def save_manifest(output_dir: str, manifest: Dict[str, Any]):
+    os.makedirs(output_dir, exist_ok=True)
+    write_atomic(os.path.join(output_dir, MANIFEST_NAME), json.dumps(manifest, indent=2, sort_keys=True))
+
+def find_changed_files(json_dir: str, manifest: Dict[str, Any], stats: Dict[str, Any] = None) -> Dict[str, str]:
+    """
+    Return {filename: sha256} for inputs that are new or whose content changed.
+    
+    When `stats` is given (filename -> (mtime, size) from the previous scan), files
+    whose mtime and size are unchanged are skipped without being hashed. Manifest
+    and stats entries of files that are no longer in json_dir are dropped.
+    """
+    changed = {}
+    present = set()
+    for entry in os.scandir(json_dir):
+        if not entry.is_file() or not entry.name.endswith('.json'):
+            continue
+        present.add(entry.name)
+        stat = entry.stat()
+        signature = (stat.st_mtime_ns, stat.st_size)
+        if stats is not None:
+            if stats.get(entry.name) == signature:
+                continue
+            stats[entry.name] = signature
+        digest = file_sha256(entry.path)
+        if manifest["files"].get(entry.name, {}).get("sha256") != digest:
+            changed[entry.name] = digest
+    for name in set(manifest["files"]) - present:
+        del manifest["files"][name]
+    if stats is not None:
+        for name in set(stats) - present:
+            del stats[name]
+    return changed
+
+def run_batch(json_dir: str, output_dir: str, workers: Optional[int] = None,
+              force: bool = False, stats: Dict[str, Any] = None) -> int:
+    """
+    Analyze new or changed JSON files in parallel and update the manifest.
+    
+    Args:
+        json_dir: Directory containing detection JSON files
+        output_dir: Directory to write *_analysis.txt reports and the manifest
+        workers: Number of worker processes (defaults to the CPU count)
+        force: Re-analyze every file regardless of the manifest
+        stats: Optional mtime/size cache shared across calls in watch mode
+        
+    Returns:
+        Number of files analyzed
+    """
+    manifest = load_manifest(output_dir)
+    if force:
+        manifest["files"] = {}
+    known = len(manifest["files"])
+    changed = find_changed_files(json_dir, manifest, stats)
+    if not changed:
+        if len(manifest["files"]) != known:
+            save_manifest(output_dir, manifest)
+        return 0
+    
+    names = sorted(changed)
+    paths = [os.path.join(json_dir, name) for name in names]
+    if len(paths) == 1:
+        outputs = [process_json_file(paths[0], output_dir)]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            outputs = list(pool.map(process_json_file, paths, [output_dir] * len(paths)))
+    
+    analyzed = 0
+    for name, output in zip(names, outputs):
+        if output is None:
+            # Unreadable or not a detection summary. Recorded with its hash so it is
+            # skipped until its content changes (e.g. a half-written file completes)
+            manifest["files"][name] = {
+                "sha256": changed[name],
+                "error": "not a usable detection summary",
+                "analyzed_at": time.strftime('%Y-%m-%dT%H:%M:%S'),
+            }
+            continue
+        manifest["files"][name] = {
+            "sha256": changed[name],
+            "output": os.path.basename(output),
+            "analyzed_at": time.strftime('%Y-%m-%dT%H:%M:%S'),
+        }
+        analyzed += 1
+    save_manifest(output_dir, manifest)
+    return analyzed
+
+def watch(json_dir: str, output_dir: str, interval: float = 1.0, workers: Optional[int] = None):
+    """Poll json_dir and analyze detection JSONs as soon as they appear or change"""
+    print(f"Watching {json_dir} for detection files (Ctrl+C to stop)...")
+    stats = {}
+    try:
+        while True:
+            started = time.perf_counter()
+            analyzed = run_batch(json_dir, output_dir, workers, stats=stats)
+            if analyzed:
+                print(f"Analyzed {analyzed} file(s) in {time.perf_counter() - started:.2f}s")
+            time.sleep(interval)
+    except KeyboardInterrupt:
+        print("Stopped watching")
 
 if __name__ == "__main__":
-    # Get list of JSON files
-    json_dir = "jsons"
-    json_files = [f for f in os.listdir(json_dir) if f.endswith('.json')]
-    
-    # Process each file
-    for json_file in sorted(json_files):
-        json_path = os.path.join(json_dir, json_file)
-        process_json_file(json_path)
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Analyze detection JSON files")
+    parser.add_argument("--json-dir", default="jsons", help="Directory containing detection JSON files")
+    parser.add_argument("--output-dir", default="analysis_results", help="Directory for analysis reports")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (defaults to CPU count)")
+    parser.add_argument("--force", action="store_true", help="Re-analyze every file, ignoring the manifest")
+    parser.add_argument("--watch", action="store_true", help="Keep running and analyze files as they arrive")
+    parser.add_argument("--interval", type=float, default=1.0, help="Polling interval in seconds for --watch")
+    args = parser.parse_args()
+    
+    if args.watch:
+        watch(args.json_dir, args.output_dir, args.interval, args.workers)
+    else:
+        started = time.perf_counter()
+        analyzed = run_batch(args.json_dir, args.output_dir, args.workers, force=args.force)
+        print(f"\nAnalyzed {analyzed} new or changed file(s) in {time.perf_counter() - started:.2f}s")
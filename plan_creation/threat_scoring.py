@@ -0,0 +1,194 @@
+import json
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+LEVELS = ["LOW", "MEDIUM", "HIGH"]
+
+# Class -> threat tier (index into LEVELS). Classes not listed are LOW.
+DEFAULT_TIERS = {
+    "Mines": 2, "Drone": 2, "boat": 2,
+    "truck": 1, "car": 1, "airplane": 1, "person": 1,
+    "bird": 0, "horse": 0, "cow": 0, "sheep": 0, "rocks": 0, "Fish and plants": 0,
+    "bicycle": 0, "umbrella": 0, "kite": 0, "bus": 0,
+}
+
+# Class -> weight used for the numeric threat score. Classes not listed weigh 0.1.
+DEFAULT_WEIGHTS = {
+    "Mines": 10.0, "Drone": 8.0, "boat": 6.0,
+    "truck": 3.0, "airplane": 3.0, "car": 2.0, "person": 1.0,
+}
+
+# Combinations that raise special considerations. Each rule fires when every
+# class in `requires` has at least the given count.
+DEFAULT_RULES = [
+    {
+        "name": "mine_drone",
+        "requires": {"Mines": 1, "Drone": 1},
+        "bonus": 20.0,
+        "message": "CRITICAL: Potential coordinated threat detected (Mine + Drone combination)",
+    },
+    {
+        "name": "boat_personnel",
+        "requires": {"boat": 1, "person": 11},
+        "bonus": 5.0,
+        "message": "WARNING: Large number of personnel with watercraft - assess for suspicious activity",
+    },
+]
+
+
+class ThreatScorer:
+    """
+    Table-driven threat scoring shared by the analysis report and the voice context.
+
+    Class names are matched case-insensitively. Summaries are scored as a batch:
+    the per-class counts are packed into a matrix once and tiers, weighted
+    scores and combination rules are then evaluated with NumPy. A scorer is
+    shared across request threads: new class names add columns under a lock.
+    """
+
+    def __init__(self, tiers: Dict[str, int] = None, weights: Dict[str, float] = None,
+                 rules: List[Dict[str, Any]] = None, default_weight: float = 0.1):
+        tiers = DEFAULT_TIERS if tiers is None else tiers
+        weights = DEFAULT_WEIGHTS if weights is None else weights
+        self.rules = DEFAULT_RULES if rules is None else rules
+        self.default_weight = default_weight
+        self.columns: Dict[str, int] = {}
+        self.lock = threading.Lock()
+        self._tiers: List[int] = []
+        self._weights: List[float] = []
+        self._tier_table = {name.casefold(): tier for name, tier in tiers.items()}
+        self._weight_table = {name.casefold(): weight for name, weight in weights.items()}
+        with self.lock:
+            for rule in self.rules:
+                for name in rule["requires"]:
+                    self._column(name)
+
+    @classmethod
+    def from_config(cls, path: str) -> "ThreatScorer":
+        """Build a scorer from a JSON file with optional tiers, weights and rules keys"""
+        with open(path, "r") as f:
+            config = json.load(f)
+        return cls(config.get("tiers"), config.get("weights"), config.get("rules"))
+
+    def _column(self, name: str) -> int:
+        """Column of a class name, added on first sight (call with self.lock held)"""
+        key = name.casefold()
+        column = self.columns.get(key)
+        if column is None:
+            column = self.columns[key] = len(self.columns)
+            self._tiers.append(self._tier_table.get(key, 0))
+            self._weights.append(self._weight_table.get(key, self.default_weight))
+        return column
+
+    def tier(self, name: str) -> int:
+        """Tier index (0=LOW, 1=MEDIUM, 2=HIGH) for a class name"""
+        return self._tier_table.get(name.casefold(), 0)
+
+    def score_batch(self, summaries: List[Dict[str, Any]]) -> Dict[str, np.ndarray]:
+        """
+        Score many detection summaries at once.
+
+        Args:
+            summaries: Detection summaries with a unique_objects mapping
+
+        Returns:
+            Dictionary of arrays: level (tier index per summary, -1 when nothing was
+            detected), score (weighted threat score), total_objects, and rules
+            (boolean matrix of summaries x rules)
+        """
+        rows, cols, values = [], [], []
+        # Columns, tiers and weights are read together, so another thread adding a
+        # class cannot leave the counts wider or narrower than the tables
+        with self.lock:
+            for row, summary in enumerate(summaries):
+                for name, count in (summary.get("unique_objects") or {}).items():
+                    rows.append(row)
+                    cols.append(self._column(name))
+                    values.append(count)
+            tiers = np.asarray(self._tiers, dtype=np.int8)
+            weights = np.asarray(self._weights, dtype=np.float64)
+
+        counts = np.zeros((len(summaries), len(tiers)), dtype=np.float64)
+        np.add.at(counts, (np.asarray(rows, dtype=np.intp), np.asarray(cols, dtype=np.intp)),
+                  np.asarray(values, dtype=np.float64))
+
+        present = counts > 0
+        level = np.where(present, tiers, -1).max(axis=1, initial=-1)
+        score = np.log1p(counts) @ weights
+
+        fired = np.ones((len(summaries), len(self.rules)), dtype=bool)
+        for index, rule in enumerate(self.rules):
+            for name, minimum in rule["requires"].items():
+                fired[:, index] &= counts[:, self.columns[name.casefold()]] >= minimum
+            score += fired[:, index] * rule.get("bonus", 0.0)
+
+        return {
+            "level": level,
+            "score": score,
+            "total_objects": counts.sum(axis=1),
+            "rules": fired,
+        }
+
+    def score(self, summary: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Score a single detection summary.
+
+        Returns:
+            Dictionary with the overall level name, numeric score, total object count,
+            the objects grouped by level (in detection order) and the messages of any
+            combination rules that fired
+        """
+        batch = self.score_batch([summary])
+        by_level = {level: [] for level in reversed(LEVELS)}
+        for name, count in (summary.get("unique_objects") or {}).items():
+            by_level[LEVELS[self.tier(name)]].append((name, count))
+        level = int(batch["level"][0])
+        return {
+            "level": LEVELS[max(level, 0)],
+            "score": float(batch["score"][0]),
+            "total_objects": int(batch["total_objects"][0]),
+            "objects": by_level,
+            "alerts": [rule["message"] for rule, fired in zip(self.rules, batch["rules"][0]) if fired],
+        }
+
+
+_default_scorer: Optional[ThreatScorer] = None
+_default_scorer_lock = threading.Lock()
+
+def get_scorer() -> ThreatScorer:
+    """Shared scorer, configured from THREAT_SCORING_CONFIG when set"""
+    global _default_scorer
+    with _default_scorer_lock:
+        if _default_scorer is None:
+            config_path = os.getenv("THREAT_SCORING_CONFIG")
+            _default_scorer = ThreatScorer.from_config(config_path) if config_path else ThreatScorer()
+        return _default_scorer
+
+
+if __name__ == "__main__":
+    # Throughput over the sample corpus, replicated to a large batch
+    json_dir = "jsons"
+    corpus = []
+    for name in sorted(os.listdir(json_dir)):
+        if name.endswith(".json"):
+            with open(os.path.join(json_dir, name), "r") as f:
+                corpus.append(json.load(f))
+    summaries = corpus * (20000 // len(corpus))
+
+    scorer = ThreatScorer()
+    start = time.perf_counter()
+    for summary in summaries:
+        scorer.score(summary)
+    single = time.perf_counter() - start
+
+    start = time.perf_counter()
+    scorer.score_batch(summaries)
+    batch = time.perf_counter() - start
+
+    print(f"Scored {len(summaries)} summaries")
+    print(f"  one at a time: {len(summaries) / single:,.0f} summaries/s")
+    print(f"  batched:       {len(summaries) / batch:,.0f} summaries/s")
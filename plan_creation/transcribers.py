@@ -0,0 +1,351 @@
+"""
+Pluggable speech-to-text for the voice service.
+
+TRANSCRIBER selects the engine:
+    gemini  Whole clip sent to Gemini (default, see gemini_calls.transcribe)
+    local   faster-whisper on the CPU with a small int8 model (WHISPER_MODEL)
+    fake    Timed placeholder text, for load tests without a model
+
+The local engine decodes the clip to 16 kHz mono, splits it at pauses with an
+energy voice-activity detector and transcribes the chunks in parallel. stream()
+yields each chunk's text in order as soon as it and every earlier chunk are
+done, so callers can start building the prompt before the clip is finished.
+
+    python transcribers.py clip.wav --engines gemini local
+    python transcribers.py --synthetic 30 --engines fake
+"""
+
+import argparse
+import io
+import os
+import threading
+import time
+import wave
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from instrumentation import registry
+
+transcription_rtf = registry.histogram(
+    "sentral_transcription_rtf", "Processing time divided by audio duration", ("engine",),
+    buckets=(0.05, 0.1, 0.2, 0.3, 0.5, 0.75, 1, 1.5, 2, 5))
+
+SAMPLE_RATE = 16000
+WHISPER_MODEL = os.getenv("WHISPER_MODEL", "tiny.en")
+WHISPER_COMPUTE_TYPE = os.getenv("WHISPER_COMPUTE_TYPE", "int8")
+TRANSCRIBE_WORKERS = int(os.getenv("TRANSCRIBE_WORKERS", "2"))
+# Voice activity: frames this many dB above the noise floor are speech
+VAD_THRESHOLD_DB = float(os.getenv("VAD_THRESHOLD_DB", "12"))
+VAD_MIN_SILENCE_MS = int(os.getenv("VAD_MIN_SILENCE_MS", "400"))
+VAD_MAX_CHUNK_S = float(os.getenv("VAD_MAX_CHUNK_S", "15"))
+
+
+def decode_audio(audio, sample_rate: int = SAMPLE_RATE) -> np.ndarray:
+    """
+    Decode an audio clip to mono float32 samples.
+
+    Args:
+        audio: Raw bytes, a binary file-like object, or a path
+        sample_rate: Output sample rate
+
+    Returns:
+        Samples in -1..1
+    """
+    if isinstance(audio, str):
+        with open(audio, "rb") as f:
+            audio = f.read()
+    if isinstance(audio, (bytes, bytearray, memoryview)):
+        audio = io.BytesIO(bytes(audio))
+    start = audio.tell()
+    header = audio.read(4)
+    audio.seek(start)
+
+    if header == b"RIFF":
+        # PCM WAV needs no codec
+        with wave.open(audio, "rb") as wav:
+            width, channels, rate = wav.getsampwidth(), wav.getnchannels(), wav.getframerate()
+            data = wav.readframes(wav.getnframes())
+        if width == 1:
+            samples = (np.frombuffer(data, np.uint8).astype(np.float32) - 128) / 128
+        elif width == 3:
+            # 24-bit PCM has no numpy type: widen each sample to 32 bits with a zero low byte
+            packed = np.frombuffer(data, np.uint8).reshape(-1, 3)
+            widened = np.zeros((len(packed), 4), np.uint8)
+            widened[:, 1:] = packed
+            samples = widened.view("<i4").ravel().astype(np.float32) / 2 ** 31
+        elif width in (2, 4):
+            dtype = {2: np.int16, 4: np.int32}[width]
+            samples = np.frombuffer(data, dtype).astype(np.float32) / np.iinfo(dtype).max
+        else:
+            raise ValueError(f"Unsupported WAV sample width: {width} bytes")
+        samples = samples.reshape(-1, channels).mean(axis=1)
+        if rate != sample_rate:
+            positions = np.arange(int(len(samples) * sample_rate / rate)) * rate / sample_rate
+            samples = np.interp(positions, np.arange(len(samples)), samples).astype(np.float32)
+        return samples
+
+    # WebM, Ogg, MP3 and the rest go through PyAV, which faster-whisper depends on
+    from faster_whisper import decode_audio as av_decode
+    return av_decode(audio, sampling_rate=sample_rate)
+
+
+def speech_chunks(samples: np.ndarray, sample_rate: int = SAMPLE_RATE, frame_ms: int = 30,
+                  threshold_db: float = VAD_THRESHOLD_DB, min_silence_ms: int = VAD_MIN_SILENCE_MS,
+                  max_chunk_s: float = VAD_MAX_CHUNK_S, min_speech_ms: int = 200,
+                  pad_ms: int = 150) -> List[Tuple[int, int]]:
+    """
+    Split audio into speech chunks at pauses.
+
+    Frames louder than the noise floor (10th percentile frame energy) by
+    threshold_db are speech. Gaps shorter than min_silence_ms are bridged, runs
+    shorter than min_speech_ms are dropped, and runs longer than max_chunk_s
+    are cut at their quietest frame. Chunks are padded by pad_ms at pauses only:
+    the two sides of a cut meet exactly, so no audio (and no word) is
+    transcribed twice.
+
+    Returns:
+        (start, end) sample offsets of each chunk
+    """
+    frame = int(sample_rate * frame_ms / 1000)
+    count = len(samples) // frame
+    if count == 0:
+        return []
+    energy = np.square(samples[:count * frame].reshape(count, frame)).mean(axis=1)
+    db = 10 * np.log10(energy + 1e-10)
+    floor = np.percentile(db, 10)
+    if db.max() - floor < threshold_db:
+        # No pauses to find: one chunk if there is any signal at all
+        voiced = db > -50
+    else:
+        voiced = db > floor + threshold_db
+
+    runs = []
+    edges = np.flatnonzero(np.diff(np.concatenate(([0], voiced.astype(np.int8), [0]))))
+    for start, end in zip(edges[::2], edges[1::2]):
+        if runs and start - runs[-1][1] < min_silence_ms / frame_ms:
+            runs[-1][1] = end
+        else:
+            runs.append([start, end])
+
+    max_frames = int(max_chunk_s * 1000 / frame_ms)
+    pad = int(pad_ms / frame_ms)
+    chunks = []
+    for start, end in runs:
+        if (end - start) * frame_ms < min_speech_ms:
+            continue
+        lead = pad
+        while end - start > max_frames:
+            cut = start + max_frames // 2 + int(np.argmin(db[start + max_frames // 2:start + max_frames]))
+            chunks.append((start - lead, cut))
+            start, lead = cut, 0
+        chunks.append((start - lead, end + pad))
+    return [(int(max(0, start) * frame), int(min(count, end) * frame)) for start, end in chunks]
+
+
+class Transcriber:
+    """
+    Interface for speech-to-text engines.
+
+    Subclasses implement stream(); transcribe() joins its output.
+    """
+
+    name = "transcriber"
+
+    def stream(self, audio, mime_type: Optional[str] = None) -> Iterator[str]:
+        """Yield the transcript in pieces, in order, as they become available"""
+        raise NotImplementedError
+
+    def transcribe(self, audio, mime_type: Optional[str] = None) -> str:
+        return " ".join(text for text in self.stream(audio, mime_type) if text).strip()
+
+    def ready(self) -> bool:
+        """Whether the engine can serve requests (used by the services' readiness checks)"""
+        return True
+
+
+class GeminiTranscriber(Transcriber):
+    """The remote path: the whole clip in one Gemini request"""
+
+    name = "gemini"
+
+    def __init__(self, client=None):
+        self.client = client
+
+    def ready(self) -> bool:
+        return self.client is not None or bool(os.getenv("GEMINI_API_KEY"))
+
+    def stream(self, audio, mime_type: Optional[str] = None) -> Iterator[str]:
+        from gemini_calls import transcribe
+        from llm_backends import get_gemini_client
+
+        # The shared client is created on first use, so the service starts without a key
+        yield transcribe(self.client or get_gemini_client(), audio, mime_type=mime_type)
+
+
+class ChunkedTranscriber(Transcriber):
+    """
+    Local engines: voice-activity chunks transcribed in parallel, streamed in order.
+
+    Subclasses implement transcribe_chunk(samples).
+    """
+
+    def __init__(self, workers: int = TRANSCRIBE_WORKERS):
+        self.workers = workers
+        self.pool = ThreadPoolExecutor(workers, thread_name_prefix=f"stt-{self.name}")
+
+    def transcribe_chunk(self, samples: np.ndarray) -> str:
+        raise NotImplementedError
+
+    def stream(self, audio, mime_type: Optional[str] = None) -> Iterator[str]:
+        started = time.perf_counter()
+        samples = decode_audio(audio)
+        futures = [self.pool.submit(self.transcribe_chunk, samples[start:end])
+                   for start, end in speech_chunks(samples)]
+        try:
+            for future in futures:
+                yield future.result().strip()
+        finally:
+            for future in futures:
+                future.cancel()
+            if len(samples):
+                transcription_rtf.observe((time.perf_counter() - started) / (len(samples) / SAMPLE_RATE),
+                                          engine=self.name)
+
+
+class WhisperTranscriber(ChunkedTranscriber):
+    """
+    faster-whisper (CTranslate2) on the CPU.
+
+    Args:
+        model: Model size or path, e.g. tiny.en, base.en, small.en
+        compute_type: CTranslate2 weight type; int8 keeps small models fast on CPU
+        workers: Chunks transcribed concurrently; CPU cores are split between them
+    """
+
+    name = "local"
+
+    def __init__(self, model: str = WHISPER_MODEL, compute_type: str = WHISPER_COMPUTE_TYPE,
+                 workers: int = TRANSCRIBE_WORKERS):
+        from faster_whisper import WhisperModel
+
+        super().__init__(workers)
+        threads = max(1, (os.cpu_count() or 1) // workers)
+        self.model = WhisperModel(model, device="cpu", compute_type=compute_type,
+                                  cpu_threads=threads, num_workers=workers)
+        self.language = "en" if model.endswith(".en") else None
+
+    def transcribe_chunk(self, samples: np.ndarray) -> str:
+        # Chunks are independent: greedy decoding, no carried-over context, VAD already applied
+        segments, _ = self.model.transcribe(samples, language=self.language, beam_size=1,
+                                            condition_on_previous_text=False, vad_filter=False)
+        return " ".join(segment.text.strip() for segment in segments)
+
+
+class FakeTranscriber(ChunkedTranscriber):
+    """Placeholder text after a delay proportional to the chunk length"""
+
+    name = "fake"
+
+    def __init__(self, rtf: float = 0.15, workers: int = TRANSCRIBE_WORKERS):
+        super().__init__(workers)
+        self.rtf = rtf
+
+    def transcribe_chunk(self, samples: np.ndarray) -> str:
+        seconds = len(samples) / SAMPLE_RATE
+        time.sleep(seconds * self.rtf)
+        return f"[{seconds:.1f}s of speech]"
+
+
+ENGINES = {"gemini": GeminiTranscriber, "local": WhisperTranscriber, "fake": FakeTranscriber}
+
+_transcriber = None
+_transcriber_lock = threading.Lock()
+
+
+def get_transcriber() -> Transcriber:
+    """Process-wide transcriber chosen by TRANSCRIBER (gemini by default)"""
+    global _transcriber
+    with _transcriber_lock:
+        if _transcriber is None:
+            name = os.getenv("TRANSCRIBER", "gemini")
+            if name not in ENGINES:
+                raise ValueError(f"Unknown TRANSCRIBER {name!r}; expected one of {', '.join(ENGINES)}")
+            _transcriber = ENGINES[name]()
+        return _transcriber
+
+
+def synthetic_speech(seconds: float, sample_rate: int = SAMPLE_RATE, seed: int = 0) -> np.ndarray:
+    """Bursts of voiced, modulated tones separated by pauses, over low background noise"""
+    rng = np.random.default_rng(seed)
+    samples = rng.normal(0, 0.003, int(seconds * sample_rate)).astype(np.float32)
+    position = 0.3
+    while position < seconds - 1:
+        length = min(rng.uniform(1.0, 4.0), seconds - position)
+        t = np.arange(int(length * sample_rate)) / sample_rate
+        pitch = rng.uniform(100, 220)
+        burst = sum(np.sin(2 * np.pi * pitch * k * t) / k for k in range(1, 6))
+        burst *= 0.2 * (0.6 + 0.4 * np.sin(2 * np.pi * 4 * t)) * np.hanning(len(t))
+        start = int(position * sample_rate)
+        samples[start:start + len(t)] += burst.astype(np.float32)
+        position += length + rng.uniform(0.5, 1.2)
+    return samples
+
+
+def to_wav(samples: np.ndarray, sample_rate: int = SAMPLE_RATE) -> bytes:
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(sample_rate)
+        wav.writeframes((np.clip(samples, -1, 1) * 32767).astype(np.int16).tobytes())
+    return buffer.getvalue()
+
+
+def measure(transcriber: Transcriber, audio: bytes, duration: float) -> dict:
+    """Latency to the first piece of text and to the full transcript, and real-time factor"""
+    started = time.perf_counter()
+    first = None
+    pieces = []
+    for text in transcriber.stream(audio):
+        if first is None:
+            first = time.perf_counter() - started
+        pieces.append(text)
+    total = time.perf_counter() - started
+    return {"first_text_s": first, "total_s": total, "rtf": total / duration,
+            "pieces": len(pieces), "text": " ".join(pieces)}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare transcription engines on one clip")
+    parser.add_argument("audio", nargs="?", help="Audio file (any format PyAV reads)")
+    parser.add_argument("--synthetic", type=float, default=0, help="Use this many seconds of synthetic speech")
+    parser.add_argument("--engines", nargs="+", default=["gemini", "local"], choices=list(ENGINES))
+    args = parser.parse_args()
+
+    if args.audio:
+        with open(args.audio, "rb") as f:
+            audio = f.read()
+    elif args.synthetic:
+        audio = to_wav(synthetic_speech(args.synthetic))
+    else:
+        parser.error("give an audio file or --synthetic SECONDS")
+    samples = decode_audio(audio)
+    duration = len(samples) / SAMPLE_RATE
+    chunks = speech_chunks(samples)
+    speech = sum(end - start for start, end in chunks) / SAMPLE_RATE
+    print(f"{duration:.1f}s of audio, {len(chunks)} speech chunks covering {speech:.1f}s")
+
+    for name in args.engines:
+        try:
+            transcriber = ENGINES[name]()
+        except Exception as e:
+            print(f"{name:>8}: unavailable ({e})")
+            continue
+        # The first call loads models and warms caches
+        transcriber.transcribe(to_wav(samples[:SAMPLE_RATE]))
+        result = measure(transcriber, audio, duration)
+        print(f"{name:>8}: first text {result['first_text_s']:.2f}s, full transcript {result['total_s']:.2f}s, "
+              f"RTF {result['rtf']:.3f}, {result['pieces']} pieces")
+        print(f"{'':>10}{result['text'][:200]}")
@@ -1,39 +1,57 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Request, Response, request, jsonify, stream_with_context
 from flask_cors import CORS
-import google.generativeai as genai
+import io
 import os
+import json
 import tempfile
-import uuid
+import time
 from dotenv import load_dotenv
-from gemini_calls import gemini_client, transcribe
+from gemini_calls import INLINE_AUDIO_LIMIT, sniff_audio_mime
+from llm_backends import VOICE_BUDGET_MS, complete, get_router
+from threat_scoring import get_scorer
+from transcribers import get_transcriber
+from instrumentation import instrument_flask, span
+
+# Uploads larger than this are rejected before they are read
+MAX_AUDIO_BYTES = int(os.getenv('MAX_AUDIO_BYTES', 25 * 1024 * 1024))
+
+class AudioUploadRequest(Request):
+    """
+    Request that keeps short multipart uploads in memory instead of spooling them
+    to disk. Uploads too large to send inline (INLINE_AUDIO_LIMIT) are written to
+    a temporary file as they arrive, and the Files API upload reads that file in
+    chunks, so a long clip is never held in memory whole.
+    """
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        if total_content_length is not None and total_content_length <= INLINE_AUDIO_LIMIT:
+            return io.BytesIO()
+        return tempfile.TemporaryFile('w+b')
 
 app = Flask(__name__)
+app.request_class = AudioUploadRequest
+app.config['MAX_CONTENT_LENGTH'] = MAX_AUDIO_BYTES
 CORS(app)
+instrument_flask(app, "voice")
 
 # Load environment variables
 load_dotenv()
 
-# Configure Gemini
-genai.configure(api_key=os.getenv('GEMINI_API_KEY'))
-
-# Initialize the model for chat
-model = genai.GenerativeModel('gemini-pro')
-chat = model.start_chat(history=[])
-
-# Initialize the Gemini client from the gemini_calls module
-from google import genai as genai_client
-client = genai_client.Client(api_key=os.environ.get("GEMINI_API_KEY"))
+def ready():
+    """Readiness checks reported by serve.py at /readyz"""
+    # Each backend checks what it needs (Gemini its API key, Llama its deployed app) without generating
+    checks = {f"llm.{name}": ok for name, ok in get_router().ready().items()}
+    checks["transcriber"] = get_transcriber().ready()
+    return checks
 
 def format_threat_context(threat_data):
     """Format threat data into a clear context string"""
     if not threat_data:
         return "No current threat data available."
 
-    objects = threat_data.get('unique_objects', {})
-    high_threats = [f"{count} {obj}" for obj, count in objects.items() 
-                   if obj.lower() in ['mines', 'drone', 'boat']]
-    medium_threats = [f"{count} {obj}" for obj, count in objects.items() 
-                     if obj.lower() in ['truck', 'car', 'airplane', 'person']]
+    assessment = get_scorer().score(threat_data)
+    high_threats = [f"{count} {obj}" for obj, count in assessment['objects']['HIGH']]
+    medium_threats = [f"{count} {obj}" for obj, count in assessment['objects']['MEDIUM']]
     
     context = []
     if high_threats:
@@ -41,11 +59,21 @@ def format_threat_context(threat_data):
     if medium_threats:
         context.append(f"MEDIUM THREAT OBJECTS DETECTED: {', '.join(medium_threats)}")
     
-    threat_level = "HIGH" if high_threats else "MEDIUM" if medium_threats else "LOW"
-    context.append(f"Current Threat Level: {threat_level}")
+    context.append(f"Current Threat Level: {assessment['level']}")
     
     return "\n".join(context)
 
+def voice_prompt(threat_context, user_message):
+    """The assistant prompt shared by typed and spoken questions"""
+    return f"""You are Sentral AI, an advanced defense system assistant. 
+        Current situation:
+        {threat_context}
+
+        User query: {user_message}
+
+        Respond in a clear, direct manner focusing on security implications and actionable recommendations. 
+        Keep responses concise but informative."""
+
 @app.route('/api/voice-chat', methods=['POST'])
 def handle_voice_chat():
     try:
@@ -59,19 +87,8 @@ def handle_voice_chat():
         # Format the current threat context
         threat_context = format_threat_context(threat_data)
 
-        # Add system context to the message
-        prompt = f"""You are Sentral AI, an advanced defense system assistant. 
-        Current situation:
-        {threat_context}
-
-        User query: {user_message}
-
-        Respond in a clear, direct manner focusing on security implications and actionable recommendations. 
-        Keep responses concise but informative."""
-
-        # Get AI response
-        response = chat.send_message(prompt)
-        ai_response = response.text
+        # Get AI response from the backend that fits the voice latency budget
+        ai_response = complete(voice_prompt(threat_context, user_message), budget_ms=VOICE_BUDGET_MS)
 
         return jsonify({
             'success': True,
@@ -82,79 +99,118 @@ def handle_voice_chat():
         print(f"Error in voice chat: {e}")
         return jsonify({'error': str(e)}), 500
 
+def answer_voice_upload(audio_stream, mime_type, threat_context, timings, started):
+    """
+    Transcribe an upload and answer it, yielding results as soon as they exist:
+    {"transcription": piece} for each transcript piece, in order, then
+    {"success": True, "transcription": ..., "response": ...} (or {"error": ...}).
+    """
+    # Local transcribers yield the transcript chunk by chunk as voice-activity chunks finish
+    with span("voice", "transcription") as stage:
+        pieces = []
+        for text in get_transcriber().stream(audio_stream, mime_type=mime_type):
+            if not pieces:
+                timings['first_text_ms'] = (time.perf_counter() - started) * 1000
+            pieces.append(text)
+            if text:
+                yield {'transcription': text}
+        transcription = " ".join(piece for piece in pieces if piece).strip()
+    timings['transcribe_ms'] = stage.duration * 1000
+
+    print(f"Transcription result: '{transcription}'")
+
+    if not transcription:
+        yield {'error': 'Failed to transcribe audio'}
+        return
+
+    # Get AI response from the backend that fits the voice latency budget
+    with span("voice", "llm_call") as stage:
+        ai_response = complete(voice_prompt(threat_context, transcription), budget_ms=VOICE_BUDGET_MS)
+    timings['response_ms'] = stage.duration * 1000
+
+    yield {'success': True, 'transcription': transcription, 'response': ai_response}
+
+def log_voice_timings(timings, started):
+    timings['total_ms'] = (time.perf_counter() - started) * 1000
+    print("Voice upload timings: " + ", ".join(f"{k}={v:.1f}" for k, v in timings.items()))
+
 @app.route('/api/voice-upload', methods=['POST'])
 def handle_voice_upload():
+    """
+    Transcribe an uploaded clip and answer it.
+
+    With `Accept: application/x-ndjson` the answer is streamed as one JSON object
+    per line (see answer_voice_upload): the client shows each transcript piece
+    while later chunks are still being transcribed, instead of waiting for the
+    transcript and the LLM answer together. Otherwise one JSON object is returned.
+    """
+    timings = {}
+    started = time.perf_counter()
+    streaming = False
     try:
         # Check if threat data is included in the request
         threat_data = None
         if 'threatData' in request.form:
-            import json
             threat_data = json.loads(request.form.get('threatData'))
         
         # Check if audio file is included in the request
         if 'audio' not in request.files:
             return jsonify({'error': 'No audio file provided'}), 400
         
-        audio_file = request.files['audio']
-        
-        # Create a temporary directory to store the audio file
-        temp_dir = tempfile.mkdtemp()
-        audio_filename = f"{uuid.uuid4()}.mp3"
-        audio_path = os.path.join(temp_dir, audio_filename)
-        
-        print(f"Saving audio file to: {audio_path}")
-        
-        # Save the audio file
-        audio_file.save(audio_path)
-        
-        # Verify the file exists and has content
-        if not os.path.exists(audio_path) or os.path.getsize(audio_path) == 0:
-            print(f"Error: File not saved or empty: {audio_path}")
-            return jsonify({'error': 'Failed to save audio file'}), 500
-        
-        print(f"Audio file saved successfully. Size: {os.path.getsize(audio_path)} bytes")
-        
-        # Transcribe the audio using the gemini function
-        transcription = transcribe(client, audio_path)
-        
-        print(f"Transcription result: '{transcription}'")
-        
-        if not transcription:
-            return jsonify({'error': 'Failed to transcribe audio'}), 500
-        
-        # Format the current threat context
+        # The upload is already buffered (in memory, or on disk when long); hand the
+        # stream over without copying
+        audio_stream = request.files['audio'].stream
+        audio_size = audio_stream.seek(0, os.SEEK_END)
+        audio_stream.seek(0)
+        if audio_size == 0:
+            return jsonify({'error': 'Empty audio file'}), 400
+        
+        mime_type = sniff_audio_mime(audio_stream.read(12))
+        audio_stream.seek(0)
+        timings['receive_ms'] = (time.perf_counter() - started) * 1000
+        # Memory held for the upload itself, per request and independent of other threads
+        timings['buffered_kb'] = audio_size / 1024 if isinstance(audio_stream, io.BytesIO) else 0
+        print(f"Received {audio_size} bytes of {mime_type} audio")
+        
+        # The threat context does not depend on the audio, so it is ready before the transcript
         threat_context = format_threat_context(threat_data)
-        
-        # Add system context to the message
-        prompt = f"""You are Sentral AI, an advanced defense system assistant. 
-        Current situation:
-        {threat_context}
-
-        User query: {transcription}
-
-        Respond in a clear, direct manner focusing on security implications and actionable recommendations. 
-        Keep responses concise but informative."""
-        
-        # Get AI response using gemini_client
-        ai_response = gemini_client(client, prompt)
-        
-        # Clean up the temporary file
-        try:
-            os.remove(audio_path)
-            os.rmdir(temp_dir)
-            print("Temporary files cleaned up successfully")
-        except Exception as e:
-            print(f"Warning: Failed to clean up temporary files: {e}")
-        
-        return jsonify({
-            'success': True,
-            'transcription': transcription,
-            'response': ai_response
-        })
+        events = answer_voice_upload(audio_stream, mime_type, threat_context, timings, started)
+
+        if request.accept_mimetypes.best == 'application/x-ndjson':
+            streaming = True
+            # Flask closes the request's files once the view returns; detach the buffer
+            # so the generator can keep reading it (no copy is made)
+            request.files['audio'].stream = io.BytesIO()
+
+            def generate():
+                try:
+                    for event in events:
+                        yield json.dumps(event) + "\n"
+                except Exception as e:
+                    print(f"Error in voice upload: {e}")
+                    yield json.dumps({'error': str(e)}) + "\n"
+                finally:
+                    # How much sooner the client saw the first words than the full answer
+                    if 'first_text_ms' in timings:
+                        timings['streamed_ahead_ms'] = (time.perf_counter() - started) * 1000 - timings['first_text_ms']
+                    log_voice_timings(timings, started)
+
+            return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+        result = {}
+        for result in events:
+            pass
+        if 'error' in result:
+            return jsonify(result), 500
+        return jsonify(result)
         
     except Exception as e:
         print(f"Error in voice upload: {e}")
         return jsonify({'error': str(e)}), 500
+    finally:
+        if not streaming:
+            log_voice_timings(timings, started)
 
 if __name__ == '__main__':
+    # Development server; use `python serve.py voice` in production
     app.run(host='0.0.0.0', port=5003)
@@ -0,0 +1,202 @@
+"""
+Production entry point for the Flask services.
+
+Runs a service under gunicorn with a configurable pool of worker processes and
+threads, instead of Flask's single-process development server:
+
+    python serve.py sonar                      # port 5001
+    python serve.py voice --workers 4          # port 5003
+    python serve.py emergency --threads 32     # port 5002
+    python serve.py detections                 # port 5004
+    python serve.py gateway                    # all of the above on port 5050
+
+Services whose app loads a model at import time are preloaded, so the model
+is loaded once in the master and shared copy-on-write with forked workers.
+Every service gets /healthz (process is up) and /readyz (dependencies loaded).
+Workers, threads and the request timeout can also be set with SERVE_WORKERS,
+SERVE_THREADS and SERVE_TIMEOUT. With more than one worker the workers share
+their metrics through METRICS_DIR (see instrumentation.py), so /metrics
+reports the whole service.
+"""
+
+import argparse
+import glob
+import importlib
+import os
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+# The services import the shared root modules (instrumentation, event_bus) by
+# bare name; this and the service directory in load_app are the only path setup
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+SERVICES = {
+    # CPU-bound model inference: one process per core
+    "sonar": {
+        "directory": "sonar",
+        "module": "app",
+        "port": 5001,
+        "workers": os.cpu_count() or 1,
+        "threads": 1,
+        "timeout": 30,
+        "preload": True,
+    },
+    # Waits on transcription and the LLM, so threads do most of the work
+    "voice": {
+        "directory": "plan_creation",
+        "module": "voice_interaction_service",
+        "port": 5003,
+        "workers": 2,
+        "threads": 8,
+        "timeout": 120,
+        "preload": True,
+    },
+    # Call jobs and TwiML scripts live in process memory, so Twilio's callbacks
+    # must reach the process that created the job: one worker, many threads.
+    # Not preloaded because the dispatcher starts threads at import time.
+    "emergency": {
+        "directory": "plan_creation",
+        "module": "emergency_call_service",
+        "port": 5002,
+        "workers": 1,
+        "threads": 16,
+        "timeout": 30,
+        "preload": False,
+        "single_process": True,
+    },
+    # Indexed detection queries; each worker opens its own SQLite connection.
+    # The detection files are indexed once, in the master, before workers start.
+    "detections": {
+        "directory": "plan_creation",
+        "module": "detection_api",
+        "port": 5004,
+        "workers": os.cpu_count() or 1,
+        "threads": 4,
+        "timeout": 30,
+        "preload": False,
+        "setup": ("plan_creation", "detection_store", "index_json_dir"),
+    },
+    # Every route in one process with shared clients (see gateway.py); single
+    # process for the same reason as the emergency service
+    "gateway": {
+        "directory": ".",
+        "module": "gateway",
+        "port": 5050,
+        "workers": 1,
+        "threads": 32,
+        "timeout": 120,
+        "preload": False,
+        "single_process": True,
+        "setup": ("plan_creation", "detection_store", "index_json_dir"),
+    },
+}
+
+
+def run_setup(name: str):
+    """
+    One-off startup work of a service (e.g. indexing files), run once before the
+    workers are forked rather than by every worker on import
+    """
+    setup = SERVICES[name].get("setup")
+    if setup is None:
+        return
+    directory, module_name, function = setup
+    sys.path.insert(0, os.path.join(ROOT, directory))
+    getattr(importlib.import_module(module_name), function)()
+
+
+def load_app(name: str):
+    """Import a service's Flask app from its directory and add the health routes"""
+    from flask import jsonify
+
+    service = SERVICES[name]
+    directory = os.path.join(ROOT, service["directory"])
+    # The services open data files relative to their own directory
+    os.chdir(directory)
+    sys.path.insert(0, directory)
+    module = importlib.import_module(service["module"])
+    app = module.app
+    ready_check = getattr(module, "ready", None)
+
+    def healthz():
+        return jsonify({"status": "ok", "service": name, "pid": os.getpid()})
+
+    def readyz():
+        checks = ready_check() if ready_check else {}
+        ok = all(checks.values())
+        return jsonify({"ready": ok, "service": name, "checks": checks}), 200 if ok else 503
+
+    app.add_url_rule("/healthz", "healthz", healthz)
+    app.add_url_rule("/readyz", "readyz", readyz)
+    return app
+
+
+def share_metrics(name: str, port: int):
+    """
+    Point every process of the service at one metrics directory, emptied of a
+    previous run's snapshots. Must run before instrumentation is imported.
+    """
+    directory = os.environ.setdefault(
+        "METRICS_DIR", os.path.join(tempfile.gettempdir(), f"sentral-metrics-{name}-{port}"))
+    os.makedirs(directory, exist_ok=True)
+    for path in glob.glob(os.path.join(directory, "*.json")):
+        os.remove(path)
+
+
+def run(name: str, host: str, port: int, workers: int, threads: int, timeout: int, preload: bool):
+    from gunicorn.app.base import BaseApplication
+
+    class ServiceApplication(BaseApplication):
+        def load_config(self):
+            self.cfg.set("bind", f"{host}:{port}")
+            self.cfg.set("workers", workers)
+            self.cfg.set("threads", threads)
+            self.cfg.set("worker_class", "gthread" if threads > 1 else "sync")
+            self.cfg.set("timeout", timeout)
+            self.cfg.set("graceful_timeout", timeout)
+            self.cfg.set("keepalive", 5)
+            self.cfg.set("preload_app", preload)
+            self.cfg.set("accesslog", os.getenv("SERVE_ACCESS_LOG"))
+
+        def load(self):
+            return load_app(name)
+
+    print(f"Serving {name} on {host}:{port} with {workers} worker(s) x {threads} thread(s), "
+          f"timeout {timeout}s{', preloaded' if preload else ''}")
+    if workers > 1:
+        share_metrics(name, port)
+    run_setup(name)
+    ServiceApplication().run()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve a Sentral service under gunicorn")
+    parser.add_argument("service", choices=sorted(SERVICES))
+    parser.add_argument("--host", default=os.getenv("SERVE_HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=None)
+    parser.add_argument("--workers", type=int, default=os.getenv("SERVE_WORKERS"), help="Worker processes")
+    parser.add_argument("--threads", type=int, default=os.getenv("SERVE_THREADS"), help="Threads per worker")
+    parser.add_argument("--timeout", type=int, default=os.getenv("SERVE_TIMEOUT"),
+                        help="Seconds before a stuck worker is restarted")
+    args = parser.parse_args()
+
+    service = SERVICES[args.service]
+    workers = int(args.workers or service["workers"])
+    if service.get("single_process") and workers > 1:
+        print(f"The {args.service} service keeps call jobs in memory; using 1 worker (raise --threads instead)")
+        workers = 1
+    run(
+        args.service,
+        args.host,
+        args.port or service["port"],
+        workers,
+        int(args.threads or service["threads"]),
+        int(args.timeout or service["timeout"]),
+        service["preload"],
+    )
+
+
+if __name__ == "__main__":
+    main()
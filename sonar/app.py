@@ -1,59 +1,115 @@
 from flask import Flask, request, jsonify
 from flask_cors import CORS
-import pandas as pd
 import numpy as np
-from sklearn.ensemble import RandomForestClassifier
-import joblib
 import os
+from instrumentation import instrument_flask, span
+from features import SAMPLE_RATE, extractor_for
+from forest import Forest
 
 app = Flask(__name__)
 CORS(app)
+instrument_flask(app, "sonar")
+
+# Data files live next to this module, whichever directory the service runs from
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DATA_PATH = os.path.join(BASE_DIR, 'sonar.csv')
+MODEL_PATH = os.path.join(BASE_DIR, 'sonar_model.joblib')
+# The same forest exported to NumPy arrays; serving from it keeps scikit-learn out of startup
+FOREST_PATH = os.path.join(BASE_DIR, 'sonar_model.npz')
 
 # Load and train the model
 def train_model():
-    df = pd.read_csv('sonar.csv', header=None)
-    X = df.drop(60, axis=1)
-    y = df[60].map({'R': 0, 'M': 1})
+    # scikit-learn is only needed to train or re-export the model
+    import joblib
+    from sklearn.ensemble import RandomForestClassifier
+
+    rows = np.loadtxt(DATA_PATH, delimiter=',', dtype=str)
+    X = rows[:, :60].astype(float)
+    y = (rows[:, 60] == 'M').astype(int)
     model = RandomForestClassifier(n_estimators=100, random_state=42)
     model.fit(X, y)
     
     # Save the model
-    joblib.dump(model, 'sonar_model.joblib')
+    joblib.dump(model, MODEL_PATH)
     return model
 
-# Load or train the model
-if os.path.exists('sonar_model.joblib'):
-    model = joblib.load('sonar_model.joblib')
-else:
-    model = train_model()
+def load_model():
+    """The exported forest, re-exported whenever the joblib model is newer or missing"""
+    if os.path.exists(FOREST_PATH) and (not os.path.exists(MODEL_PATH) or
+                                        os.path.getmtime(FOREST_PATH) >= os.path.getmtime(MODEL_PATH)):
+        return Forest.load(FOREST_PATH)
+    if os.path.exists(MODEL_PATH):
+        import joblib
+        trained = joblib.load(MODEL_PATH)
+    else:
+        trained = train_model()
+    forest = Forest.from_sklearn(trained)
+    forest.save(FOREST_PATH)
+    return forest
+
+model = load_model()
+
+def ready():
+    """Readiness checks reported by serve.py at /readyz"""
+    return {"model": model is not None}
+
+def format_results(predictions, probabilities):
+    results = []
+    for pred, prob in zip(predictions, probabilities):
+        result = {
+            'prediction': 'MINE' if pred == 1 else 'ROCK',
+            'confidence': float(prob[pred] * 100)
+        }
+        results.append(result)
+    return results
 
 @app.route('/api/predict', methods=['POST'])
 def predict():
     try:
-        data = request.json
-        readings = data.get('readings', [])
-        
-        # Convert to correct format
-        readings_array = np.array(readings)
-        if readings_array.ndim == 1:
-            readings_array = readings_array.reshape(1, -1)
+        with span("sonar", "decode"):
+            data = request.json
+            readings = data.get('readings', [])
+            
+            # Convert to correct format
+            readings_array = np.array(readings)
+            if readings_array.ndim == 1:
+                readings_array = readings_array.reshape(1, -1)
             
         # Make prediction
-        predictions = model.predict(readings_array)
-        probabilities = model.predict_proba(readings_array)
+        with span("sonar", "inference"):
+            predictions = model.predict(readings_array)
+            probabilities = model.predict_proba(readings_array)
         
-        # Format results
-        results = []
-        for pred, prob in zip(predictions, probabilities):
-            result = {
-                'prediction': 'MINE' if pred == 1 else 'ROCK',
-                'confidence': float(prob[pred] * 100)
-            }
-            results.append(result)
-            
-        return jsonify({'results': results})
+        return jsonify({'results': format_results(predictions, probabilities)})
+    except Exception as e:
+        return jsonify({'error': str(e)}), 400
+
+@app.route('/api/predict-raw', methods=['POST'])
+def predict_raw():
+    """Classify raw echo waveforms: {"pings": [[samples...], ...], "sample_rate": 48000}"""
+    try:
+        with span("sonar", "decode"):
+            data = request.json
+            pings = np.asarray(data.get('pings', []), dtype=np.float32)
+            sample_rate = float(data.get('sample_rate', SAMPLE_RATE))
+
+        # The 60 band energies sonar.csv uses, computed for the whole batch at once
+        with span("sonar", "features"):
+            features = extractor_for(sample_rate).extract(pings)
+            if features.ndim == 1:
+                features = features.reshape(1, -1)
+
+        with span("sonar", "inference"):
+            predictions = model.predict(features)
+            probabilities = model.predict_proba(features)
+
+        return jsonify({
+            'results': format_results(predictions, probabilities),
+            'features': np.round(features, 4).tolist()
+        })
     except Exception as e:
         return jsonify({'error': str(e)}), 400
 
 if __name__ == '__main__':
+    # Development server; use `python serve.py sonar` in production
     app.run(port=5001)
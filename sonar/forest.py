@@ -0,0 +1,82 @@
+"""
+RandomForestClassifier inference in plain NumPy.
+
+Importing scikit-learn to unpickle the forest dominates the sonar service's
+startup. The trained trees are exported once to flat arrays in an .npz file and
+evaluated here, for every sample and tree at the same time, with the same
+decisions as sklearn (features compared as float32, as sklearn's trees do).
+"""
+
+import numpy as np
+
+
+class Forest:
+    """
+    Flattened decision trees. Node arrays are concatenated over all trees and
+    child indices are global. Leaves are their own children, so every sample
+    can take `depth` steps down every tree without checking for leaves.
+
+    Args:
+        feature: Feature index tested at each node
+        threshold: Split threshold at each node (go left when value <= threshold)
+        left: Left child of each node
+        right: Right child of each node
+        proba: Class probabilities at each node
+        roots: Root node of each tree
+        classes: Class labels, in the column order of proba
+        depth: Depth of the deepest tree
+    """
+
+    def __init__(self, feature, threshold, left, right, proba, roots, classes, depth):
+        self.feature = feature
+        self.threshold = threshold
+        self.left = left
+        self.right = right
+        self.proba = proba
+        self.roots = roots
+        self.classes = classes
+        self.depth = int(depth)
+
+    @classmethod
+    def from_sklearn(cls, model) -> "Forest":
+        features, thresholds, lefts, rights, probas, roots = [], [], [], [], [], []
+        offset = 0
+        for estimator in model.estimators_:
+            tree = estimator.tree_
+            leaf = tree.children_left == -1
+            value = tree.value[:, 0, :]
+            own = np.arange(tree.node_count) + offset
+            roots.append(offset)
+            features.append(np.where(leaf, 0, tree.feature))
+            thresholds.append(tree.threshold)
+            lefts.append(np.where(leaf, own, tree.children_left + offset))
+            rights.append(np.where(leaf, own, tree.children_right + offset))
+            probas.append(value / value.sum(axis=1, keepdims=True))
+            offset += tree.node_count
+        return cls(np.concatenate(features).astype(np.int32), np.concatenate(thresholds),
+                   np.concatenate(lefts).astype(np.int32), np.concatenate(rights).astype(np.int32),
+                   np.concatenate(probas), np.array(roots, dtype=np.int32), np.asarray(model.classes_),
+                   max(estimator.tree_.max_depth for estimator in model.estimators_))
+
+    def save(self, path: str):
+        np.savez(path, feature=self.feature, threshold=self.threshold, left=self.left, right=self.right,
+                 proba=self.proba, roots=self.roots, classes=self.classes, depth=self.depth)
+
+    @classmethod
+    def load(cls, path: str) -> "Forest":
+        with np.load(path) as data:
+            return cls(**{name: data[name] for name in data.files})
+
+    def predict_proba(self, X) -> np.ndarray:
+        X = np.asarray(X, dtype=np.float32)
+        if X.ndim == 1:
+            X = X.reshape(1, -1)
+        rows = np.arange(len(X))[:, None]
+        nodes = np.broadcast_to(self.roots, (len(X), len(self.roots)))
+        for _ in range(self.depth):
+            go_left = X[rows, self.feature[nodes]] <= self.threshold[nodes]
+            nodes = np.where(go_left, self.left[nodes], self.right[nodes])
+        return self.proba[nodes].mean(axis=1)
+
+    def predict(self, X) -> np.ndarray:
+        return self.classes[self.predict_proba(X).argmax(axis=1)]
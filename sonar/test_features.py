@@ -0,0 +1,49 @@
+import numpy as np
+import pytest
+
+from features import FeatureExtractor, chirp, extractor_for, synthetic_pings, validate
+
+
+@pytest.fixture(scope="module")
+def extractor():
+    return FeatureExtractor(sample_rate=48000)
+
+
+def test_tones_peak_in_their_own_band(extractor):
+    centers = (extractor.edges[:-1] + extractor.edges[1:]) / 2
+    t = np.arange(8192) / extractor.sample_rate
+    tones = np.sin(2 * np.pi * centers[:, None] * t[None]).astype(np.float32)
+    np.testing.assert_array_equal(extractor.extract(tones).argmax(axis=1), np.arange(extractor.bands))
+
+
+def test_partial_chirp_stays_in_its_bands(extractor):
+    low, high = 20, 30
+    part = extractor.extract(chirp(8192, extractor.edges[low], extractor.edges[high], extractor.sample_rate))
+    assert part[low:high].sum() / part.sum() > 0.9
+
+
+def test_batched_matches_reference(extractor):
+    # More pings than one chunk, so the split into FFT calls is covered too
+    pings = synthetic_pings(extractor.chunk * 2 + 3, 8192, extractor.sample_rate)
+    batched = extractor.extract(pings)
+    reference = np.stack([extractor.extract_reference(ping) for ping in pings])
+    assert batched.shape == (len(pings), 60)
+    np.testing.assert_allclose(batched, reference, atol=1e-4)
+    np.testing.assert_allclose(extractor.extract(pings[0]), reference[0], atol=1e-4)
+    assert batched.max(axis=1) == pytest.approx(1.0)
+
+
+def test_short_ping_is_padded(extractor):
+    ping = synthetic_pings(1, extractor.frame_size // 2, extractor.sample_rate)[0]
+    np.testing.assert_allclose(extractor.extract(ping), extractor.extract_reference(ping), atol=1e-4)
+
+
+def test_invalid_input():
+    with pytest.raises(ValueError):
+        FeatureExtractor(sample_rate=16000, high_hz=20000)
+    with pytest.raises(ValueError):
+        extractor_for(48000).extract(np.zeros((2, 0)))
+
+
+def test_validate_passes(extractor):
+    assert validate(extractor)
@@ -0,0 +1,66 @@
+import os
+
+import numpy as np
+import pytest
+
+from forest import Forest
+
+sklearn_ensemble = pytest.importorskip("sklearn.ensemble")
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def load_sonar():
+    rows = np.loadtxt(os.path.join(BASE_DIR, "sonar.csv"), delimiter=",", dtype=str)
+    return rows[:, :60].astype(float), (rows[:, 60] == "M").astype(int)
+
+
+@pytest.fixture(scope="module")
+def trained():
+    X, y = load_sonar()
+    model = sklearn_ensemble.RandomForestClassifier(n_estimators=25, random_state=0).fit(X, y)
+    return model, X
+
+
+def test_forest_matches_sklearn(trained):
+    model, X = trained
+    forest = Forest.from_sklearn(model)
+    rng = np.random.default_rng(0)
+    samples = np.vstack([X, rng.uniform(0, 1, (200, X.shape[1]))])
+    np.testing.assert_allclose(forest.predict_proba(samples), model.predict_proba(samples), atol=1e-12)
+    np.testing.assert_array_equal(forest.predict(samples), model.predict(samples))
+
+
+def test_values_on_split_thresholds_go_the_same_way(trained):
+    model, X = trained
+    forest = Forest.from_sklearn(model)
+    # Put every tested feature exactly on one of its thresholds
+    samples = np.repeat(X[:20], 3, axis=0)
+    splits = np.flatnonzero(forest.left != np.arange(len(forest.left)))
+    for row, node in zip(samples, np.random.default_rng(0).choice(splits, len(samples))):
+        row[forest.feature[node]] = forest.threshold[node]
+    np.testing.assert_allclose(forest.predict_proba(samples), model.predict_proba(samples), atol=1e-12)
+
+
+def test_save_and_load(trained, tmp_path):
+    model, X = trained
+    forest = Forest.from_sklearn(model)
+    path = str(tmp_path / "forest.npz")
+    forest.save(path)
+    loaded = Forest.load(path)
+    assert loaded.depth == forest.depth
+    np.testing.assert_array_equal(loaded.predict_proba(X), forest.predict_proba(X))
+    assert forest.predict_proba(X[0]).shape == (1, 2)
+
+
+# The joblib model may come from another scikit-learn version
+@pytest.mark.filterwarnings("ignore::UserWarning")
+def test_shipped_forest_matches_shipped_model():
+    joblib = pytest.importorskip("joblib")
+    model_path = os.path.join(BASE_DIR, "sonar_model.joblib")
+    if not os.path.exists(model_path):
+        pytest.skip("no trained model")
+    model = joblib.load(model_path)
+    X, _ = load_sonar()
+    forest = Forest.load(os.path.join(BASE_DIR, "sonar_model.npz"))
+    np.testing.assert_allclose(forest.predict_proba(X), model.predict_proba(X), atol=1e-12)
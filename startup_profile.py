@@ -0,0 +1,103 @@
+"""
+Service startup time against a budget.
+
+Each service is started in a fresh interpreter with `python -X importtime`,
+the way serve.py loads it, and asked for /readyz. The report shows the time
+to import the app, the time for the first readiness check, and the slowest
+top-level imports, so a heavy module creeping back into a service's import
+path is easy to spot.
+
+    python startup_profile.py                       # every service
+    python startup_profile.py voice sonar --top 15
+    python startup_profile.py --no-key              # services must still start without GEMINI_API_KEY
+
+Exits non-zero when a service misses STARTUP_BUDGET_S (1.0 s by default).
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+from serve import ROOT, SERVICES
+
+STARTUP_BUDGET_S = float(os.getenv("STARTUP_BUDGET_S", "1.0"))
+
+CHILD = """
+import json, sys, time
+started = time.perf_counter()
+sys.path.insert(0, {root!r})
+import serve
+app = serve.load_app({name!r})
+imported = time.perf_counter()
+response = app.test_client().get("/readyz")
+print(json.dumps({{"import_s": imported - started, "ready_s": time.perf_counter() - imported,
+                  "status": response.status_code, "checks": response.get_json().get("checks")}}))
+"""
+
+
+def top_imports(importtime_log: str, count: int):
+    """Slowest top-level imports (cumulative seconds) from `-X importtime` output"""
+    imports = []
+    for line in importtime_log.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        # Nested imports are indented under the module that triggered them
+        if not name[1:].startswith(" "):
+            imports.append((int(cumulative) / 1e6, name.strip()))
+    return sorted(imports, reverse=True)[:count]
+
+
+def profile(name: str, no_key: bool = False):
+    env = dict(os.environ)
+    if no_key:
+        env.pop("GEMINI_API_KEY", None)
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", CHILD.format(root=ROOT, name=name)],
+                            capture_output=True, text=True, env=env, cwd=ROOT)
+    report = None
+    for line in reversed(result.stdout.splitlines()):
+        if line.startswith("{"):
+            report = json.loads(line)
+            break
+    if report is None:
+        errors = result.stdout.splitlines() + [
+            line for line in result.stderr.splitlines() if not line.startswith("import time:")]
+        return {"error": "\n".join(errors[-5:]) or f"exit code {result.returncode}"}, []
+    return report, result.stderr
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure service startup time")
+    parser.add_argument("services", nargs="*",
+                        help=f"Services to start: {', '.join(SERVICES)} (default: all but the gateway)")
+    parser.add_argument("--top", type=int, default=8, help="Slowest imports listed per service")
+    parser.add_argument("--no-key", action="store_true", help="Start without GEMINI_API_KEY")
+    args = parser.parse_args()
+    unknown = set(args.services) - set(SERVICES)
+    if unknown:
+        parser.error(f"unknown services: {', '.join(sorted(unknown))}")
+
+    over_budget = []
+    for name in args.services or [name for name in SERVICES if name != "gateway"]:
+        report, log = profile(name, args.no_key)
+        if "error" in report:
+            print(f"{name}: failed to start\n{report['error']}\n")
+            over_budget.append(name)
+            continue
+        total = report["import_s"] + report["ready_s"]
+        verdict = "ok" if total <= STARTUP_BUDGET_S else f"OVER the {STARTUP_BUDGET_S:.1f}s budget"
+        print(f"{name}: import {report['import_s']:.2f}s + readyz {report['ready_s']:.2f}s = {total:.2f}s ({verdict}), "
+              f"readyz {report['status']} {report['checks']}")
+        for seconds, module in top_imports(log, args.top):
+            print(f"    {seconds:6.3f}s  {module}")
+        print()
+        if total > STARTUP_BUDGET_S:
+            over_budget.append(name)
+    if over_budget:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+import time
+
+from event_bus import EventBus
+from call_dispatcher import CallDispatcher, FakeTwilioClient
+from threat_pipeline import ALERTS, ThreatPipeline
+
+
+def wait_until(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+def alert(source="cam-1"):
+    return {"source": source, "level": "HIGH", "objects": {"mines": 1},
+            "reason": "mines detected", "detected_at": time.time()}
+
+
+def test_events_reach_every_group():
+    bus = EventBus(poll_interval=0.01)
+    seen = {"a": [], "b": []}
+    bus.subscribe("topic", "a", lambda event: seen["a"].append(event["n"]))
+    bus.subscribe("topic", "b", lambda event: seen["b"].append(event["n"]))
+    for n in range(3):
+        bus.publish("topic", {"n": n})
+    assert bus.poll("topic", "a") == 3
+    assert bus.poll("topic", "b") == 3
+    assert seen == {"a": [0, 1, 2], "b": [0, 1, 2]}
+    assert bus.lag() == {"a/topic": 0, "b/topic": 0}
+
+
+def test_failing_handler_is_dead_lettered():
+    bus = EventBus(max_attempts=3, retry_delay=0.001)
+    attempts = []
+
+    def handler(event):
+        attempts.append(event["n"])
+        if event["n"] == 0:
+            raise RuntimeError("dial failed")
+
+    bus.subscribe("topic", "group", handler)
+    bus.publish("topic", {"n": 0})
+    bus.publish("topic", {"n": 1})
+    assert bus.poll("topic", "group") == 2
+    assert attempts == [0, 0, 0, 1]
+    [dead] = bus.dead_letters("group")
+    assert dead["event_id"] == 1
+    assert dead["attempts"] == 3
+    assert dead["error"] == "RuntimeError: dial failed"
+    assert bus.dead_letters("other") == []
+
+
+def test_standby_takes_over_when_owner_stops(tmp_path):
+    path = str(tmp_path / "events.db")
+    first, second = EventBus(path, poll_interval=0.01), EventBus(path, poll_interval=0.01)
+    handled = {"first": [], "second": []}
+    first.subscribe("topic", "group", lambda event: handled["first"].append(event["n"]))
+    second.subscribe("topic", "group", lambda event: handled["second"].append(event["n"]))
+    assert first.claim("topic", "group")
+    assert not second.claim("topic", "group")
+
+    first.publish("topic", {"n": 0})
+    assert second.poll("topic", "group") == 0
+    assert first.poll("topic", "group") == 1
+
+    first.stop()
+    first.publish("topic", {"n": 1})
+    assert second.poll("topic", "group") == 1
+    assert handled == {"first": [0], "second": [1]}
+
+
+def test_expired_lease_is_taken_over(tmp_path):
+    path = str(tmp_path / "events.db")
+    first = EventBus(path, lease_seconds=0.2)
+    second = EventBus(path, lease_seconds=0.2)
+    for bus in (first, second):
+        bus.subscribe("topic", "group", lambda event: None)
+    assert first.claim("topic", "group")
+    assert not second.claim("topic", "group")
+    # The first owner stops renewing without releasing the lease
+    time.sleep(0.3)
+    assert second.claim("topic", "group")
+    assert not first.claim("topic", "group")
+
+
+def test_log_only_pipeline_leaves_alerts_to_the_dispatcher(tmp_path):
+    # threat_pipeline.py without --dispatch next to emergency_call_service.py on one bus
+    path = str(tmp_path / "events.db")
+    log_bus, call_bus = EventBus(path, poll_interval=0.01), EventBus(path, poll_interval=0.01)
+    log_only = ThreatPipeline(log_bus, str(tmp_path / "reports"))
+    log_only.subscribe_alert_log()
+    client = FakeTwilioClient(latency=0)
+    dispatcher = CallDispatcher(client, "+10000000000", "http://localhost",
+                                lambda job_id, message, threat: message, calls_per_second=100)
+    calls = ThreatPipeline(call_bus, str(tmp_path / "reports"))
+    calls.subscribe_dispatcher(dispatcher, ["+15550000001"])
+    log_bus.start()
+    call_bus.start()
+    try:
+        for n in range(3):
+            log_bus.publish(ALERTS, alert(f"cam-{n}"))
+        assert wait_until(lambda: len(client.calls.created) == 3)
+        assert wait_until(lambda: len(log_only.detection_to_alert) == 3)
+    finally:
+        log_bus.stop()
+        call_bus.stop()
+    assert call_bus.dead_letters() == []
@@ -0,0 +1,70 @@
+import os
+
+from instrumentation import Histogram, MetricsStore, Registry
+
+
+def worker(directory):
+    registry = Registry()
+    registry.store = MetricsStore(registry, directory)
+    return registry, registry.counter("jobs_total", "Jobs", ("kind",)), \
+        registry.histogram("job_seconds", "Job time", buckets=(0.1, 1.0))
+
+
+def test_render_without_store():
+    registry = Registry()
+    registry.counter("jobs_total", "Jobs", ("kind",)).inc(kind="call")
+    registry.histogram("job_seconds", "Job time", buckets=(0.1, 1.0)).observe(0.5)
+    lines = registry.render().splitlines()
+    assert 'jobs_total{kind="call"} 1' in lines
+    assert 'job_seconds_bucket{le="0.1"} 0' in lines
+    assert 'job_seconds_bucket{le="1"} 1' in lines
+    assert "job_seconds_count 1" in lines
+
+
+def test_workers_report_the_service_totals(tmp_path):
+    first, first_jobs, first_seconds = worker(str(tmp_path))
+    second, second_jobs, second_seconds = worker(str(tmp_path))
+    first_jobs.inc(kind="call")
+    first_seconds.observe(0.05)
+    second_jobs.inc(2, kind="call")
+    second_jobs.inc(kind="sms")
+    second_seconds.observe(5)
+    first.store.flush()
+    second.store.flush()
+    # Values recorded after the last flush are live in the answering worker only
+    first_jobs.inc(kind="call")
+
+    lines = first.render().splitlines()
+    assert 'jobs_total{kind="call"} 4' in lines
+    assert 'jobs_total{kind="sms"} 1' in lines
+    assert 'job_seconds_bucket{le="0.1"} 1' in lines
+    assert 'job_seconds_bucket{le="+Inf"} 2' in lines
+    assert "job_seconds_sum 5.05" in lines
+    assert 'jobs_total{kind="call"} 3' in second.render().splitlines()
+
+
+def test_forked_worker_starts_from_zero(tmp_path):
+    registry, jobs, _ = worker(str(tmp_path))
+    jobs.inc(kind="call")
+    registry.store.flush()
+    parent_path = registry.store.path
+    # What os.register_at_fork runs in the child, minus the flush thread
+    registry.store.start = lambda: None
+    registry.store.after_fork()
+    assert registry.store.path != parent_path
+    jobs.inc(kind="call")
+    registry.store.flush()
+    assert len([name for name in os.listdir(tmp_path) if name.endswith(".json")]) == 2
+    assert 'jobs_total{kind="call"} 2' in registry.render().splitlines()
+
+
+def test_summary_since():
+    histogram = Histogram("stage_seconds", "Stages", ("stage",))
+    histogram.observe(1.0, stage="decode")
+    before = histogram.summary()
+    histogram.observe(3.0, stage="decode")
+    histogram.observe(2.0, stage="infer")
+    assert histogram.summary(since=before) == {
+        ("decode",): {"count": 1, "sum": 3.0, "mean": 3.0},
+        ("infer",): {"count": 1, "sum": 2.0, "mean": 2.0},
+    }
@@ -0,0 +1,114 @@
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+torch = pytest.importorskip("torch")
+pytest.importorskip("transformers")
+
+from llama_engine import ContinuousBatchingEngine, HFModelRunner, _tiny_model
+
+EOS = 255
+
+
+@pytest.fixture(scope="module")
+def model():
+    return _tiny_model()
+
+
+def sequential(model, prompts, max_new):
+    outputs = []
+    for prompt, n in zip(prompts, max_new):
+        out = model.generate(torch.tensor([prompt]), max_new_tokens=n, do_sample=False,
+                             eos_token_id=EOS, pad_token_id=0)
+        outputs.append(out[0, len(prompt):].tolist())
+    return outputs
+
+
+def concurrent(engine, prompts, max_new):
+    with ThreadPoolExecutor(max_workers=len(prompts)) as pool:
+        return list(pool.map(lambda args: engine.generate(args[0], max_new_tokens=args[1]),
+                             zip(prompts, max_new)))
+
+
+def wait_until(condition, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+def test_batched_generation_matches_sequential(model):
+    rng = random.Random(0)
+    prompts = [[rng.randrange(1, 250) for _ in range(rng.randint(4, 30))] for _ in range(8)]
+    max_new = [rng.randint(4, 16) for _ in prompts]
+    engine = ContinuousBatchingEngine(HFModelRunner(model), eos_token_ids=[EOS], max_batch_size=4)
+    try:
+        assert concurrent(engine, prompts, max_new) == sequential(model, prompts, max_new)
+    finally:
+        engine.shutdown()
+    metrics = engine.metrics()
+    assert metrics["mean_batch_size"] > 1
+    assert metrics["queue_depth"] == 0
+
+
+def test_registered_prefix_is_reused(model):
+    rng = random.Random(1)
+    prefix = [rng.randrange(1, 250) for _ in range(40)]
+    prompts = [prefix + [rng.randrange(1, 250) for _ in range(rng.randint(1, 8))] for _ in range(6)]
+    max_new = [8] * len(prompts)
+    engine = ContinuousBatchingEngine(HFModelRunner(model), eos_token_ids=[EOS], max_batch_size=8)
+    try:
+        engine.register_prefix(prefix)
+        wait_until(lambda: tuple(prefix) in engine.prefixes)
+        assert concurrent(engine, prompts, max_new) == sequential(model, prompts, max_new)
+    finally:
+        engine.shutdown()
+    metrics = engine.metrics()
+    assert metrics["prefix_hits"] == len(prompts)
+    assert metrics["prefix_tokens_reused"] == len(prefix) * len(prompts)
+
+
+def test_evicted_prefix_can_be_registered_again(model):
+    first, second = tuple(range(1, 21)), tuple(range(21, 41))
+    engine = ContinuousBatchingEngine(HFModelRunner(model), eos_token_ids=[EOS], max_prefixes=1)
+    try:
+        engine.register_prefix(first)
+        wait_until(lambda: first in engine.prefixes)
+        engine.register_prefix(second)
+        wait_until(lambda: second in engine.prefixes)
+        assert first not in engine.prefixes
+        # A cached prefix is not queued again; an evicted one is re-encoded
+        engine.register_prefix(second)
+        assert engine.pending_prefixes == []
+        engine.register_prefix(first)
+        wait_until(lambda: first in engine.prefixes)
+        assert second not in engine.prefixes
+        assert engine.generate(list(first) + [50], max_new_tokens=3) == \
+            sequential(model, [list(first) + [50]], [3])[0]
+    finally:
+        engine.shutdown()
+    assert engine.metrics()["prefix_hits"] == 1
+
+
+def test_prefix_that_failed_to_encode_can_be_registered_again(model):
+    class FlakyRunner(HFModelRunner):
+        failures = 1
+
+        def encode_prefix(self, prefix_ids):
+            if self.failures:
+                self.failures -= 1
+                raise RuntimeError("out of memory")
+            return super().encode_prefix(prefix_ids)
+
+    prefix = tuple(range(1, 11))
+    engine = ContinuousBatchingEngine(FlakyRunner(model), eos_token_ids=[EOS])
+    try:
+        engine.register_prefix(prefix)
+        wait_until(lambda: engine.runner.failures == 0 and not engine.encoding_prefixes)
+        assert prefix not in engine.prefixes
+        engine.register_prefix(prefix)
+        wait_until(lambda: prefix in engine.prefixes)
+    finally:
+        engine.shutdown()